@@ -0,0 +1,230 @@
+"""
+API HTTP/JSON do CarFlow (ASGI puro, sem framework), separada do Streamlit:
+
+    uvicorn src.api:app --host 0.0.0.0 --port 8000 --workers 4
+
+Cada worker tem seu próprio serviço, cache de leitura e fila de logs. As
+respostas levam ETag derivado da versão dos dados publicada pelo batch:
+um If-None-Match igual volta 304 sem tocar no banco.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from src.cache import DataVersion, DataVersionListener, RepositoryCache
+from src.database import DATABASE_URL, READ_DATABASE_URL, ReadSessionLocal, SessionLocal, engine
+from src.log_sink import QueryLogSink
+from src.models import NATIONAL_REGION
+from src.services import ScopedCarService
+
+# Respostas menores que isso não compensam o gzip
+GZIP_MIN_SIZE = 500
+
+# Maior valor de uma coluna INTEGER (ids, ano, month_key): acima disso o
+# driver do banco levanta OverflowError em vez de não achar nada
+MAX_DB_INT = 2**31 - 1
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _int_param(params: Dict[str, str], name: str, required: bool = False) -> Optional[int]:
+    value = params.get(name)
+    if value is None or value == "":
+        if required:
+            raise HTTPError(400, f"Parâmetro obrigatório: {name}")
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        raise HTTPError(400, f"Parâmetro inválido: {name}")
+    if abs(number) > MAX_DB_INT:
+        raise HTTPError(400, f"Parâmetro inválido: {name}")
+    return number
+
+
+def _path_id(match: Dict[str, str], name: str) -> int:
+    # Id fora da faixa do banco não existe
+    value = int(match[name])
+    if value > MAX_DB_INT:
+        raise HTTPError(404, "Rota não encontrada")
+    return value
+
+
+# --- Rotas ---
+
+def _brands(service, match, params):
+    return service.list_brands()
+
+
+def _models(service, match, params):
+    return service.list_models(_path_id(match, "brand_id"))
+
+
+def _years(service, match, params):
+    return service.list_years(_path_id(match, "model_id"))
+
+
+def _regions(service, match, params):
+    return service.list_regions()
+
+
+def _prices(service, match, params):
+    # Sem região = média nacional (como no app); None misturaria todas as regiões
+    result = service.get_consolidated_price(
+        brand_id=_int_param(params, "brand_id", required=True),
+        model_id=_int_param(params, "model_id", required=True),
+        year_model=_int_param(params, "year_model", required=True),
+        region=params.get("region") or NATIONAL_REGION,
+        since=_int_param(params, "since"),
+        until=_int_param(params, "until"),
+        last_n_months=_int_param(params, "last_n_months"),
+    )
+    if result is None:
+        raise HTTPError(404, "Sem dados para o veículo/região")
+
+    return {
+        "current_price": result["current_price"],
+        "current_month": result["current_month"],
+        "samples": result["samples"],
+        "history": [
+            {"month_ref": row["Mês"], "avg_price": row["Preço Médio"], "samples_count": row["Amostras"]}
+            for row in result["history_df"].to_dict(orient="records")
+        ],
+    }
+
+
+ROUTES = [
+    (re.compile(r"^/brands$"), _brands),
+    (re.compile(r"^/brands/(?P<brand_id>\d+)/models$"), _models),
+    (re.compile(r"^/models/(?P<model_id>\d+)/years$"), _years),
+    (re.compile(r"^/regions$"), _regions),
+    (re.compile(r"^/prices$"), _prices),
+]
+
+
+def _etag(version: int, path: str, query: str) -> str:
+    digest = hashlib.sha1(f"{path}?{query}".encode("utf-8")).hexdigest()[:16]
+    return f'"v{version}-{digest}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+class CarFlowAPI:
+    """
+    Aplicação ASGI. `service` e `data_version` podem ser injetados (testes);
+    por padrão são criados no startup (lifespan) ou na primeira requisição.
+    """
+
+    def __init__(self, service=None, data_version: Optional[DataVersion] = None, gzip_min_size: int = GZIP_MIN_SIZE):
+        self.service = service
+        self.data_version = data_version
+        self.gzip_min_size = gzip_min_size
+        self._log_sink: Optional[QueryLogSink] = None
+        self._listener: Optional[DataVersionListener] = None
+        self._startup_lock = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+            # Serviço e versão são síncronos (SQLAlchemy): rodam fora do event loop
+            status, response_headers, body = await asyncio.get_running_loop().run_in_executor(
+                None, self.handle, scope["method"], scope["path"], scope["query_string"].decode("latin-1"), headers
+            )
+            await send({"type": "http.response.start", "status": status, "headers": response_headers})
+            await send({"type": "http.response.body", "body": body})
+
+    def handle(self, method: str, path: str, query: str, headers: Dict[str, str]) -> Tuple[int, Headers, bytes]:
+        """Processa uma requisição e devolve (status, headers, corpo)."""
+        if self.service is None:
+            self.startup()
+
+        try:
+            if method not in ("GET", "HEAD"):
+                raise HTTPError(405, "Método não permitido")
+
+            for pattern, route in ROUTES:
+                match = pattern.match(path)
+                if match:
+                    break
+            else:
+                raise HTTPError(404, "Rota não encontrada")
+
+            etag = _etag(self.data_version.current(), path, query)
+            cache_headers = [(b"etag", etag.encode()), (b"cache-control", b"no-cache")]
+            if _etag_matches(headers.get("if-none-match"), etag):
+                # Dado não mudou desde a versão do cliente: nada de banco
+                return 304, cache_headers, b""
+
+            params = {k: v[-1] for k, v in parse_qs(query).items()}
+            payload = route(self.service, match.groupdict(), params)
+            status, body, extra_headers = 200, payload, cache_headers
+        except HTTPError as e:
+            status, body, extra_headers = e.status, {"error": e.message}, []
+
+        return self._json_response(status, body, extra_headers, headers.get("accept-encoding", ""), method)
+
+    def _json_response(self, status: int, payload: Any, extra_headers: Headers, accept_encoding: str, method: str):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        response_headers = [(b"content-type", b"application/json; charset=utf-8"), (b"vary", b"Accept-Encoding")]
+        response_headers += extra_headers
+
+        if len(body) >= self.gzip_min_size and "gzip" in accept_encoding:
+            body = gzip.compress(body, compresslevel=6)
+            response_headers.append((b"content-encoding", b"gzip"))
+
+        response_headers.append((b"content-length", str(len(body)).encode()))
+        return status, response_headers, b"" if method == "HEAD" else body
+
+    def startup(self):
+        """Cria serviço, cache e fila de logs do worker (uma vez por processo)."""
+        with self._startup_lock:
+            if self.service is None:
+                self._create_dependencies()
+
+    def _create_dependencies(self):
+        self._log_sink = QueryLogSink(SessionLocal).start()
+        # Leituras (e a versão dos dados) na réplica, se houver; logs no primário
+        cache = RepositoryCache(DataVersion(ReadSessionLocal))
+        if DATABASE_URL.startswith("postgresql"):
+            self._listener = DataVersionListener(cache, engine, use_payload=not READ_DATABASE_URL).start()
+        self.data_version = cache.data_version
+        self.service = ScopedCarService(ReadSessionLocal, log_sink=self._log_sink, cache=cache)
+
+    def shutdown(self):
+        if self._listener is not None:
+            self._listener.stop()
+        if self._log_sink is not None:
+            self._log_sink.close()
+
+    async def _lifespan(self, receive: Callable, send: Callable):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+app = CarFlowAPI()
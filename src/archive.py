@@ -0,0 +1,320 @@
+import sys
+import os
+
+# Adiciona a raiz do projeto ao PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse  # noqa: E402
+import re  # noqa: E402
+import shutil  # noqa: E402
+import time  # noqa: E402
+from datetime import datetime  # noqa: E402
+from pathlib import Path  # noqa: E402
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple  # noqa: E402
+import pandas as pd  # noqa: E402
+import pyarrow as pa  # noqa: E402
+import pyarrow.dataset as ds  # noqa: E402
+import pyarrow.parquet as pq  # noqa: E402
+from sqlalchemy import delete, func, select, text  # noqa: E402
+from sqlalchemy.engine import Connection  # noqa: E402
+from src.batch_etl import BATCH_NAME, WATERMARK_LAG_IDS  # noqa: E402
+from src.database import engine  # noqa: E402
+from src.models import ArchivedMonth, BatchState, Model, PriceCollection  # noqa: E402
+from src.partitions import DEFAULT_PARTITION, PARTITIONED_TABLE, is_partitioned, list_month_partitions, partition_name  # noqa: E402
+from src.periods import month_key_to_ref, ref_to_month_key, shift_month_key, to_month_key  # noqa: E402
+
+# Raiz do arquivo frio (month_key=YYYYMM/brand_id=N/*.parquet)
+ARCHIVE_DIR = os.getenv("CARFLOW_ARCHIVE_DIR", "archive/price_collections")
+
+# Meses anteriores ao atual que ficam sempre na tabela quente
+HOT_MONTHS = 12
+
+# Linhas lidas do banco por arquivo Parquet escrito
+ARCHIVE_CHUNK_ROWS = 100000
+
+PARQUET_COMPRESSION = "zstd"
+
+# Ids abaixo da marca d'água do batch que ainda não contam como consolidados
+# (a janela que o incremental relê). Um banco com menos coletas consolidadas
+# que isso não fecha mês nenhum; com a ingestão parada, 0 é seguro.
+ARCHIVE_LAG_IDS = int(os.getenv("CARFLOW_ARCHIVE_LAG_IDS", str(WATERMARK_LAG_IDS)))
+
+ARCHIVE_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("brand_id", pa.int32()),
+    ("model_id", pa.int32()),
+    ("year_model", pa.int32()),
+    ("price", pa.float64()),
+    ("region", pa.string()),
+    ("collected_at", pa.timestamp("us", tz="UTC")),
+    ("month_key", pa.int32()),
+    ("source_id", pa.string()),
+    ("content_hash", pa.int64()),
+])
+
+# Partição física do arquivo: diretórios no formato hive
+PARTITIONING = ds.partitioning(
+    pa.schema([("month_key", pa.int32()), ("brand_id", pa.int32())]), flavor="hive"
+)
+
+_MONTH_DIR = re.compile(r"^month_key=(\d{6})$")
+
+
+def archived_months(archive_dir: str = ARCHIVE_DIR) -> List[int]:
+    """Meses já presentes no arquivo (pelos diretórios, sem abrir os Parquets)."""
+    root = Path(archive_dir)
+    if not root.is_dir():
+        return []
+    return sorted(int(m.group(1)) for m in (_MONTH_DIR.match(p.name) for p in root.iterdir()) if m)
+
+
+def month_dir(archive_dir: str, month_key: int) -> Path:
+    return Path(archive_dir) / f"month_key={month_key}"
+
+
+def archive_locations(connection: Connection, archive_dir: Optional[str] = None) -> Dict[int, str]:
+    """
+    Onde está cada mês arquivado: o diretório registrado em archived_months
+    ou, se informado, `archive_dir` (arquivo movido de lugar). Com
+    `archive_dir`, meses que só existem no diretório (arquivados antes do
+    registro no banco) entram também.
+    """
+    locations = {
+        month_key: archive_dir or registered
+        for month_key, registered in connection.execute(select(ArchivedMonth.month_key, ArchivedMonth.archive_dir))
+    }
+    if archive_dir:
+        locations.update({month_key: archive_dir for month_key in archived_months(archive_dir)})
+    return locations
+
+
+def read_archive(
+    archive_dir: str = ARCHIVE_DIR,
+    month_keys: Optional[Sequence[int]] = None,
+    columns: Optional[Sequence[str]] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Lê as coletas arquivadas em lotes (um DataFrame por lote de registros).
+    O filtro por `month_keys` poda os diretórios: só os meses pedidos são
+    abertos. `columns` limita as colunas lidas (formato colunar).
+    """
+    if not archived_months(archive_dir):
+        return
+    dataset = ds.dataset(archive_dir, format="parquet", partitioning=PARTITIONING)
+    month_filter = ds.field("month_key").isin(list(month_keys)) if month_keys is not None else None
+    for batch in dataset.to_batches(columns=list(columns) if columns else None, filter=month_filter):
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def _closed_watermark(connection: Connection, lag_ids: Optional[int] = None) -> int:
+    """
+    Maior id que o batch já consolidou com certeza: a marca d'água menos
+    `lag_ids` (padrão ARCHIVE_LAG_IDS; abaixo dessa janela um commit
+    atrasado já não é esperado).
+    """
+    watermark = connection.execute(
+        select(BatchState.last_collection_id).where(BatchState.name == BATCH_NAME)
+    ).scalar()
+    return (watermark or 0) - (ARCHIVE_LAG_IDS if lag_ids is None else lag_ids)
+
+
+def closed_months(connection: Connection, before_month_key: int, lag_ids: Optional[int] = None) -> List[int]:
+    """
+    Meses anteriores a `before_month_key` cujas coletas já foram todas
+    consolidadas pelo batch (maior id do mês <= _closed_watermark).
+    """
+    watermark = _closed_watermark(connection, lag_ids)
+    if watermark <= 0:
+        return []
+    stmt = (
+        select(PriceCollection.month_key)
+        .where(PriceCollection.month_key < before_month_key)
+        .group_by(PriceCollection.month_key)
+        .having(func.max(PriceCollection.id) <= watermark)
+        .order_by(PriceCollection.month_key)
+    )
+    return list(connection.execute(stmt).scalars())
+
+
+def _lock_month(connection: Connection, month_key: int):
+    """
+    Bloqueia escritas no mês até o fim da transação (leituras seguem). O
+    LOCK espera as transações que já escrevem nele: depois dele, todas as
+    coletas do mês estão commitadas e visíveis. Fora do Postgres (SQLite)
+    não há escrita concorrente.
+    """
+    if connection.dialect.name != "postgresql":
+        return
+    if not is_partitioned(connection):
+        table = PARTITIONED_TABLE
+    elif month_key in list_month_partitions(connection):
+        table = partition_name(month_key)
+    else:
+        table = DEFAULT_PARTITION
+    connection.execute(text(f'LOCK TABLE "{table}" IN EXCLUSIVE MODE'))
+
+
+def _still_closed(connection: Connection, month_key: int, lag_ids: Optional[int] = None) -> bool:
+    """Confere, já sob o lock, que nenhuma coleta nova entrou no mês."""
+    max_id = connection.execute(
+        select(func.max(PriceCollection.id)).where(PriceCollection.month_key == month_key)
+    ).scalar()
+    return max_id is not None and max_id <= _closed_watermark(connection, lag_ids)
+
+
+def _month_frames(connection: Connection, month_key: int, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    # Outer join: coleta de modelo removido também é arquivada (brand_id nulo)
+    stmt = (
+        select(
+            PriceCollection.id, Model.brand_id, PriceCollection.model_id, PriceCollection.year_model,
+            PriceCollection.price, PriceCollection.region, PriceCollection.collected_at,
+            PriceCollection.month_key, PriceCollection.source_id, PriceCollection.content_hash,
+        )
+        .outerjoin(Model, Model.id == PriceCollection.model_id)
+        .where(PriceCollection.month_key == month_key)
+        .order_by(PriceCollection.id)
+    )
+    result = connection.execution_options(yield_per=chunk_rows).execute(stmt)
+    for rows in result.partitions(chunk_rows):
+        frame = pd.DataFrame(rows, columns=ARCHIVE_SCHEMA.names)
+        frame["collected_at"] = pd.to_datetime(frame["collected_at"], utc=True)
+        yield frame
+
+
+def _write_frame(frame: pd.DataFrame, root: Path, index: int):
+    pq.write_to_dataset(
+        pa.Table.from_pandas(frame[ARCHIVE_SCHEMA.names], schema=ARCHIVE_SCHEMA, preserve_index=False),
+        str(root),
+        partitioning=PARTITIONING,
+        basename_template=f"part-{index}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        compression=PARQUET_COMPRESSION,
+    )
+
+
+def export_month(connection: Connection, month_key: int, archive_dir: str = ARCHIVE_DIR, chunk_rows: int = ARCHIVE_CHUNK_ROWS) -> Tuple[int, int]:
+    """
+    Grava as coletas do mês em Parquet comprimido, um diretório por marca,
+    e devolve (linhas novas gravadas, maior id gravado).
+
+    Se o mês já estava arquivado (coletas que chegaram depois), o arquivo
+    antigo é regravado junto com as novas, sem repetir ids. A escrita vai
+    para um diretório temporário e só substitui o mês no final.
+    """
+    root = Path(archive_dir)
+    target = month_dir(archive_dir, month_key)
+    staging = root / f".staging-{month_key}"
+    if staging.exists():
+        shutil.rmtree(staging)
+
+    index = 0
+    archived_ids = set()
+    for frame in read_archive(archive_dir, [month_key]):
+        archived_ids.update(frame["id"].tolist())
+        _write_frame(frame, staging, index)
+        index += 1
+
+    written = max_id = 0
+    for frame in _month_frames(connection, month_key, chunk_rows):
+        max_id = max(max_id, int(frame["id"].max()))
+        frame = frame[~frame["id"].isin(archived_ids)]
+        if frame.empty:
+            continue
+        _write_frame(frame, staging, index)
+        index += 1
+        written += len(frame)
+
+    if index:
+        if target.exists():
+            shutil.rmtree(target)
+        (staging / target.name).rename(target)
+    if staging.exists():
+        shutil.rmtree(staging)
+    return written, max_id
+
+
+def _remove_month(connection: Connection, month_key: int, max_id: int) -> int:
+    """Tira o mês da tabela quente: DROP da partição (Postgres) ou DELETE."""
+    if is_partitioned(connection) and month_key in list_month_partitions(connection):
+        name = partition_name(month_key)
+        connection.execute(text(f'ALTER TABLE "{PARTITIONED_TABLE}" DETACH PARTITION "{name}"'))
+        connection.execute(text(f'DROP TABLE "{name}"'))
+        return 0
+    # Só o que foi exportado (coletas do mês que chegarem depois ficam)
+    result = connection.execute(
+        delete(PriceCollection).where(PriceCollection.month_key == month_key, PriceCollection.id <= max_id)
+    )
+    return result.rowcount
+
+
+def _record_archived(connection: Connection, month_key: int, archive_dir: str):
+    """Registra o mês em archived_months (lido pelo batch e pela ingestão)."""
+    connection.execute(delete(ArchivedMonth).where(ArchivedMonth.month_key == month_key))
+    connection.execute(ArchivedMonth.__table__.insert().values(month_key=month_key, archive_dir=archive_dir))
+
+
+def archive_months(before_month_key: int, archive_dir: str = ARCHIVE_DIR, chunk_rows: int = ARCHIVE_CHUNK_ROWS, dry_run: bool = False, lag_ids: Optional[int] = None) -> List[Tuple[int, int]]:
+    """
+    Arquiva os meses fechados (anteriores a `before_month_key` e já
+    consolidados): exporta cada mês para Parquet, o remove da tabela
+    quente e o registra em archived_months, tudo em uma transação com as
+    escritas no mês bloqueadas. Um mês que recebeu coletas depois de
+    closed_months é pulado. `lag_ids` sobrepõe ARCHIVE_LAG_IDS. Retorna
+    [(month_key, linhas arquivadas)].
+    """
+    with engine.begin() as connection:
+        # Meses arquivados antes de existir o registro no banco
+        registered = set(connection.execute(select(ArchivedMonth.month_key)).scalars())
+        if not dry_run:
+            for month_key in set(archived_months(archive_dir)) - registered:
+                _record_archived(connection, month_key, archive_dir)
+        months = closed_months(connection, before_month_key, lag_ids)
+        if _closed_watermark(connection, lag_ids) <= 0:
+            lag = ARCHIVE_LAG_IDS if lag_ids is None else lag_ids
+            print(
+                f"Nenhum mês fechado: a marca d'água do batch ainda não passa da janela de {lag} ids "
+                f"(--lag-ids / CARFLOW_ARCHIVE_LAG_IDS)."
+            )
+
+    archived = []
+    for month_key in months:
+        if dry_run:
+            print(f"  {month_key_to_ref(month_key)}: seria arquivado")
+            continue
+
+        started = time.perf_counter()
+        with engine.begin() as connection:
+            # closed_months rodou antes, sem lock: confere de novo já bloqueado
+            _lock_month(connection, month_key)
+            if not _still_closed(connection, month_key, lag_ids):
+                print(f"  {month_key_to_ref(month_key)}: coletas novas desde a última consolidação, mês não arquivado")
+                continue
+            written, max_id = export_month(connection, month_key, archive_dir, chunk_rows)
+            _remove_month(connection, month_key, max_id)
+            _record_archived(connection, month_key, archive_dir)
+
+        print(f"  {month_key_to_ref(month_key)}: {written} coletas arquivadas em {time.perf_counter() - started:.1f}s")
+        archived.append((month_key, written))
+    return archived
+
+
+if __name__ == "__main__":
+    default_before = month_key_to_ref(shift_month_key(to_month_key(datetime.now()), -HOT_MONTHS))
+    parser = argparse.ArgumentParser(description="Arquiva coletas de meses fechados em Parquet (tira da tabela quente)")
+    parser.add_argument("--before", default=default_before, metavar="YYYY-MM", help=f"Arquiva meses anteriores a este (padrão: {default_before})")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR, help="Diretório raiz do arquivo Parquet")
+    parser.add_argument("--dry-run", action="store_true", help="Só lista os meses que seriam arquivados")
+    parser.add_argument(
+        "--lag-ids", type=int, default=ARCHIVE_LAG_IDS,
+        help=(
+            "Um mês só fecha quando seu maior id está ao menos N ids abaixo da marca d'água do batch "
+            f"(commits fora de ordem; padrão: {ARCHIVE_LAG_IDS}, CARFLOW_ARCHIVE_LAG_IDS). Com menos de N "
+            "coletas consolidadas nada é arquivado; com a ingestão parada, 0 é seguro"
+        ),
+    )
+    args = parser.parse_args()
+
+    print(f"Arquivando coletas anteriores a {args.before} em {args.archive_dir}...")
+    result = archive_months(ref_to_month_key(args.before), args.archive_dir, dry_run=args.dry_run, lag_ids=args.lag_ids)
+    print(f"Arquivamento finalizado: {len(result)} meses, {sum(count for _, count in result)} coletas.")
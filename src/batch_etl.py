@@ -4,89 +4,418 @@ import os
 # Adiciona a raiz do projeto ao PYTHONPATH
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from sqlalchemy import func, select  # noqa: E402
-from src.database import SessionLocal  # noqa: E402
-from src.models import PriceCollection, MonthlyAverage, Model  # noqa: E402
+import argparse  # noqa: E402
+import time  # noqa: E402
+from concurrent.futures import ProcessPoolExecutor, as_completed  # noqa: E402
+from typing import Dict, List, Optional, Sequence, Tuple  # noqa: E402
+import pandas as pd  # noqa: E402
+from sqlalchemy import case, func, select, tuple_  # noqa: E402
+from sqlalchemy.dialects import postgresql, sqlite  # noqa: E402
+from src.database import SessionLocal, engine  # noqa: E402
+from src.models import PriceCollection, MonthlyAverage, Model, BatchState, NATIONAL_REGION  # noqa: E402
+from src.periods import month_key_to_ref  # noqa: E402
+from src.cache import DATA_VERSION_CHANNEL  # noqa: E402
 
-def run_monthly_batch():
+# Nome do registro de controle (marca d'água) em batch_state
+BATCH_NAME = "monthly_averages"
+
+# Linhas por lote de upsert: limita a memória e o número de round trips
+UPSERT_CHUNK_SIZE = 500
+
+# Ids abaixo da marca d'água que todo incremental relê. No Postgres os ids
+# saem da sequence na ordem do nextval, não do commit: uma transação longa
+# (ex: um bloco de COPY da ingestão) pode commitar depois do batch com ids
+# menores que o max_id já gravado. O upsert é idempotente, então reler a
+# janela só custa reagregar os grupos tocados por ela.
+WATERMARK_LAG_IDS = int(os.getenv("BATCH_WATERMARK_LAG_IDS", "100000"))
+
+# Colunas gravadas em monthly_averages
+RESULT_FIELDS = ("brand_id", "model_id", "year_model", "region", "month_key", "month_ref", "avg_price", "samples_count")
+
+# Chave das linhas nacionais (todas as regiões de um modelo/ano/mês)
+NATIONAL_KEY = ["brand_id", "model_id", "year_model", "month_key", "month_ref"]
+
+def _upsert_monthly_averages(db, rows):
+    """
+    Grava um lote de médias com um único INSERT ... ON CONFLICT DO UPDATE
+    sobre a chave natural (model_id, year_model, region, month_key).
+    """
+    dialect_insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+
+    stmt = dialect_insert(MonthlyAverage).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["model_id", "year_model", "region", "month_key"],
+        set_={
+            "brand_id": stmt.excluded.brand_id,
+            "avg_price": stmt.excluded.avg_price,
+            "samples_count": stmt.excluded.samples_count,
+        },
+    )
+    db.execute(stmt)
+
+def _build_aggregation(
+    last_id: int,
+    max_id: int,
+    month_key: Optional[int] = None,
+    rollup_in_sql: bool = False,
+    month_keys: Optional[Sequence[int]] = None,
+    exclude_month_keys: Sequence[int] = (),
+):
+    """
+    Monta a query de agregação sobre as coletas com id <= max_id.
+    Com last_id > 0 (incremental) restringe aos grupos tocados por coletas
+    novas; com month_key restringe a uma única partição (mês).
+
+    `month_keys` (meses tocados, em literais) permite ao Postgres podar as
+    partições mensais de price_collections já no planejamento: o filtro por
+    grupos tocados sozinho é um semi-join e varreria todos os meses.
+    `exclude_month_keys` tira meses da varredura (os arquivados em Parquet,
+    reagregados à parte).
+
+    Agrupa pela coluna indexada price_collections.month_key (YYYYMM), o que
+    funciona igual em Postgres e SQLite.
+
+    Com rollup_in_sql=True (Postgres) a mesma varredura também produz as
+    linhas nacionais via GROUPING SETS; senão o resultado sai ordenado por
+    (modelo, ano, mês) para o rollup em pandas.
+    """
+    if rollup_in_sql:
+        # Na linha do rollup nacional a região vem agrupada (NULL) -> "Nacional"
+        region_expr = case(
+            (func.grouping(PriceCollection.region) == 1, NATIONAL_REGION),
+            else_=PriceCollection.region,
+        )
+    else:
+        region_expr = PriceCollection.region
+
+    stmt = (
+        select(
+            Model.brand_id,
+            PriceCollection.model_id,
+            PriceCollection.year_model,
+            region_expr.label("region"),
+            PriceCollection.month_key,
+            func.avg(PriceCollection.price).label("avg_price"),
+            func.count(PriceCollection.id).label("samples_count")
+        )
+        .join(Model, Model.id == PriceCollection.model_id)
+        .where(PriceCollection.id <= max_id)
+    )
+
+    if rollup_in_sql:
+        stmt = stmt.group_by(
+            func.grouping_sets(
+                tuple_(Model.brand_id, PriceCollection.model_id, PriceCollection.year_model, PriceCollection.region, PriceCollection.month_key),
+                tuple_(Model.brand_id, PriceCollection.model_id, PriceCollection.year_model, PriceCollection.month_key),
+            )
+        )
+    else:
+        stmt = stmt.group_by(
+            Model.brand_id,
+            PriceCollection.model_id,
+            PriceCollection.year_model,
+            PriceCollection.region,
+            PriceCollection.month_key
+        ).order_by(
+            PriceCollection.model_id,
+            PriceCollection.year_model,
+            PriceCollection.month_key
+        )
+
+    if month_key is not None:
+        stmt = stmt.where(PriceCollection.month_key == month_key)
+    elif month_keys is not None:
+        stmt = stmt.where(PriceCollection.month_key.in_(month_keys))
+
+    if exclude_month_keys:
+        stmt = stmt.where(PriceCollection.month_key.not_in(sorted(exclude_month_keys)))
+
+    if last_id:
+        # Incremental: apenas os grupos tocados por coletas novas são
+        # recalculados (com todas as coletas do grupo, antigas e novas).
+        # O grupo é (modelo, ano, mês), sem a região, para que a média
+        # nacional seja refeita com todas as regiões do mês.
+        group_key = (
+            PriceCollection.model_id,
+            PriceCollection.year_model,
+            PriceCollection.month_key,
+        )
+        touched_groups = (
+            select(*group_key)
+            .where(PriceCollection.id > last_id, PriceCollection.id <= max_id)
+            .distinct()
+        )
+        stmt = stmt.where(tuple_(*group_key).in_(touched_groups))
+
+    return stmt
+
+def _as_rows(chunk) -> List[dict]:
+    """Converte um lote da agregação (mês em YYYYMM) para linhas de monthly_averages."""
+    rows = []
+    for brand_id, model_id, year_model, region, month_key, avg_price, samples_count in chunk:
+        rows.append({
+            "brand_id": brand_id,
+            "model_id": model_id,
+            "year_model": year_model,
+            "region": region,
+            "month_key": month_key,
+            "month_ref": month_key_to_ref(month_key),
+            "avg_price": avg_price,
+            "samples_count": samples_count,
+        })
+    return rows
+
+def _national_rollup(df: pd.DataFrame) -> pd.DataFrame:
+    """Médias nacionais a partir das regionais, ponderadas pelo nº de amostras."""
+    totals = (
+        df.assign(price_total=df["avg_price"] * df["samples_count"])
+        .groupby(NATIONAL_KEY, as_index=False, sort=False)[["price_total", "samples_count"]]
+        .sum()
+    )
+    totals["avg_price"] = totals["price_total"] / totals["samples_count"]
+    totals["region"] = NATIONAL_REGION
+    return totals[list(RESULT_FIELDS)]
+
+def _with_national_rollup(batches):
+    """
+    Fallback sem GROUPING SETS: acrescenta a cada lote as linhas nacionais
+    calculadas em pandas. Os lotes chegam ordenados por (modelo, ano, mês),
+    então só o último grupo de um lote pode continuar no próximo: ele fica
+    pendente até fechar.
+    """
+    pending = None
+    for rows in batches:
+        df = pd.DataFrame(rows, columns=RESULT_FIELDS)
+        if pending is not None:
+            df = pd.concat([pending, df], ignore_index=True)
+
+        in_last_group = (df[NATIONAL_KEY] == df[NATIONAL_KEY].iloc[-1]).all(axis=1)
+        pending = df[in_last_group]
+
+        # astype(object) devolve escalares Python (os drivers não aceitam numpy)
+        yield rows + _national_rollup(df[~in_last_group]).astype(object).to_dict("records")
+
+    if pending is not None:
+        yield _national_rollup(pending).astype(object).to_dict("records")
+
+def _consolidate(
+    db,
+    last_id: int,
+    max_id: int,
+    month_key: Optional[int] = None,
+    month_keys: Optional[Sequence[int]] = None,
+    exclude_month_keys: Sequence[int] = (),
+) -> int:
+    """Executa a agregação e grava o resultado em lotes. Retorna o nº de métricas."""
+    rollup_in_sql = db.get_bind().dialect.name == "postgresql"
+    stmt = _build_aggregation(last_id, max_id, month_key, rollup_in_sql, month_keys, exclude_month_keys)
+
+    # Streaming do resultado em lotes: a memória fica em O(lote) e cada
+    # lote vira um único upsert set-based (sem carregar monthly_averages)
+    result = db.execute(stmt.execution_options(yield_per=UPSERT_CHUNK_SIZE))
+    batches = (_as_rows(chunk) for chunk in result.partitions(UPSERT_CHUNK_SIZE))
+
+    if not rollup_in_sql:
+        batches = _with_national_rollup(batches)
+
+    total = 0
+    for rows in batches:
+        _upsert_monthly_averages(db, rows)
+        total += len(rows)
+    return total
+
+def _consolidate_archived(db, locations: Dict[int, str], month_keys: Sequence[int], max_id: int) -> int:
+    """
+    Reagrega meses arquivados em Parquet (src/archive.py), um mês por vez:
+    coletas do arquivo (diretório de cada mês em `locations`) + as que
+    ainda estiverem na tabela quente para o mesmo mês (chegadas depois do
+    arquivamento), sem contar duas vezes um id presente nos dois lados.
+    Retorna o nº de métricas.
+    """
+    from src.archive import read_archive
+
+    group = ["brand_id", "model_id", "year_model", "region", "month_key"]
+    total = 0
+    for month_key in month_keys:
+        hot = db.execute(
+            select(PriceCollection.id, Model.brand_id, PriceCollection.model_id, PriceCollection.year_model,
+                   PriceCollection.region, PriceCollection.month_key, PriceCollection.price)
+            .join(Model, Model.id == PriceCollection.model_id)
+            .where(PriceCollection.month_key == month_key, PriceCollection.id <= max_id)
+        ).all()
+        columns = ["id"] + group + ["price"]
+        frames = list(read_archive(locations[month_key], [month_key], columns=columns))
+        if hot:
+            frames.append(pd.DataFrame(hot, columns=columns))
+        if not frames:
+            continue
+        df = pd.concat(frames, ignore_index=True).drop_duplicates("id")
+
+        regional = (
+            df.groupby(group, as_index=False)
+            .agg(avg_price=("price", "mean"), samples_count=("price", "size"))
+        )
+        regional["month_ref"] = month_key_to_ref(month_key)
+        regional = regional[list(RESULT_FIELDS)]
+        rows = pd.concat([regional, _national_rollup(regional)], ignore_index=True).astype(object).to_dict("records")
+        for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+            _upsert_monthly_averages(db, rows[start:start + UPSERT_CHUNK_SIZE])
+        total += len(rows)
+    return total
+
+def _list_partitions(db, last_id: int, max_id: int) -> List[int]:
+    """Meses (month_key) com coletas a processar: cada um vira uma partição."""
+    stmt = (
+        select(PriceCollection.month_key)
+        .where(PriceCollection.id > last_id, PriceCollection.id <= max_id)
+        .distinct()
+        .order_by(PriceCollection.month_key)
+    )
+    return db.execute(stmt).scalars().all()
+
+def _init_worker():
+    # Cada processo filho abre suas próprias conexões: descarta o pool herdado
+    # do pai (fork) sem fechar os sockets que ainda pertencem a ele
+    engine.dispose(close=False)
+
+def _run_partition(last_id: int, max_id: int, month_key: int) -> Tuple[int, int, float]:
+    """Processa uma partição (mês) em sessão própria. Executado nos workers."""
+    started = time.perf_counter()
+    db = SessionLocal()
+    try:
+        total = _consolidate(db, last_id, max_id, month_key)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    return month_key, total, time.perf_counter() - started
+
+def _run_parallel(db, last_id: int, max_id: int, workers: int, skip_months: Sequence[int] = ()) -> int:
+    """Distribui as partições (meses) entre um pool de processos."""
+    partitions = [m for m in _list_partitions(db, last_id, max_id) if m not in skip_months]
+    print(f"Modo paralelo: {len(partitions)} partições em {workers} workers.")
+
+    total = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = [pool.submit(_run_partition, last_id, max_id, month_key) for month_key in partitions]
+        for future in as_completed(futures):
+            # Erro em qualquer partição aborta o batch sem avançar a marca d'água
+            # (o upsert é idempotente, então reprocessar é seguro)
+            month_key, count, elapsed = future.result()
+            print(f"  Partição {month_key_to_ref(month_key)}: {count} métricas em {elapsed:.2f}s")
+            total += count
+    return total
+
+def _publish_data_version(db, data_version: int):
+    """
+    Avisa as instâncias da aplicação (DataVersionListener) da nova versão.
+    NOTIFY é transacional no Postgres: só é entregue se o commit acontecer.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    db.execute(select(func.pg_notify(DATA_VERSION_CHANNEL, str(data_version))))
+
+
+def run_monthly_batch(full_refresh: bool = False, workers: int = 1, archive_dir: Optional[str] = None):
     """
     Processo Batch que:
     1. Lê a tabela raw (price_collections)
     2. Agrupa por Marca, Modelo, Ano e Mês de Referência
     3. Calcula a Média e Count
     4. Salva/Atualiza na tabela 'monthly_averages'
+
+    Além das médias por região, grava a média nacional de cada
+    modelo/ano/mês (region = "Nacional") na mesma varredura.
+
+    Por padrão roda em modo incremental: só reagrega os grupos
+    (modelo, ano, mês) tocados por coletas com id acima da
+    marca d'água salva em 'batch_state', menos WATERMARK_LAG_IDS
+    (coletas commitadas fora da ordem dos ids). Com full_refresh=True
+    reprocessa todo o histórico.
+
+    Com workers > 1 o trabalho é particionado por mês e cada partição
+    roda em um processo separado, com conexão própria (só Postgres: em
+    outro banco o batch roda em série).
+
+    Meses arquivados em Parquet (src/archive.py, registrados em
+    archived_months) nunca são recalculados só com a tabela quente: são
+    reagregados a partir do arquivo (todos no full_refresh, ou só os
+    tocados por coletas novas no incremental), lido do diretório
+    registrado ou de archive_dir. Se o arquivo não estiver acessível, o
+    mês é pulado e as médias gravadas ficam como estão.
     """
     db = SessionLocal()
     print("Iniciando processamento mensal Batch...")
 
+    if workers > 1 and db.get_bind().dialect.name != "postgresql":
+        # SQLite aceita um único escritor: os workers falhariam com "database is locked"
+        print(f"Aviso: --workers {workers} requer Postgres; rodando em série neste banco.")
+        workers = 1
+
     try:
-        # Query de Agregação
-        # Extrai YYYY-MM do collected_at no Postgres: to_char(collected_at, 'YYYY-MM')
-        # Em SQLite seria diferente, mas estamos usando Postgres.
-        
-        stmt = (
-            select(
-                # Model needs to be joined to get brand_id? 
-                # Actually PriceCollection -> Model -> Brand.
-                Model.brand_id,
-                PriceCollection.model_id,
-                PriceCollection.year_model,
-                PriceCollection.region,
-                func.to_char(PriceCollection.collected_at, 'YYYY-MM').label("month_ref"),
-                func.avg(PriceCollection.price).label("avg_price"),
-                func.count(PriceCollection.id).label("samples_count")
-            )
-            .join(Model, Model.id == PriceCollection.model_id)
-            .group_by(
-                Model.brand_id,
-                PriceCollection.model_id,
-                PriceCollection.year_model,
-                PriceCollection.region,
-                func.to_char(PriceCollection.collected_at, 'YYYY-MM')
-            )
-        )
-        
-        results = db.execute(stmt).all()
-        
-        print(f"Calculadas {len(results)} métricas consolidadas.")
+        # Marca d'água: maior price_collections.id já consolidado
+        state = db.get(BatchState, BATCH_NAME)
+        last_id = 0 if (full_refresh or state is None) else state.last_collection_id
 
-        # OTIMIZAÇÃO: Carregar dados existentes em memória para evitar N+1 queries via rede
-        # Isso reduz drasticamente o tempo quando o banco está remoto (Render)
-        print("Carregando médias existentes para comparação...")
-        existing_records = db.query(MonthlyAverage).all()
-        existing_map = {
-            (r.model_id, r.year_model, r.region, r.month_ref): r 
-            for r in existing_records
-        }
+        # Congela o limite superior para que coletas inseridas durante o batch
+        # fiquem para a próxima execução (e não sejam puladas pela marca d'água)
+        max_id = db.execute(select(func.max(PriceCollection.id))).scalar()
+        if max_id is None or max_id <= last_id:
+            print("Nenhuma coleta nova desde a última execução. Nada a processar.")
+            return
+
+        watermark = last_id
+        # Relê a janela abaixo da marca d'água (commits fora da ordem dos ids)
+        last_id = max(last_id - WATERMARK_LAG_IDS, 0)
+        if last_id:
+            print(f"Modo incremental: coletas com id entre {last_id + 1} e {max_id} (marca d'água {watermark}).")
+        else:
+            print("Modo completo: reprocessando todo o histórico.")
+
+        # Meses fora da tabela quente: o que sobrou deles lá não é o mês inteiro
+        from src.archive import archive_locations, month_dir
+        locations = archive_locations(db.connection(), archive_dir)
+        archived = set(locations)
 
         print("Atualizando registros...")
-        for row in results:
-            # row: (brand_id, model_id, year_model, region, month_ref, avg_price, samples_count)
-            brand_id, model_id, year_model, region, month_ref, avg_price, samples_count = row
-            
-            key = (model_id, year_model, region, month_ref)
-            
-            if key in existing_map:
-                # Atualiza existente (SQLAlchemy detecta a mudança automaticamente)
-                record = existing_map[key]
-                record.avg_price = avg_price
-                record.samples_count = samples_count
-            else:
-                # Cria novo
-                new_avg = MonthlyAverage(
-                    brand_id=brand_id,
-                    model_id=model_id,
-                    year_model=year_model,
-                    month_ref=month_ref,
-                    region=region,
-                    avg_price=avg_price,
-                    samples_count=samples_count
-                )
-                db.add(new_avg)
-        
+        if workers > 1:
+            total = _run_parallel(db, last_id, max_id, workers, skip_months=archived)
+            if last_id:
+                archived &= set(_list_partitions(db, last_id, max_id))
+        elif last_id:
+            # Incremental: só os meses com coletas novas (poda de partições)
+            touched = _list_partitions(db, last_id, max_id)
+            total = _consolidate(db, last_id, max_id, month_keys=[m for m in touched if m not in archived])
+            archived &= set(touched)
+        else:
+            total = _consolidate(db, last_id, max_id, exclude_month_keys=archived)
+
+        missing = sorted(m for m in archived if not month_dir(locations[m], m).is_dir())
+        if missing:
+            refs = ", ".join(month_key_to_ref(m) for m in missing)
+            print(
+                f"Aviso: arquivo Parquet inacessível para {refs}: médias mantidas. "
+                f"Para reagregar: python src/batch_etl.py --full --archive-dir <diretório do arquivo>"
+            )
+            archived -= set(missing)
+        if archived:
+            print(f"Reagregando {len(archived)} meses a partir do arquivo Parquet...")
+            total += _consolidate_archived(db, locations, sorted(archived), max_id)
+
+        print(f"Calculadas {total} métricas consolidadas.")
+
+        # Avança a marca d'água e a versão dos dados na mesma transação das
+        # médias: caches da aplicação chaveados pela versão anterior expiram
+        data_version = (state.data_version or 0) + 1 if state is not None else 1
+        db.merge(BatchState(name=BATCH_NAME, last_collection_id=max_id, data_version=data_version))
+
+        _publish_data_version(db, data_version)
+
         print("Commitando alterações...")
         db.commit()
-        print("Batch Mensal finalizado com sucesso!")
+        print(f"Batch Mensal finalizado com sucesso! Versão dos dados: {data_version}")
         
     except Exception as e:
         print(f"Erro no Batch: {e}")
@@ -95,4 +424,10 @@ def run_monthly_batch():
         db.close()
 
 if __name__ == "__main__":
-    run_monthly_batch()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Batch mensal de consolidação de preços (CarFlow)")
+    parser.add_argument("--full", action="store_true", help="Reprocessa todo o histórico, ignorando a marca d'água")
+    parser.add_argument("--workers", type=int, default=1, help="Processos paralelos (particiona o batch por mês; só Postgres)")
+    parser.add_argument("--archive-dir", help="Lê os meses arquivados em Parquet (src/archive.py) deste diretório (padrão: o registrado no arquivamento)")
+    args = parser.parse_args()
+
+    run_monthly_batch(full_refresh=args.full, workers=args.workers, archive_dir=args.archive_dir)
@@ -0,0 +1,95 @@
+import io
+from typing import TYPE_CHECKING, Sequence
+
+from sqlalchemy import Table
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.engine import Connection
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Linhas por executemany quando não há COPY (SQLite nos testes/dev)
+EXECUTEMANY_CHUNK_ROWS = 10000
+
+
+def _copy_into(connection: Connection, table_name: str, frame: "pd.DataFrame"):
+    buffer = io.StringIO()
+    frame.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    column_list = ", ".join(f'"{name}"' for name in frame.columns)
+    cursor = connection.connection.driver_connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY "{table_name}" ({column_list}) FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+
+
+def copy_dataframe(connection: Connection, table: Table, frame: "pd.DataFrame") -> int:
+    """
+    Grava as linhas do DataFrame em `table` dentro da transação de
+    `connection` e devolve quantas foram gravadas. As colunas do DataFrame
+    devem ter os nomes das colunas da tabela.
+
+    No Postgres usa COPY FROM STDIN (CSV gerado pelo pandas, sem objeto
+    Python por linha); nos demais bancos cai para executemany em lotes.
+    """
+    if frame.empty:
+        return 0
+
+    if connection.dialect.name == "postgresql":
+        _copy_into(connection, table.name, frame)
+    else:
+        statement = table.insert()
+        for start in range(0, len(frame), EXECUTEMANY_CHUNK_ROWS):
+            connection.execute(statement, frame.iloc[start:start + EXECUTEMANY_CHUNK_ROWS].to_dict(orient="records"))
+
+    return len(frame)
+
+
+def copy_dataframe_skip_duplicates(
+    connection: Connection, table: Table, frame: "pd.DataFrame", conflict_columns: Sequence[str]
+) -> int:
+    """
+    Como copy_dataframe, mas ignora linhas cujos `conflict_columns` (colunas
+    de um índice único) já existem na tabela ou se repetem no próprio bloco.
+    Devolve quantas linhas foram de fato inseridas.
+
+    COPY não aceita ON CONFLICT: no Postgres o bloco vai por COPY para uma
+    tabela temporária e de lá para a tabela final em um único
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING (nenhuma consulta de
+    existência por linha). Nos demais bancos, executemany com o mesmo
+    ON CONFLICT DO NOTHING.
+    """
+    frame = frame.drop_duplicates(list(conflict_columns))
+    if frame.empty:
+        return 0
+
+    if connection.dialect.name == "postgresql":
+        staging = f"{table.name}_staging"
+        column_list = ", ".join(f'"{name}"' for name in frame.columns)
+        conflict_list = ", ".join(f'"{name}"' for name in conflict_columns)
+        cursor = connection.connection.driver_connection.cursor()
+        try:
+            # Uma por sessão, só com as colunas do bloco (sem constraints nem
+            # defaults); as linhas somem no commit (e no TRUNCATE abaixo)
+            cursor.execute(
+                f'CREATE TEMP TABLE IF NOT EXISTS "{staging}" ON COMMIT DELETE ROWS '
+                f'AS SELECT {column_list} FROM "{table.name}" WITH NO DATA'
+            )
+            _copy_into(connection, staging, frame)
+            cursor.execute(
+                f'INSERT INTO "{table.name}" ({column_list}) SELECT {column_list} FROM "{staging}" '
+                f"ON CONFLICT ({conflict_list}) DO NOTHING"
+            )
+            inserted = cursor.rowcount
+            cursor.execute(f'TRUNCATE "{staging}"')
+        finally:
+            cursor.close()
+        return inserted
+
+    statement = sqlite.insert(table).on_conflict_do_nothing(index_elements=list(conflict_columns))
+    inserted = 0
+    for start in range(0, len(frame), EXECUTEMANY_CHUNK_ROWS):
+        result = connection.execute(statement, frame.iloc[start:start + EXECUTEMANY_CHUNK_ROWS].to_dict(orient="records"))
+        inserted += result.rowcount
+    return inserted
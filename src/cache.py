@@ -0,0 +1,360 @@
+import logging
+import select as io_select
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import Any, Callable, Hashable, Optional, Sequence, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from src.models import BatchState
+from src.repositories import CarRepository
+
+logger = logging.getLogger(__name__)
+
+# Canal do Postgres em que o batch publica a nova versão dos dados
+DATA_VERSION_CHANNEL = "carflow_data_version"
+
+
+class TTLCache:
+    """Cache LRU com expiração por TTL (thread-safe)."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """Retorna (encontrado, valor)."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, item[1]
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class DataVersion:
+    """
+    Versão dos dados publicada pelo batch (batch_state.data_version).
+
+    Sem listener é relida do banco no máximo a cada `check_interval`
+    segundos; entre uma leitura e outra o valor em memória é usado sem
+    round trip. Com o DataVersionListener conectado as notificações são a
+    fonte da verdade e o caminho da requisição não consulta o banco (só
+    uma releitura quando o listener pede, ex: ao reconectar).
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], check_interval: float = 5.0):
+        self.session_factory = session_factory
+        self.check_interval = check_interval
+        self._version = 0
+        self._expected = 0
+        self._listening = False
+        self._checked_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def current(self) -> int:
+        with self._lock:
+            now = time.monotonic()
+            # Com o listener ativo só relê se pedido ou se a versão anunciada
+            # ainda não chegou (réplica atrasada)
+            polling = not self._listening or self._version < self._expected
+            if self._checked_at is None or (polling and now - self._checked_at >= self.check_interval):
+                self._version = self._load()
+                self._checked_at = now
+            return self._version
+
+    def set(self, version: int):
+        """Atualiza a versão sem consultar o banco (ex: avisada por notificação)."""
+        with self._lock:
+            self._version = version
+            self._checked_at = time.monotonic()
+
+    def expect(self, version: int):
+        """
+        Versão anunciada que ainda precisa ser lida do banco: relê já e
+        segue relendo a cada `check_interval` até encontrá-la.
+        """
+        with self._lock:
+            self._expected = max(self._expected, version)
+            self._checked_at = None
+
+    def invalidate(self):
+        """Força a releitura do banco na próxima consulta."""
+        with self._lock:
+            self._checked_at = None
+
+    def set_listening(self, listening: bool):
+        """Liga/desliga o modo notificação (sem polling na requisição)."""
+        with self._lock:
+            self._listening = listening
+
+    def _load(self) -> int:
+        db = self.session_factory()
+        try:
+            return db.execute(select(func.max(BatchState.data_version))).scalar() or 0
+        finally:
+            db.close()
+
+
+def _detach(value: Any) -> Any:
+    """
+    Copia objetos ORM para SimpleNamespace com as colunas já carregadas, para
+    que o valor em cache não dependa da sessão que o carregou (nem dispare
+    lazy load depois que ela fechar).
+    """
+    if isinstance(value, list):
+        return [_detach(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _detach(v) for k, v in value.items()}
+    if hasattr(value, "_sa_instance_state"):
+        state = sa_inspect(value)
+        return SimpleNamespace(**{
+            attr.key: state.dict[attr.key]
+            for attr in state.mapper.column_attrs
+            if attr.key in state.dict
+        })
+    return value
+
+
+class RepositoryCache:
+    """
+    Cache de leitura compartilhado pelo processo, com entradas chaveadas pela
+    versão dos dados: quando o batch publica uma nova versão as entradas
+    antigas deixam de ser encontradas (e são descartadas).
+    """
+
+    def __init__(self, data_version: DataVersion, maxsize: int = 1024, ttl: float = 600.0):
+        self.data_version = data_version
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._seen_version: Optional[int] = None
+        # _seen_version é lida/escrita pelas requisições e pelo listener
+        self._lock = threading.Lock()
+
+    def get_or_load(self, method: str, args: Tuple, loader: Callable[[], Any]) -> Any:
+        version = self.data_version.current()
+        with self._lock:
+            if version != self._seen_version:
+                # Versão nova: nada do que está em cache vale mais
+                self.entries.clear()
+                self._seen_version = version
+
+        key = (version, method, args)
+        found, value = self.entries.get(key)
+        if found:
+            return value
+
+        value = _detach(loader())
+        self.entries.set(key, value)
+        return value
+
+    def invalidate(self, version: Optional[int] = None, trusted: bool = True):
+        """
+        Descarta o cache; com `version` já registra a nova versão sem ir ao
+        banco. Com `trusted=False` a versão é só esperada: relida do banco
+        até aparecer (leituras em réplica que pode estar atrasada).
+        """
+        with self._lock:
+            if version is None:
+                self.data_version.invalidate()
+            elif trusted:
+                self.data_version.set(version)
+            else:
+                self.data_version.expect(version)
+            self.entries.clear()
+            self._seen_version = None
+
+
+class CachedCarRepository:
+    """
+    Read-through na frente do CarRepository: catálogo (marcas, modelos, anos,
+    regiões) e histórico de preços vêm do cache enquanto a versão dos dados
+    não muda. Demais métodos (ex: create_log) vão direto ao repositório.
+    """
+
+    def __init__(self, repository: CarRepository, cache: RepositoryCache):
+        self.repository = repository
+        self.cache = cache
+
+    def __getattr__(self, name: str):
+        return getattr(self.repository, name)
+
+    def get_brands(self):
+        return self.cache.get_or_load("get_brands", (), self.repository.get_brands)
+
+    def get_models_by_brand(self, brand_id: int):
+        return self.cache.get_or_load(
+            "get_models_by_brand", (brand_id,),
+            lambda: self.repository.get_models_by_brand(brand_id)
+        )
+
+    def get_catalog(self):
+        return self.cache.get_or_load("get_catalog", (), self.repository.get_catalog)
+
+    def get_years_by_model(self, model_id: int):
+        return self.cache.get_or_load(
+            "get_years_by_model", (model_id,),
+            lambda: self.repository.get_years_by_model(model_id)
+        )
+
+    def get_available_regions(self):
+        return self.cache.get_or_load("get_available_regions", (), self.repository.get_available_regions)
+
+    def get_price_history(
+        self,
+        model_id: int,
+        year_model: int,
+        region: Optional[str] = None,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        last_n_months: Optional[int] = None,
+    ):
+        return self.cache.get_or_load(
+            "get_price_history", (model_id, year_model, region, since, until, last_n_months),
+            lambda: self.repository.get_price_history(
+                model_id, year_model, region,
+                since=since, until=until, last_n_months=last_n_months
+            )
+        )
+
+    def get_price_histories(
+        self,
+        model_id: int,
+        year_model: int,
+        regions: Sequence[str],
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        last_n_months: Optional[int] = None,
+    ):
+        return self.cache.get_or_load(
+            "get_price_histories", (model_id, year_model, tuple(regions), since, until, last_n_months),
+            lambda: self.repository.get_price_histories(
+                model_id, year_model, regions,
+                since=since, until=until, last_n_months=last_n_months
+            )
+        )
+
+
+class DataVersionListener:
+    """
+    Escuta (LISTEN) o canal DATA_VERSION_CHANNEL em uma thread de fundo e
+    descarta o RepositoryCache assim que o batch de qualquer host publica uma
+    nova versão dos dados.
+
+    Enquanto está conectado o DataVersion deixa de fazer polling: a versão
+    só muda pelas notificações. Usa uma conexão dedicada (fora do pool) em
+    autocommit. Se ela cair, o polling volta, a thread reconecta após
+    `reconnect_delay` segundos e força a releitura da versão, já que
+    notificações enviadas nesse intervalo se perderam.
+
+    Com `use_payload=False` a versão do payload não é aplicada direto: ela
+    é relida do banco até aparecer. Usado quando a versão é lida de uma
+    réplica, que pode ainda não ter recebido os dados anunciados pelo
+    primário.
+    """
+
+    def __init__(
+        self,
+        cache: RepositoryCache,
+        engine: Engine,
+        channel: str = DATA_VERSION_CHANNEL,
+        poll_timeout: float = 5.0,
+        reconnect_delay: float = 5.0,
+        use_payload: bool = True,
+    ):
+        self.cache = cache
+        self.engine = engine
+        self.channel = channel
+        self.poll_timeout = poll_timeout
+        self.reconnect_delay = reconnect_delay
+        self.use_payload = use_payload
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.received = 0
+
+    def start(self) -> "DataVersionListener":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="data-version-listener", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def handle(self, payload: str):
+        """Trata uma notificação: o payload é a nova versão publicada pelo batch."""
+        version: Optional[int] = None
+        try:
+            version = int(payload)
+        except (TypeError, ValueError):
+            pass  # payload inesperado: relê a versão do banco
+        self.received += 1
+        self.cache.invalidate(version, trusted=self.use_payload)
+
+    def _run(self):
+        while not self._stop.is_set():
+            connection = None
+            try:
+                connection = self._connect()
+                # Pode ter perdido notificações enquanto estava desconectado
+                self.cache.invalidate()
+                self.cache.data_version.set_listening(True)
+                self._listen(connection.driver_connection)
+            except Exception as e:
+                logger.warning("Listener de versão dos dados desconectado: %s", e)
+                self.cache.data_version.set_listening(False)
+                self._stop.wait(self.reconnect_delay)
+            finally:
+                if connection is not None:
+                    connection.close()
+        self.cache.data_version.set_listening(False)
+
+    def _connect(self):
+        connection = self.engine.raw_connection()
+        # LISTEN em autocommit muda o estado da conexão: ela não volta ao pool
+        connection.detach()
+        driver_connection = connection.driver_connection
+        driver_connection.autocommit = True
+        cursor = driver_connection.cursor()
+        cursor.execute(f'LISTEN "{self.channel}"')
+        cursor.close()
+        return connection
+
+    def _listen(self, driver_connection):
+        while not self._stop.is_set():
+            readable, _, _ = io_select.select([driver_connection], [], [], self.poll_timeout)
+            if not readable:
+                continue
+            driver_connection.poll()
+            while driver_connection.notifies:
+                notification = driver_connection.notifies.pop(0)
+                self.handle(notification.payload)
@@ -0,0 +1,262 @@
+import sys
+import os
+
+# Adiciona a raiz do projeto ao PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse  # noqa: E402
+import time  # noqa: E402
+from datetime import datetime  # noqa: E402
+from typing import Dict, Iterator, Optional, Set, Tuple  # noqa: E402
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+from sqlalchemy import select  # noqa: E402
+from src.archive import archive_locations, read_archive  # noqa: E402
+from src.bulk_load import copy_dataframe_skip_duplicates  # noqa: E402
+from src.database import engine  # noqa: E402
+from src.models import Model, PriceCollection  # noqa: E402
+from src.partitions import ensure_month_partitions  # noqa: E402
+from src.periods import MONTH_TIMEZONE_NAME  # noqa: E402
+
+# Linhas lidas/validadas/gravadas por vez: limita a memória do processo
+INGEST_CHUNK_ROWS = 50000
+
+# Colunas obrigatórias nos arquivos dos scrapers
+REQUIRED_COLUMNS = ("model_id", "year_model", "price", "region", "collected_at")
+
+# Colunas gravadas em price_collections (month_key e content_hash são derivados)
+LOAD_COLUMNS = ("model_id", "year_model", "price", "region", "collected_at", "month_key", "source_id", "content_hash")
+
+# Índice único da deduplicação (o month_key acompanha a chave de partição)
+DEDUP_KEY = ("content_hash", "month_key")
+
+# Faixa de preço plausível (R$); fora dela é erro de parsing do scraper
+MIN_PRICE = 1000.0
+MAX_PRICE = 10_000_000.0
+
+MIN_YEAR_MODEL = 1950
+
+# Regiões aceitas: UFs (a média nacional é gerada pelo batch, não coletada)
+VALID_REGIONS = frozenset({
+    "AC", "AL", "AM", "AP", "BA", "CE", "DF", "ES", "GO", "MA", "MG", "MS", "MT", "PA",
+    "PB", "PE", "PI", "PR", "RJ", "RN", "RO", "RR", "RS", "SC", "SE", "SP", "TO",
+})
+
+
+def read_chunks(path: str, chunk_rows: int = INGEST_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Lê um CSV ou JSONL em blocos de `chunk_rows` linhas (nunca o arquivo inteiro)."""
+    if path.endswith((".jsonl", ".jsonl.gz", ".ndjson")):
+        reader = pd.read_json(path, lines=True, chunksize=chunk_rows, dtype=False)
+    elif path.endswith((".csv", ".csv.gz")):
+        reader = pd.read_csv(path, chunksize=chunk_rows, dtype=str, skipinitialspace=True)
+    else:
+        raise ValueError(f"Formato não suportado (use .csv ou .jsonl): {path}")
+
+    with reader:
+        for chunk in reader:
+            chunk.columns = chunk.columns.str.strip().str.lower()
+            missing = [c for c in REQUIRED_COLUMNS if c not in chunk.columns]
+            if missing:
+                raise ValueError(f"{path}: colunas obrigatórias ausentes: {', '.join(missing)}")
+            yield chunk
+
+
+def content_hash(rows: pd.DataFrame) -> pd.Series:
+    """
+    Hash de 64 bits (int64, cabe no BigInteger) do conteúdo da coleta:
+    modelo, ano, região, preço em centavos, collected_at (em segundos, UTC)
+    e source_id. O mesmo anúncio reenviado pelo scraper gera o mesmo hash.
+    """
+    key = pd.DataFrame({
+        "model_id": rows["model_id"],
+        "year_model": rows["year_model"],
+        "region": rows["region"],
+        "price_cents": (rows["price"] * 100).round().astype("int64"),
+        "collected_at": rows["collected_at"].dt.as_unit("s").astype("int64"),
+        "source_id": rows["source_id"].fillna(""),
+    })
+    return pd.Series(pd.util.hash_pandas_object(key, index=False).to_numpy().view("int64"), index=rows.index)
+
+
+def parse_collected_at(raw: pd.Series) -> pd.Series:
+    """
+    Converte collected_at para datetime em UTC. Valores com fuso (Z,
+    -03:00...) são respeitados; sem fuso são horário de MONTH_TIMEZONE, a
+    mesma regra do ORM (periods.to_month_key). Inválidos viram NaT.
+    """
+    text = raw.astype("string").str.strip()
+    has_offset = text.str.contains(r"(?:Z|[+-]\d{2}:?\d{2})$", regex=True).fillna(False).astype(bool)
+    parsed = pd.Series(pd.NaT, index=raw.index, dtype="datetime64[ns, UTC]")
+    if has_offset.any():
+        parsed[has_offset] = pd.to_datetime(text[has_offset], errors="coerce", utc=True, format="ISO8601")
+    if (~has_offset).any():
+        local = pd.to_datetime(text[~has_offset], errors="coerce", format="ISO8601")
+        parsed[~has_offset] = local.dt.tz_localize(
+            MONTH_TIMEZONE_NAME, ambiguous="NaT", nonexistent="shift_forward"
+        ).dt.tz_convert("UTC")
+    return parsed
+
+
+def validate_chunk(chunk: pd.DataFrame, known_models: Set[int], max_year: Optional[int] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Valida um bloco de forma vetorizada e devolve (válidas, rejeitadas).
+
+    As válidas vêm já no formato de price_collections (LOAD_COLUMNS); as
+    rejeitadas mantêm as colunas originais mais `reason` (o primeiro
+    problema encontrado: UNKNOWN_MODEL, INVALID_YEAR, INVALID_PRICE,
+    INVALID_REGION ou INVALID_DATE).
+    """
+    max_year = max_year or datetime.now().year + 1
+
+    model_id = pd.to_numeric(chunk["model_id"], errors="coerce")
+    year_model = pd.to_numeric(chunk["year_model"], errors="coerce")
+    price = pd.to_numeric(chunk["price"], errors="coerce")
+    region = chunk["region"].astype("string").str.strip().str.upper()
+    collected_at = parse_collected_at(chunk["collected_at"])
+    # source_id (id do anúncio) é opcional; vazio vira NULL
+    if "source_id" in chunk.columns:
+        source_id = chunk["source_id"].astype("string").str.strip().replace("", pd.NA).astype(object)
+    else:
+        source_id = pd.Series(None, index=chunk.index, dtype=object)
+
+    checks = [
+        ("UNKNOWN_MODEL", ~model_id.isin(known_models)),
+        ("INVALID_YEAR", ~year_model.between(MIN_YEAR_MODEL, max_year) | (year_model % 1 != 0)),
+        ("INVALID_PRICE", ~price.between(MIN_PRICE, MAX_PRICE)),
+        ("INVALID_REGION", ~region.isin(VALID_REGIONS).fillna(False).astype(bool)),
+        ("INVALID_DATE", collected_at.isna()),
+    ]
+    reason = pd.Series(
+        np.select([mask.to_numpy() for _, mask in checks], [name for name, _ in checks], default=""),
+        index=chunk.index,
+    )
+    ok = reason == ""
+    # Mês pelo calendário local, como o default do ORM (não pelo dia em UTC)
+    local_at = collected_at[ok].dt.tz_convert(MONTH_TIMEZONE_NAME)
+
+    valid = pd.DataFrame({
+        "model_id": model_id[ok].astype("int64"),
+        "year_model": year_model[ok].astype("int64"),
+        "price": price[ok].astype("float64"),
+        "region": region[ok].astype(object),
+        "collected_at": collected_at[ok],
+        "month_key": local_at.dt.year * 100 + local_at.dt.month,
+        "source_id": source_id[ok].where(source_id[ok].notna(), None),
+    })
+    valid["content_hash"] = content_hash(valid)
+
+    rejected = chunk.loc[~ok].assign(reason=reason[~ok])
+    return valid, rejected
+
+
+def _load_known_models() -> Set[int]:
+    with engine.connect() as connection:
+        return set(connection.execute(select(Model.id)).scalars())
+
+
+def _drop_archived_duplicates(valid: pd.DataFrame, locations: Dict[int, str], seen: Dict[int, Set[int]]) -> pd.DataFrame:
+    """
+    Tira as coletas de meses arquivados (src/archive.py) já presentes no
+    Parquet: o índice único de DEDUP_KEY só vê a tabela quente. Os hashes
+    de cada mês são lidos do arquivo uma vez por execução (`seen`).
+    """
+    months = set(valid["month_key"].unique()) & set(locations)
+    if not months:
+        return valid
+    keep = pd.Series(True, index=valid.index)
+    for month_key in months:
+        if month_key not in seen:
+            seen[month_key] = set()
+            for frame in read_archive(locations[month_key], [month_key], columns=["content_hash"]):
+                seen[month_key].update(frame["content_hash"].dropna().astype("int64"))
+        keep &= ~((valid["month_key"] == month_key) & valid["content_hash"].isin(seen[month_key]))
+    return valid[keep]
+
+
+def _quarantine(rejected: pd.DataFrame, path: str, source: str, first_line: int):
+    # Linha no arquivo de origem (1 = primeira linha de dados) para reprocessar depois
+    out = rejected.assign(source_file=source, source_line=rejected.index + first_line)
+    out.to_csv(path, mode="a", header=os.path.getsize(path) == 0, index=False)
+
+
+def _rate(part: int, whole: int) -> str:
+    return f"{part / whole:.1%}" if whole else "0.0%"
+
+
+def ingest_files(paths, quarantine_path: str, chunk_rows: int = INGEST_CHUNK_ROWS) -> Dict[str, float]:
+    """
+    Carrega arquivos de coletas em price_collections: lê em blocos, valida,
+    grava as válidas via COPY (executemany fora do Postgres) e manda as
+    rejeitadas para `quarantine_path` (recriado a cada execução: reprocessar
+    um arquivo não duplica a quarentena). Coletas já carregadas (mesmo
+    content_hash) são ignoradas pelo ON CONFLICT DO NOTHING, ou pelo
+    arquivo Parquet nos meses arquivados, e contadas como duplicadas.
+    Cada bloco é commitado ao ser gravado. Retorna totais de linhas lidas,
+    carregadas, duplicadas e rejeitadas.
+    """
+    known_models = _load_known_models()
+    # Quarentena desta execução apenas (o retry de um arquivo não repete linhas)
+    open(quarantine_path, "w").close()
+    partitioned_months = set()
+    archived_hashes = {}
+    totals = {"read": 0, "loaded": 0, "duplicates": 0, "rejected": 0, "seconds": 0.0}
+    started = time.perf_counter()
+
+    with engine.connect() as connection:
+        archived = archive_locations(connection)
+        connection.commit()
+        for path in paths:
+            file_started = time.perf_counter()
+            loaded = duplicates = rejected_count = read = 0
+            for chunk in read_chunks(path, chunk_rows):
+                first_line = read + 1
+                chunk = chunk.reset_index(drop=True)
+                read += len(chunk)
+
+                valid, rejected = validate_chunk(chunk, known_models)
+                # Mês novo ganha partição antes da carga (no-op fora do Postgres)
+                new_months = set(valid["month_key"].unique()) - partitioned_months
+                if new_months:
+                    ensure_month_partitions(connection, new_months)
+                    partitioned_months |= new_months
+                candidates = len(valid)
+                valid = _drop_archived_duplicates(valid, archived, archived_hashes)
+                inserted = copy_dataframe_skip_duplicates(connection, PriceCollection.__table__, valid, DEDUP_KEY)
+                connection.commit()
+                loaded += inserted
+                duplicates += candidates - inserted
+                if not rejected.empty:
+                    _quarantine(rejected, quarantine_path, path, first_line)
+                    rejected_count += len(rejected)
+
+            elapsed = time.perf_counter() - file_started
+            print(
+                f"{path}: {loaded} carregadas, {duplicates} duplicadas ({_rate(duplicates, loaded + duplicates)}), "
+                f"{rejected_count} rejeitadas em {elapsed:.1f}s ({read / max(elapsed, 1e-9):,.0f} linhas/s)"
+            )
+            totals["read"] += read
+            totals["loaded"] += loaded
+            totals["duplicates"] += duplicates
+            totals["rejected"] += rejected_count
+
+    totals["seconds"] = time.perf_counter() - started
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingestão de coletas de preço (CSV/JSONL dos scrapers) em price_collections")
+    parser.add_argument("files", nargs="+", help="Arquivos .csv ou .jsonl")
+    parser.add_argument("--quarantine", default="quarentena.csv", help="CSV que recebe as linhas rejeitadas (com o motivo)")
+    parser.add_argument("--chunk-rows", type=int, default=INGEST_CHUNK_ROWS, help="Linhas por bloco (limita a memória)")
+    args = parser.parse_args()
+
+    print("Iniciando ingestão de coletas...")
+    result = ingest_files(args.files, args.quarantine, chunk_rows=args.chunk_rows)
+    rate = result["read"] / max(result["seconds"], 1e-9)
+    print(
+        f"Ingestão finalizada: {result['loaded']} carregadas, {result['duplicates']} duplicadas "
+        f"({_rate(result['duplicates'], result['loaded'] + result['duplicates'])}), {result['rejected']} rejeitadas "
+        f"em {result['seconds']:.1f}s ({rate:,.0f} linhas/s)"
+    )
+    if result["rejected"]:
+        print(f"Linhas rejeitadas em {args.quarantine}")
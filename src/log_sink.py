@@ -0,0 +1,167 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from src.models import QueryLog
+
+logger = logging.getLogger(__name__)
+
+# Marcador enfileirado pelo close() para acordar a thread sem esperar o intervalo
+_WAKEUP = object()
+
+
+class QueryLogSink:
+    """
+    Fila em memória para os logs de consulta (QueryLog).
+
+    A consulta pública só enfileira o registro; uma thread de fundo grava em
+    lote (um INSERT executemany por lote) a cada `batch_size` registros ou a
+    cada `flush_interval_ms`, o que vier primeiro. A fila é limitada:
+
+    - overflow="drop": fila cheia descarta o registro (nunca bloqueia a leitura)
+    - overflow="block": espera até `block_timeout` segundos por espaço e só
+      então descarta (backpressure limitado)
+
+    O que estiver na fila é gravado no close(), registrado no atexit.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        batch_size: int = 100,
+        flush_interval_ms: int = 500,
+        max_queue: int = 10_000,
+        overflow: str = "drop",
+        block_timeout: float = 0.05,
+    ):
+        if overflow not in ("drop", "block"):
+            raise ValueError(f"overflow inválido: {overflow}")
+
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._write_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self) -> "QueryLogSink":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="query-log-sink", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        return self
+
+    def submit(
+        self,
+        brand_id: Optional[int],
+        model_id: Optional[int],
+        year_model: Optional[int],
+        status: str,
+        region: Optional[str] = None,
+        items_requested: Optional[int] = None,
+        items_matched: Optional[int] = None,
+    ) -> bool:
+        """Enfileira um log. Retorna False se ele foi descartado pela política de overflow."""
+        entry = {
+            "brand_id": brand_id,
+            "model_id": model_id,
+            "year_model": year_model,
+            "status": status,
+            "region": region,
+            "items_requested": items_requested,
+            "items_matched": items_matched,
+            # Horário da consulta, não o da gravação em lote
+            "created_at": datetime.now(timezone.utc),
+        }
+        try:
+            if self.overflow == "block":
+                self._queue.put(entry, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def flush(self):
+        """Grava imediatamente tudo o que está na fila."""
+        while True:
+            batch = self._drain_nowait()
+            if not batch:
+                return
+            self._write(batch)
+
+    def close(self, timeout: float = 5.0):
+        """Para a thread de fundo e grava o que restou na fila."""
+        self._stop.set()
+        if self._thread is not None:
+            try:
+                self._queue.put_nowait(_WAKEUP)
+            except queue.Full:
+                pass  # fila cheia: a thread não está esperando
+            self._thread.join(timeout)
+        self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+
+    def _next_batch(self) -> List[Dict[str, Any]]:
+        """Junta registros até completar o lote ou vencer o intervalo de flush."""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is _WAKEUP:
+                break
+            batch.append(entry)
+        return batch
+
+    def _drain_nowait(self) -> List[Dict[str, Any]]:
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not _WAKEUP:
+                batch.append(entry)
+        return batch
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        with self._write_lock:
+            db = self.session_factory()
+            try:
+                db.execute(insert(QueryLog), batch)
+                db.commit()
+                self.written += len(batch)
+            except Exception as e:
+                # Auditoria nunca derruba a aplicação: registra e segue
+                db.rollback()
+                self.failed += len(batch)
+                logger.error("Falha ao gravar %d logs de consulta: %s", len(batch), e)
+            finally:
+                db.close()
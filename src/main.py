@@ -5,15 +5,37 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import streamlit as st  # noqa: E402
-import pandas as pd  # noqa: E402
-import plotly.express as px  # noqa: E402
 from datetime import datetime  # noqa: E402
-from src.database import SessionLocal, engine, Base  # noqa: E402
-from src.services import CarService  # noqa: E402
+from src.database import DATABASE_URL, READ_DATABASE_URL, ReadSessionLocal, SessionLocal, engine  # noqa: E402
+from src.models import NATIONAL_REGION  # noqa: E402
+from src.services import ScopedCarService  # noqa: E402
+from src.log_sink import QueryLogSink  # noqa: E402
+from src.cache import DataVersion, DataVersionListener, RepositoryCache  # noqa: E402
+from src.migrate import check_database_ready, run_migrations  # noqa: E402
+
+# Janela do gráfico de evolução (meses até o último mês disponível)
+CHART_MONTHS = 12
+
+# Páginas do app (seletor no topo da sidebar)
+PAGE_SEARCH = "🔍 Consulta de Preço"
+PAGE_INVENTORY = "📦 Estoque (CSV)"
+
+# Com CARFLOW_AUTO_MIGRATE=0 o schema fica só a cargo de `python src/migrate.py`
+AUTO_MIGRATE = os.getenv("CARFLOW_AUTO_MIGRATE", "1") == "1"
 
 # --- SETUP INICIAL ---
+# show_spinner=False: nada pode ser renderizado antes do set_page_config
+@st.cache_resource(show_spinner=False)
+def prepare_database():
+    # Uma vez por processo (não a cada rerun). Exceções não vão para o cache:
+    # se o banco estiver fora, o próximo rerun tenta de novo
+    if AUTO_MIGRATE:
+        run_migrations(engine)
+    check_database_ready(engine)
+    return True
+
 try:
-    Base.metadata.create_all(bind=engine)
+    prepare_database()
 except Exception as e:
     # Se der erro, mostra na tela mas tenta seguir (pode ser que o banco já exista/esteja inacessível temporariamente)
     # st.error não interrompe o script se não chamarmos st.stop(), mas aqui o stop é prudente se for crítico.
@@ -33,6 +55,8 @@ if 'history' not in st.session_state:
     st.session_state.history = []
 if 'last_search' not in st.session_state:
     st.session_state.last_search = None
+if 'new_search' not in st.session_state:
+    st.session_state.new_search = False
 
 def add_to_history(brand, model, year, region, price):
     # Evita duplicatas consecutivas
@@ -50,9 +74,28 @@ def add_to_history(brand, model, year, region, price):
         st.session_state.history.pop()
 
 # --- SERVICES ---
+@st.cache_resource
+def get_log_sink():
+    # Um sink por processo: os logs de consulta são gravados em lote em background
+    return QueryLogSink(SessionLocal).start()
+
+@st.cache_resource
+def get_repository_cache():
+    # Catálogo e histórico só mudam quando o batch publica uma nova versão
+    # A versão é lida de onde vêm os dados (réplica, se configurada)
+    cache = RepositoryCache(DataVersion(ReadSessionLocal))
+    if DATABASE_URL.startswith("postgresql"):
+        # Batch rodando em outro host avisa via NOTIFY: descarta o cache na hora.
+        # Com réplica, a versão do aviso pode ainda não ter chegado nela: só relê.
+        DataVersionListener(cache, engine, use_payload=not READ_DATABASE_URL).start()
+    return cache
+
+@st.cache_resource
 def get_service():
-    db = SessionLocal()
-    return CarService(db)
+    # Serviço único por processo: cada chamada usa a própria sessão e devolve
+    # a conexão ao pool (nada fica aberto entre um rerun e outro). Consultas
+    # vão para a réplica de leitura; os logs seguem pelo sink no primário.
+    return ScopedCarService(ReadSessionLocal, log_sink=get_log_sink(), cache=get_repository_cache())
 
 service = get_service()
 
@@ -177,17 +220,32 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# --- DADOS DOS FILTROS ---
+# Chaveados pela versão dos dados: um batch novo gera novas entradas
+@st.cache_data(ttl=600, show_spinner=False)
+def load_brands(data_version: int):
+    return service.list_brands()
+
+@st.cache_data(ttl=600, show_spinner=False)
+def load_models(data_version: int, brand_id: int):
+    return service.list_models(brand_id)
+
+@st.cache_data(ttl=600, show_spinner=False)
+def load_years(data_version: int, model_id: int):
+    return service.list_years(model_id)
+
+@st.cache_data(ttl=600, show_spinner=False)
+def load_regions(data_version: int):
+    return service.list_regions()
+
 # --- SIDEBAR ---
-with st.sidebar:
-    try:
-        st.image("docs/assets/images/logo.png", width=300)
-    except Exception:
-        st.title("CarFlow")
-        
-    st.write("")
-    st.markdown("### 🔍 Filtros de Busca")
-    
-    brands_map = service.list_brands()
+@st.fragment
+def render_filters():
+    # Fragmento: mudar um filtro reexecuta só esta função, não a página toda.
+    # O resultado só é recalculado no clique do botão (rerun completo).
+    data_version = get_repository_cache().data_version.current()
+
+    brands_map = load_brands(data_version)
     selected_brand_name = st.selectbox("Marca", options=list(brands_map.keys()) if brands_map else [], key="brand_key", placeholder="Selecione...")
     
     selected_model_name = None
@@ -195,16 +253,16 @@ with st.sidebar:
     
     if selected_brand_name:
         brand_id = brands_map[selected_brand_name]
-        models_map = service.list_models(brand_id)
+        models_map = load_models(data_version, brand_id)
         selected_model_name = st.selectbox("Modelo", options=list(models_map.keys()), key="model_key", placeholder="Selecione...")
 
     if selected_model_name:
         model_id = models_map[selected_model_name]
-        years_list = service.list_years(model_id)
+        years_list = load_years(data_version, model_id)
         selected_year = st.selectbox("Ano Modelo", options=years_list, key="year_key")
         
-    regions_list = service.list_regions()
-    selected_region = st.selectbox("Região", options=["Nacional"] + regions_list, key="region_key")
+    regions_list = load_regions(data_version)
+    selected_region = st.selectbox("Região", options=[NATIONAL_REGION] + regions_list, key="region_key")
     
     st.write("")
     st.write("")
@@ -219,47 +277,144 @@ with st.sidebar:
             'brand_name': selected_brand_name,
             'model_name': selected_model_name
         }
+        st.session_state.new_search = True
+        # Rerun da página inteira para renderizar o resultado
+        st.rerun()
+
+with st.sidebar:
+    try:
+        st.image("docs/assets/images/logo.png", width=300)
+    except Exception:
+        st.title("CarFlow")
+        
+    st.write("")
+    page = st.radio("Página", [PAGE_SEARCH, PAGE_INVENTORY], key="page_key", label_visibility="collapsed")
+
+    if page == PAGE_SEARCH:
+        st.markdown("### 🔍 Filtros de Busca")
+        render_filters()
+
+# --- MAPA REGIONAL ---
+@st.fragment
+def render_region_matrix(search_data):
+    # Fragmento próprio: ligar/desligar o mapa não refaz a consulta principal
+    if not st.toggle("🗺️ Ver todas as regiões", key="matrix_toggle"):
+        return
+
+    # A versão dos dados entra na chave: batch novo refaz o mapa
+    matrix_key = (
+        get_repository_cache().data_version.current(),
+        search_data['brand_id'], search_data['model_id'], search_data['year_model'],
+    )
+    cached = st.session_state.get("region_matrix")
+    if cached is None or cached[0] != matrix_key:
+        matrix = service.get_price_matrix(
+            brand_id=search_data['brand_id'],
+            model_id=search_data['model_id'],
+            year_model=search_data['year_model'],
+            last_n_months=CHART_MONTHS
+        )
+        st.session_state.region_matrix = (matrix_key, matrix)
+    matrix = st.session_state.region_matrix[1]
+
+    if not matrix or matrix['prices'].empty:
+        st.info("Sem dados regionais para este modelo/ano.")
+        return
+
+    import plotly.express as px
+
+    # Com média nacional: mapa de spread (%); sem ela, os preços absolutos
+    if matrix['spreads_pct'] is not None:
+        heat = matrix['spreads_pct']
+        title, color_label, fmt = "Diferença para a Média Nacional (%)", "% vs BR", ".1f"
+    else:
+        heat = matrix['prices']
+        title, color_label, fmt = "Preço Médio por Região", "R$", ",.0f"
+
+    fig = px.imshow(
+        heat, aspect="auto", text_auto=fmt, color_continuous_scale="RdYlGn_r",
+        labels=dict(x="Mês", y="Região", color=color_label)
+    )
+    fig.update_layout(
+        title=dict(text=title, font=dict(size=18, color="#2c3e50")),
+        paper_bgcolor="white", plot_bgcolor="white", font=dict(color="black")
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+# --- ESTOQUE DO LOJISTA (CSV) ---
+def render_inventory_page():
+    st.markdown("## 📦 Avaliação de Estoque")
+    st.markdown(
+        "Envie um CSV com as colunas **marca**, **modelo**, **ano** e, opcionalmente, "
+        "**regiao** (vazia = média nacional). Todas as linhas são avaliadas de uma vez."
+    )
+    uploaded = st.file_uploader("Arquivo CSV", type="csv", key="inventory_file")
+    if uploaded is None:
+        return
+
+    # Avalia uma vez por arquivo; reruns reaproveitam o resultado
+    cached = st.session_state.get("inventory_result")
+    if cached is None or cached[0] != uploaded.file_id:
+        try:
+            with st.spinner("Avaliando estoque..."):
+                result = service.value_inventory(uploaded)
+        except ValueError as e:
+            st.error(f"⚠️ {e}")
+            return
+        st.session_state.inventory_result = (uploaded.file_id, result)
+    result = st.session_state.inventory_result[1]
+
+    status_counts = result["status"].value_counts()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Veículos", len(result))
+    col2.metric("Avaliados", int(status_counts.get("SUCCESS", 0)))
+    col3.metric("Sem preço", len(result) - int(status_counts.get("SUCCESS", 0)))
+
+    st.dataframe(result, use_container_width=True, hide_index=True)
+    st.download_button(
+        "⬇️ Baixar estoque avaliado",
+        data=result.to_csv(index=False).encode("utf-8"),
+        file_name=f"avaliacao_{uploaded.name}",
+        mime="text/csv"
+    )
+
+if page == PAGE_INVENTORY:
+    render_inventory_page()
+    st.stop()
 
 # --- LÓGICA PRINCIPAL ---
 if st.session_state.last_search:
     
     # Recupera os dados DA ÚLTIMA BUSCA CONFIRMADA (não dos seletores atuais)
     search_data = st.session_state.last_search
+    new_search = st.session_state.new_search
+    st.session_state.new_search = False
     
-    # Lógica para Região
-    main_region_param = None if search_data['region'] == "Nacional" else search_data['region']
-    
-    # Busca Principal com os dados CONGELADOS
-    main_result = service.get_consolidated_price(
-        brand_id=search_data['brand_id'], 
-        model_id=search_data['model_id'], 
-        year_model=search_data['year_model'],
-        region=main_region_param
-    )
+    # Só consulta no clique; outros reruns reaproveitam o último resultado
+    if new_search or 'last_results' not in st.session_state:
+        # Região buscada + comparativo nacional em uma única consulta (e um único log)
+        # "Nacional" é uma região como as outras: o batch já grava o rollup nacional
+        regions = [search_data['region']]
+        if search_data['region'] != NATIONAL_REGION:
+            regions.append(NATIONAL_REGION)
 
-    # Busca Nacional (se necessário)
-    national_result = None
-    if search_data['region'] != "Nacional":
-        national_result = service.get_consolidated_price(
+        results = service.get_consolidated_prices(
             brand_id=search_data['brand_id'], 
             model_id=search_data['model_id'], 
             year_model=search_data['year_model'],
-            region=None # Vai buscar onde region IS NULL (Média Nacional consolidada)
-        )
-    
-    # Se ainda assim não achar, tenta buscar explicitamente "Nacional" caso o banco salve assim
-    if search_data['region'] != "Nacional" and not national_result:
-         national_result = service.get_consolidated_price(
-            brand_id=search_data['brand_id'], 
-            model_id=search_data['model_id'], 
-            year_model=search_data['year_model'],
-            region="Nacional"
+            regions=regions,
+            last_n_months=CHART_MONTHS
         )
+        main_result = results[search_data['region']]
+        national_result = results.get(NATIONAL_REGION) if search_data['region'] != NATIONAL_REGION else None
+        st.session_state.last_results = (main_result, national_result)
+    else:
+        main_result, national_result = st.session_state.last_results
 
     if main_result:
-        label_hist = search_data['region'] if search_data['region'] != "Nacional" else "Nacional"
+        label_hist = search_data['region']
         # Só adiciona ao histórico se houve clique novo (opcional, ou add sempre que mostrar)
-        if btn_consultar:
+        if new_search:
             add_to_history(search_data['brand_name'], search_data['model_name'], search_data['year_model'], label_hist, main_result['current_price'])
 
         st.markdown(f"## 📊 Análise: {search_data['brand_name']} {search_data['model_name']}")
@@ -304,6 +459,10 @@ if st.session_state.last_search:
 
         with col2:
             # --- GRÁFICO ---
+            # Imports pesados só quando há gráfico: a landing page não paga por eles
+            import pandas as pd
+            import plotly.express as px
+
             df_chart = main_result['history_df'].copy()
             # Usa a região DA BUSCA (search_data) e não a selecionada no momento
             df_chart['Local'] = search_data['region']
@@ -324,7 +483,7 @@ if st.session_state.last_search:
             )
 
             fig.update_layout(
-                title=dict(text="Evolução de Preço (12 Meses)", font=dict(size=18, color="#2c3e50")),
+                title=dict(text=f"Evolução de Preço ({CHART_MONTHS} Meses)", font=dict(size=18, color="#2c3e50")),
                 paper_bgcolor="white", plot_bgcolor="white",
                 legend=dict(orientation="h", y=1.1, x=1),
                 hovermode="x unified",
@@ -339,6 +498,8 @@ if st.session_state.last_search:
 
             st.plotly_chart(fig, use_container_width=True)
 
+        render_region_matrix(search_data)
+
     else:
         st.warning(f"Sem dados para {search_data['model_name']} em {search_data['region']}.")
         
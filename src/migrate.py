@@ -0,0 +1,223 @@
+import sys
+import os
+
+# Adiciona a raiz do projeto ao PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse  # noqa: E402
+from typing import Set, Tuple  # noqa: E402
+from sqlalchemy import inspect, select, text  # noqa: E402
+from sqlalchemy.engine import Connection  # noqa: E402
+from src.database import engine, Base  # noqa: E402
+from src.models import MonthlyAverage, PriceCollection  # noqa: E402
+from src.partitions import PARTITIONED_TABLE, ensure_default_partition, ensure_month_partitions, is_partitioned  # noqa: E402
+from src.periods import MONTH_TIMEZONE_NAME  # noqa: E402
+
+# Valor das colunas novas nas linhas que já existiam, por dialeto. Colunas
+# sem entrada aqui ficam NULL (ex: content_hash das coletas antigas).
+BACKFILLS = {
+    ("price_collections", "month_key"): {
+        # Mês no calendário local (mesma regra de periods.to_month_key)
+        "postgresql": (
+            f"CAST(EXTRACT(YEAR FROM collected_at AT TIME ZONE '{MONTH_TIMEZONE_NAME}') * 100 "
+            f"+ EXTRACT(MONTH FROM collected_at AT TIME ZONE '{MONTH_TIMEZONE_NAME}') AS INTEGER)"
+        ),
+        "sqlite": "CAST(strftime('%Y%m', collected_at) AS INTEGER)",
+    },
+    ("monthly_averages", "month_key"): {
+        "default": "CAST(SUBSTR(month_ref, 1, 4) AS INTEGER) * 100 + CAST(SUBSTR(month_ref, 6, 2) AS INTEGER)",
+    },
+    ("batch_state", "last_collection_id"): {"default": "0"},
+    ("batch_state", "data_version"): {"default": "0"},
+}
+
+# Índices únicos criados sobre tabelas com dados: duplicatas antigas são
+# removidas antes (fica a linha de maior id, a última gravada pelo batch)
+DEDUPLICATE_BEFORE = {
+    "uq_monthly_averages_key": ("monthly_averages", ("model_id", "year_model", "region", "month_key")),
+}
+
+
+def _add_missing_columns(connection: Connection) -> Set[Tuple[str, str]]:
+    """ALTER TABLE ... ADD COLUMN para colunas do modelo que a tabela ainda não tem."""
+    inspector = inspect(connection)
+    added = set()
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            # Sempre nullable aqui: o NOT NULL só entra depois do backfill
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+            added.add((table.name, column.name))
+    return added
+
+
+def _nullable_required_columns(connection: Connection) -> Set[Tuple[str, str]]:
+    """Colunas NOT NULL no modelo que no banco ainda aceitam NULL."""
+    inspector = inspect(connection)
+    pending = set()
+    for table in Base.metadata.sorted_tables:
+        nullable = {column["name"] for column in inspector.get_columns(table.name) if column["nullable"]}
+        pending |= {
+            (table.name, column.name) for column in table.columns
+            if not column.nullable and not column.primary_key and column.name in nullable
+        }
+    return pending
+
+
+def _backfill(connection: Connection, table: str, column: str):
+    expressions = BACKFILLS.get((table, column))
+    if not expressions:
+        return
+    expression = expressions.get(connection.dialect.name, expressions.get("default"))
+    if expression:
+        connection.execute(text(f'UPDATE "{table}" SET "{column}" = {expression} WHERE "{column}" IS NULL'))
+
+
+def _deduplicate(connection: Connection, table: str, key: Tuple[str, ...]):
+    key_list = ", ".join(f'"{name}"' for name in key)
+    connection.execute(text(
+        f'DELETE FROM "{table}" WHERE id NOT IN (SELECT MAX(id) FROM "{table}" GROUP BY {key_list})'
+    ))
+
+
+def _create_missing_indexes(connection: Connection):
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.name in DEDUPLICATE_BEFORE:
+                _deduplicate(connection, *DEDUPLICATE_BEFORE[index.name])
+            index.create(connection)
+
+
+def upgrade_schema(connection: Connection):
+    """
+    Leva tabelas criadas por versões anteriores ao schema atual, de forma
+    idempotente (só faz o que falta):
+
+    1. adiciona as colunas novas (month_key, content_hash, source_id,
+       colunas de query_logs, batch_state.data_version...);
+    2. preenche as linhas antigas (month_key a partir de collected_at e
+       month_ref, contadores do batch_state em 0);
+    3. aplica o NOT NULL das colunas obrigatórias (no SQLite o ALTER
+       COLUMN não existe: a coluna fica nullable e o ORM preenche);
+    4. cria os índices que faltam, deduplicando antes os únicos (ex: a
+       chave natural usada pelo ON CONFLICT do batch).
+
+    A conversão de price_collections em tabela particionada reescreve a
+    tabela inteira e fica fora daqui (ver partition_price_collections).
+    """
+    added = _add_missing_columns(connection)
+    pending = added | _nullable_required_columns(connection)
+    for table, column in sorted(pending):
+        _backfill(connection, table, column)
+
+    if connection.dialect.name == "postgresql":
+        for table, column in sorted(_nullable_required_columns(connection)):
+            connection.execute(text(f'ALTER TABLE "{table}" ALTER COLUMN "{column}" SET NOT NULL'))
+
+    _create_missing_indexes(connection)
+    # Tabelas particionadas antes de existir a partição DEFAULT
+    ensure_default_partition(connection)
+
+
+def run_migrations(bind=None):
+    """
+    Cria as tabelas (e índices) que ainda não existem e atualiza as que
+    vieram de versões anteriores (upgrade_schema).
+
+    É um passo de deploy/startup: `python src/migrate.py`, ou uma única vez
+    por processo no app. Não deve rodar a cada rerun do Streamlit, porque o
+    create_all reflete o schema tabela por tabela.
+    """
+    bind = bind or engine
+    Base.metadata.create_all(bind=bind)
+    with bind.begin() as connection:
+        upgrade_schema(connection)
+
+
+def partition_price_collections(connection: Connection) -> int:
+    """
+    Converte uma price_collections comum (criada antes do particionamento)
+    na tabela particionada por mês e devolve quantas coletas foram copiadas.
+    Só Postgres; se a tabela já é particionada não faz nada.
+
+    Reescreve a tabela inteira em uma transação, sob ACCESS EXCLUSIVE:
+    leituras e escritas em price_collections esperam até o fim. Rodar em
+    janela de manutenção, com ingestão e batch parados:
+
+    1. a tabela antiga vira price_collections_legacy (índices e sequence
+       renomeados junto, liberando os nomes);
+    2. a nova é criada pelo modelo, com as partições iniciais e a DEFAULT,
+       mais uma partição por mês presente nos dados;
+    3. as coletas são copiadas com os mesmos ids e a sequence continua
+       do maior id (a marca d'água do batch segue válida);
+    4. a tabela antiga é apagada.
+    """
+    if connection.dialect.name != "postgresql" or is_partitioned(connection):
+        return 0
+
+    legacy = f"{PARTITIONED_TABLE}_legacy"
+    connection.execute(text(f'LOCK TABLE "{PARTITIONED_TABLE}" IN ACCESS EXCLUSIVE MODE'))
+    connection.execute(text(f'ALTER TABLE "{PARTITIONED_TABLE}" RENAME TO "{legacy}"'))
+    indexes = connection.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :table"
+    ), {"table": legacy}).scalars().all()
+    for name in indexes:
+        connection.execute(text(f'ALTER INDEX "{name}" RENAME TO "{name}_legacy"'))
+    sequence = connection.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": legacy}).scalar()
+    if sequence:
+        connection.execute(text(f'ALTER SEQUENCE {sequence} RENAME TO "{legacy}_id_seq"'))
+
+    # after_create (models) já cria a DEFAULT e os meses correntes
+    PriceCollection.__table__.create(connection)
+    months = connection.execute(text(f'SELECT DISTINCT month_key FROM "{legacy}"')).scalars().all()
+    ensure_month_partitions(connection, months)
+
+    columns = ", ".join(f'"{column.name}"' for column in PriceCollection.__table__.columns)
+    copied = connection.execute(text(
+        f'INSERT INTO "{PARTITIONED_TABLE}" ({columns}) SELECT {columns} FROM "{legacy}"'
+    )).rowcount
+    connection.execute(text(
+        f"SELECT setval(pg_get_serial_sequence(:table, 'id'), "
+        f'(SELECT COALESCE(MAX(id), 0) + 1 FROM "{PARTITIONED_TABLE}"), false)'
+    ), {"table": PARTITIONED_TABLE})
+    connection.execute(text(f'DROP TABLE "{legacy}"'))
+    return copied
+
+
+def check_database_ready(bind=None):
+    """
+    Verificação leve de prontidão: uma única consulta na tabela lida pela
+    página, sem reflexão de schema. Levanta exceção se o banco estiver
+    inacessível ou se a migração ainda não rodou.
+    """
+    with (bind or engine).connect() as conn:
+        conn.execute(select(MonthlyAverage.id).limit(1)).first()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cria/atualiza o schema do CarFlow")
+    parser.add_argument(
+        "--partition-price-collections", action="store_true",
+        help="Converte price_collections em tabela particionada por mês (Postgres; bloqueia a tabela durante a cópia)",
+    )
+    args = parser.parse_args()
+
+    print("Aplicando schema do CarFlow...")
+    run_migrations()
+
+    with engine.begin() as connection:
+        if args.partition_price_collections:
+            print("Convertendo price_collections em tabela particionada...")
+            print(f"{partition_price_collections(connection)} coletas copiadas.")
+        elif connection.dialect.name == "postgresql" and not is_partitioned(connection):
+            print("Aviso: price_collections não é particionada. Para converter: python src/migrate.py --partition-price-collections")
+
+    check_database_ready()
+    print("Schema pronto.")
@@ -1,6 +1,12 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from datetime import datetime, timezone
+from sqlalchemy import BigInteger, Column, Integer, String, Float, DateTime, ForeignKey, Index, PrimaryKeyConstraint, event
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql import func
 from src.database import Base
+from src.periods import ref_to_month_key, to_month_key
+
+# Região usada nas linhas de média nacional geradas pelo batch (rollup de todas as regiões)
+NATIONAL_REGION = "Nacional"
 
 class Brand(Base):
     __tablename__ = "brands"
@@ -9,14 +15,53 @@ class Brand(Base):
 
 class Model(Base):
     __tablename__ = "models"
+    __table_args__ = (
+        # Lista de modelos por marca já ordenada por nome
+        Index("ix_models_brand_name", "brand_id", "name"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     brand_id = Column(Integer, ForeignKey("brands.id"))
     name = Column(String, index=True)
     vehicle_type = Column(String) # Carro, Moto, Caminhão
 
+def _collected_month_key(context):
+    # Preenchido na ingestão a partir do collected_at (ou do instante atual,
+    # quando o collected_at fica para o server_default)
+    collected_at = context.get_current_parameters().get("collected_at")
+    return to_month_key(collected_at or datetime.now(timezone.utc))
+
+@compiles(PrimaryKeyConstraint, "postgresql")
+def _partitioned_primary_key(constraint, compiler, **kw):
+    # Em tabela particionada a PK precisa conter a chave de partição. Só o
+    # DDL muda: para o ORM (e no SQLite) a PK continua sendo apenas o id.
+    ddl = compiler.visit_primary_key_constraint(constraint, **kw)
+    partition_key = constraint.table.info.get("partition_key") if constraint.table is not None else None
+    if partition_key and ddl and partition_key not in constraint.columns:
+        ddl = ddl[:ddl.rindex(")")] + f", {compiler.preparer.quote(partition_key)})" + ddl[ddl.rindex(")") + 1:]
+    return ddl
+
 class PriceCollection(Base):
-    """Coletas de preços brutas (antes da consolidação)"""
+    """
+    Coletas de preços brutas (antes da consolidação).
+
+    No Postgres a tabela é particionada por faixa de month_key (uma
+    partição por mês, criadas por src/partitions.py): o batch e consultas
+    filtradas por mês leem só as partições envolvidas, e descartar meses
+    antigos é um DETACH/DROP de partição em vez de um DELETE.
+    """
     __tablename__ = "price_collections"
+    __table_args__ = (
+        # Agrupamento do batch por mês via índice (sem função por linha)
+        Index("ix_price_collections_month_group", "month_key", "model_id", "year_model", "region"),
+        # Deduplicação na ingestão (INSERT ... ON CONFLICT DO NOTHING). Linhas
+        # sem hash (seed, cadastros manuais) ficam fora: NULL não conflita.
+        # O month_key entra porque índice único em tabela particionada precisa
+        # da chave de partição (o hash já cobre o collected_at, logo o mês).
+        Index("uq_price_collections_content_hash", "content_hash", "month_key", unique=True),
+        # sqlite_autoincrement: ids nunca são reaproveitados (o batch usa o id
+        # como marca d'água e o arquivamento apaga os maiores ids de um mês)
+        {"postgresql_partition_by": "RANGE (month_key)", "info": {"partition_key": "month_key"}, "sqlite_autoincrement": True},
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     model_id = Column(Integer, ForeignKey("models.id"))
@@ -24,16 +69,42 @@ class PriceCollection(Base):
     price = Column(Float)
     region = Column(String) # Estado ou Região
     collected_at = Column(DateTime(timezone=True), server_default=func.now())
+    month_key = Column(Integer, nullable=False, default=_collected_month_key) # Mês da coleta (YYYYMM)
+    source_id = Column(String, nullable=True) # Id do anúncio no scraper de origem
+    content_hash = Column(BigInteger, nullable=True) # Hash de 64 bits do conteúdo (ver src/ingest.py)
+
+@event.listens_for(PriceCollection.__table__, "after_create")
+def _create_initial_partitions(target, connection, **kw):
+    # Tabela particionada sem partição não aceita insert: já nasce com os meses correntes
+    if connection.dialect.name == "postgresql":
+        from src.partitions import create_initial_partitions
+        create_initial_partitions(connection)
+
+def _month_ref_key(context):
+    return ref_to_month_key(context.get_current_parameters()["month_ref"])
 
 class MonthlyAverage(Base):
     """Tabela consolidada (Otimizada para leitura na consulta pública)"""
     __tablename__ = "monthly_averages"
+    __table_args__ = (
+        # Chave natural usada pelo upsert do batch (INSERT ... ON CONFLICT) e
+        # índice de cobertura da consulta pública: filtra por modelo/ano/região
+        # e já entrega ordenado por mês. No Postgres os valores lidos pela
+        # consulta vão no INCLUDE, permitindo Index Only Scan.
+        Index(
+            "uq_monthly_averages_key",
+            "model_id", "year_model", "region", "month_key",
+            unique=True,
+            postgresql_include=["id", "month_ref", "avg_price", "samples_count"],
+        ),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     brand_id = Column(Integer, ForeignKey("brands.id"))
     model_id = Column(Integer, ForeignKey("models.id"))
-    year_model = Column(Integer, index=True)
-    month_ref = Column(String, index=True) # Formato YYYY-MM
+    year_model = Column(Integer)
+    month_ref = Column(String) # Formato YYYY-MM (exibição)
+    month_key = Column(Integer, nullable=False, default=_month_ref_key) # Mesmo mês como inteiro YYYYMM (filtros e ordenação)
     region = Column(String, index=True, nullable=True) # Região consolidada
     
     avg_price = Column(Float)
@@ -49,5 +120,25 @@ class QueryLog(Base):
     model_id = Column(Integer, nullable=True)
     year_model = Column(Integer, nullable=True)
     region = Column(String, nullable=True) # Adicionado para análises regionais
-    status = Column(String) # SUCCESS, NO_RESULT, ERROR
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    status = Column(String) # SUCCESS, NO_RESULT, ERROR, BULK
+    # Só na avaliação em lote (um log por lote): itens pedidos e encontrados
+    items_requested = Column(Integer, nullable=True)
+    items_matched = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ArchivedMonth(Base):
+    """Meses de price_collections movidos para o arquivo Parquet (src/archive.py)"""
+    __tablename__ = "archived_months"
+
+    month_key = Column(Integer, primary_key=True) # Mês arquivado (YYYYMM)
+    archive_dir = Column(String, nullable=False) # Raiz do arquivo Parquet onde o mês está
+    archived_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class BatchState(Base):
+    """Controle do processamento batch (marca d'água do incremental)"""
+    __tablename__ = "batch_state"
+
+    name = Column(String, primary_key=True) # Nome do processo (ex: monthly_averages)
+    last_collection_id = Column(Integer, nullable=False, default=0) # Maior price_collections.id já consolidado
+    data_version = Column(Integer, nullable=False, default=0) # Incrementada a cada batch commitado (invalida caches)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
\ No newline at end of file
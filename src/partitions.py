@@ -0,0 +1,171 @@
+import sys
+import os
+
+# Adiciona a raiz do projeto ao PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse  # noqa: E402
+import re  # noqa: E402
+from datetime import datetime  # noqa: E402
+from typing import Iterable, List, Optional  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+from sqlalchemy.engine import Connection  # noqa: E402
+from src.database import engine  # noqa: E402
+from src.periods import ref_to_month_key, shift_month_key, to_month_key  # noqa: E402
+
+# Tabela particionada por mês (RANGE em month_key, ver models.PriceCollection)
+PARTITIONED_TABLE = "price_collections"
+
+# Partições criadas junto com a tabela: histórico do seed + meses à frente
+INITIAL_PAST_MONTHS = 12
+FUTURE_MONTHS = 3
+
+# Recebe coletas de meses ainda sem partição (insert nunca falha por falta
+# de partição); ensure_month_partitions move essas linhas para o mês certo
+DEFAULT_PARTITION = f"{PARTITIONED_TABLE}_default"
+
+# Advisory lock (por transação) que serializa a criação de partições entre
+# ingestões concorrentes
+PARTITION_LOCK_KEY = f"{PARTITIONED_TABLE}_partitions"
+
+_PARTITION_NAME = re.compile(rf"^{PARTITIONED_TABLE}_(\d{{6}})$")
+
+
+def partition_name(month_key: int) -> str:
+    return f"{PARTITIONED_TABLE}_{month_key}"
+
+
+def is_partitioned(connection: Connection) -> bool:
+    """True se price_collections existe como tabela particionada (Postgres)."""
+    if connection.dialect.name != "postgresql":
+        return False
+    relkind = connection.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {"table": PARTITIONED_TABLE}
+    ).scalar()
+    return relkind == "p"
+
+
+def list_month_partitions(connection: Connection) -> List[int]:
+    """Meses (YYYYMM) que já têm partição anexada à tabela."""
+    if not is_partitioned(connection):
+        return []
+    names = connection.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = to_regclass(:table)"
+    ), {"table": PARTITIONED_TABLE}).scalars()
+    return sorted(int(match.group(1)) for match in map(_PARTITION_NAME.match, names) if match)
+
+
+def ensure_default_partition(connection: Connection) -> bool:
+    """Cria a partição DEFAULT se ela não existir. Devolve True se criou."""
+    if not is_partitioned(connection):
+        return False
+    exists = connection.execute(text("SELECT to_regclass(:name)"), {"name": DEFAULT_PARTITION}).scalar()
+    if exists:
+        return False
+    connection.execute(text(f'CREATE TABLE IF NOT EXISTS "{DEFAULT_PARTITION}" PARTITION OF "{PARTITIONED_TABLE}" DEFAULT'))
+    return True
+
+
+def _create_month_partition(connection: Connection, month_key: int):
+    name = partition_name(month_key)
+    bounds = f"FROM ({month_key}) TO ({shift_month_key(month_key, 1)})"
+    has_default = connection.execute(text("SELECT to_regclass(:name)"), {"name": DEFAULT_PARTITION}).scalar()
+    in_default = has_default and connection.execute(text(
+        f'SELECT 1 FROM "{DEFAULT_PARTITION}" WHERE month_key >= :start AND month_key < :end LIMIT 1'
+    ), {"start": month_key, "end": shift_month_key(month_key, 1)}).scalar()
+    if not in_default:
+        connection.execute(text(f'CREATE TABLE "{name}" PARTITION OF "{PARTITIONED_TABLE}" FOR VALUES {bounds}'))
+        return
+
+    # O mês já tem coletas na DEFAULT: o PARTITION OF falharia. Monta a
+    # tabela do mês com essas linhas e só então a anexa.
+    connection.execute(text(f'CREATE TABLE "{name}" (LIKE "{PARTITIONED_TABLE}" INCLUDING DEFAULTS)'))
+    connection.execute(text(
+        f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" WHERE month_key >= :start AND month_key < :end RETURNING *) '
+        f'INSERT INTO "{name}" SELECT * FROM moved'
+    ), {"start": month_key, "end": shift_month_key(month_key, 1)})
+    connection.execute(text(f'ALTER TABLE "{PARTITIONED_TABLE}" ATTACH PARTITION "{name}" FOR VALUES {bounds}'))
+
+
+def ensure_month_partitions(connection: Connection, month_keys: Iterable[int]) -> List[int]:
+    """
+    Cria as partições mensais que faltam para `month_keys` e devolve os
+    meses criados. Fora do Postgres (ou com a tabela ainda não
+    particionada) não faz nada: a carga segue para a tabela única.
+
+    A criação roda sob um advisory lock da transação: ingestões
+    concorrentes esperam umas pelas outras e relêem as partições
+    existentes em vez de disputar o mesmo CREATE TABLE.
+    """
+    wanted = sorted({int(key) for key in month_keys})
+    if not wanted or not is_partitioned(connection):
+        return []
+
+    missing = set(wanted) - set(list_month_partitions(connection))
+    if not missing:
+        return []
+
+    connection.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": PARTITION_LOCK_KEY})
+    created = []
+    for month_key in sorted(missing - set(list_month_partitions(connection))):
+        _create_month_partition(connection, month_key)
+        created.append(month_key)
+    return created
+
+
+def detach_month_partitions(connection: Connection, before_month_key: int, drop: bool = False) -> List[int]:
+    """
+    Desanexa (e com `drop`, apaga) as partições de meses anteriores a
+    `before_month_key`. É operação de catálogo: não varre nem apaga linha a
+    linha. Sem `drop` a tabela do mês fica disponível para arquivamento.
+    """
+    removed = []
+    for month_key in list_month_partitions(connection):
+        if month_key >= before_month_key:
+            continue
+        name = partition_name(month_key)
+        connection.execute(text(f'ALTER TABLE "{PARTITIONED_TABLE}" DETACH PARTITION "{name}"'))
+        if drop:
+            connection.execute(text(f'DROP TABLE "{name}"'))
+        removed.append(month_key)
+    return removed
+
+
+def create_initial_partitions(connection: Connection, today: Optional[datetime] = None) -> List[int]:
+    """
+    Partição DEFAULT mais as do mês atual, dos INITIAL_PAST_MONTHS
+    anteriores e dos FUTURE_MONTHS seguintes.
+    """
+    ensure_default_partition(connection)
+    current = to_month_key(today or datetime.now())
+    return ensure_month_partitions(
+        connection, (shift_month_key(current, offset) for offset in range(-INITIAL_PAST_MONTHS, FUTURE_MONTHS + 1))
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manutenção das partições mensais de price_collections (Postgres)")
+    parser.add_argument("--ahead", type=int, default=FUTURE_MONTHS, help="Garante partições do mês atual e de N meses à frente (coletas já na DEFAULT são movidas)")
+    parser.add_argument("--detach-before", metavar="YYYY-MM", help="Desanexa as partições de meses anteriores a este")
+    parser.add_argument("--drop", action="store_true", help="Com --detach-before, também apaga as partições desanexadas")
+    args = parser.parse_args()
+
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            print("price_collections não é particionada (apenas Postgres, tabela criada pelo migrate). Nada a fazer.")
+            sys.exit(0)
+
+        if ensure_default_partition(connection):
+            print(f"Partição criada: {DEFAULT_PARTITION}")
+        current = to_month_key(datetime.now())
+        created = ensure_month_partitions(connection, (shift_month_key(current, m) for m in range(args.ahead + 1)))
+        print(f"Partições criadas: {', '.join(map(partition_name, created)) or 'nenhuma'}")
+
+        if args.detach_before:
+            removed = detach_month_partitions(connection, ref_to_month_key(args.detach_before), drop=args.drop)
+            action = "Apagadas" if args.drop else "Desanexadas"
+            print(f"{action}: {', '.join(map(partition_name, removed)) or 'nenhuma'}")
+
+        print(f"Partições atuais: {len(list_month_partitions(connection))}")
@@ -0,0 +1,40 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# Fuso que define o mês de uma coleta (calendário local do mercado). Datas
+# com fuso são convertidas para ele; datas sem fuso já são horário local.
+MONTH_TIMEZONE_NAME = "America/Sao_Paulo"
+MONTH_TIMEZONE = ZoneInfo(MONTH_TIMEZONE_NAME)
+
+
+def to_month_key(value: datetime) -> int:
+    """
+    Chave inteira do mês (YYYYMM) de uma data. Ex: 2026-01-15 -> 202601.
+    Com fuso, o mês é o do horário de MONTH_TIMEZONE: 2024-01-31T22:00-03:00
+    (01:00 UTC de fevereiro) ainda é 202401.
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(MONTH_TIMEZONE)
+    return value.year * 100 + value.month
+
+
+def month_key_to_ref(key: int) -> str:
+    """Converte a chave YYYYMM para o formato de exibição YYYY-MM."""
+    return f"{key // 100:04d}-{key % 100:02d}"
+
+
+def ref_to_month_key(ref: str) -> int:
+    """Converte YYYY-MM para a chave inteira YYYYMM. Ex: "2026-01" -> 202601."""
+    year, month = ref.split("-")[:2]
+    return int(year) * 100 + int(month)
+
+
+def shift_month_key(key, months: int):
+    """
+    Soma (ou subtrai) meses de uma chave YYYYMM. Ex: (202601, -1) -> 202512.
+    Usa apenas //, % e aritmética inteira, então também aceita expressões
+    SQLAlchemy (o cálculo vai para o SQL e a coluna comparada segue livre
+    para uso de índice).
+    """
+    index = (key // 100) * 12 + key % 100 - 1 + months
+    return (index // 12) * 100 + index % 12 + 1
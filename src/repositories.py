@@ -1,12 +1,29 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import select, desc
-from typing import List, Optional
+from sqlalchemy.orm import Session, aliased, load_only
+from sqlalchemy import Integer, String, and_, column, desc, func, or_, select, values
+from typing import Dict, List, Optional, Sequence, Tuple
 
+from src.log_sink import QueryLogSink
 from src.models import Brand, Model, MonthlyAverage, QueryLog
+from src.periods import shift_month_key
+
+# Colunas lidas pelo histórico de preços (cobertas pelo índice da consulta pública)
+HISTORY_COLUMNS = (
+    MonthlyAverage.model_id,
+    MonthlyAverage.year_model,
+    MonthlyAverage.region,
+    MonthlyAverage.month_key,
+    MonthlyAverage.month_ref,
+    MonthlyAverage.avg_price,
+    MonthlyAverage.samples_count,
+)
+
+# Chaves (modelo, ano, região) por consulta na avaliação em lote
+BULK_KEYS_CHUNK = 500
 
 class CarRepository:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, log_sink: Optional[QueryLogSink] = None):
         self.db = db
+        self.log_sink = log_sink
 
     def get_brands(self) -> List[Brand]:
         statement = select(Brand).order_by(Brand.name)
@@ -16,6 +33,15 @@ class CarRepository:
         statement = select(Model).where(Model.brand_id == brand_id).order_by(Model.name)
         return self.db.execute(statement).scalars().all()
 
+    def get_catalog(self) -> List[Tuple[int, str, int, str]]:
+        """Catálogo completo (brand_id, marca, model_id, modelo) em uma consulta, para indexar em memória."""
+        statement = (
+            select(Brand.id, Brand.name, Model.id, Model.name)
+            .join(Model, Model.brand_id == Brand.id)
+            .order_by(Brand.name, Model.name)
+        )
+        return [tuple(row) for row in self.db.execute(statement).all()]
+
     def get_years_by_model(self, model_id: int) -> List[int]:
         # Busca anos distintos disponíveis na tabela consolidada
         statement = (
@@ -30,29 +56,168 @@ class CarRepository:
         statement = select(MonthlyAverage.region).distinct().order_by(MonthlyAverage.region)
         return self.db.execute(statement).scalars().all()
 
-    def get_price_history(self, model_id: int, year_model: int, region: Optional[str] = None) -> List[MonthlyAverage]:
-        query = (
-            select(MonthlyAverage)
+    def get_price_history(
+        self,
+        model_id: int,
+        year_model: int,
+        region: Optional[str] = None,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        last_n_months: Optional[int] = None,
+    ) -> List[MonthlyAverage]:
+        """
+        Histórico mensal ordenado por mês. since/until são chaves YYYYMM
+        (inclusivas); last_n_months limita aos N meses até o último mês
+        disponível. Todos os filtros vão para o SQL sobre month_key.
+        """
+        filters = [
+            MonthlyAverage.model_id == model_id,
+            MonthlyAverage.year_model == year_model
+        ]
+        
+        if region:
+            filters.append(MonthlyAverage.region == region)
+
+        return self._history(filters, since, until, last_n_months)
+
+    def get_price_histories(
+        self,
+        model_id: int,
+        year_model: int,
+        regions: Sequence[str],
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        last_n_months: Optional[int] = None,
+    ) -> Dict[str, List[MonthlyAverage]]:
+        """
+        Histórico de várias regiões (ex: a buscada + "Nacional") em uma
+        única consulta. Retorna {região: histórico ordenado por mês} na ordem
+        de `regions`; last_n_months conta a partir do último mês entre elas.
+        """
+        filters = [
+            MonthlyAverage.model_id == model_id,
+            MonthlyAverage.year_model == year_model,
+            MonthlyAverage.region.in_(list(regions)),
+        ]
+
+        histories: Dict[str, List[MonthlyAverage]] = {region: [] for region in regions}
+        for row in self._history(filters, since, until, last_n_months):
+            histories[row.region].append(row)
+        return histories
+
+    def get_latest_prices(self, keys: Sequence[Tuple[int, int, str]]) -> List[MonthlyAverage]:
+        """
+        Último mês disponível de cada chave (model_id, year_model, region),
+        em consultas set-based de até BULK_KEYS_CHUNK chaves. O mês mais
+        recente vem de um max(month_key) correlacionado, que é uma busca
+        pontual no índice uq_monthly_averages_key. Chaves sem dado não
+        aparecem no resultado.
+        """
+        newer = aliased(MonthlyAverage)
+        latest_month = (
+            select(func.max(newer.month_key))
             .where(
-                MonthlyAverage.model_id == model_id,
-                MonthlyAverage.year_model == year_model
+                newer.model_id == MonthlyAverage.model_id,
+                newer.year_model == MonthlyAverage.year_model,
+                newer.region == MonthlyAverage.region,
             )
+            .scalar_subquery()
         )
-        
-        if region:
-            query = query.where(MonthlyAverage.region == region)
+        postgres = self.db.get_bind().dialect.name == "postgresql"
+
+        latest: List[MonthlyAverage] = []
+        for start in range(0, len(keys), BULK_KEYS_CHUNK):
+            chunk = list(keys[start:start + BULK_KEYS_CHUNK])
+            query = (
+                select(MonthlyAverage)
+                .options(load_only(*HISTORY_COLUMNS))
+                .where(MonthlyAverage.month_key == latest_month)
+            )
+            if postgres:
+                # JOIN com lista VALUES: cada chave vira um index scan
+                wanted = values(
+                    column("model_id", Integer), column("year_model", Integer), column("region", String),
+                    name="wanted",
+                ).data(chunk)
+                query = query.join(wanted, and_(
+                    MonthlyAverage.model_id == wanted.c.model_id,
+                    MonthlyAverage.year_model == wanted.c.year_model,
+                    MonthlyAverage.region == wanted.c.region,
+                ))
+            else:
+                # SQLite não aceita VALUES com nomes de coluna nem usa índice em
+                # (a, b, c) IN (...): OR de igualdades vira MULTI-INDEX OR
+                query = query.where(or_(*(
+                    and_(
+                        MonthlyAverage.model_id == model_id,
+                        MonthlyAverage.year_model == year_model,
+                        MonthlyAverage.region == region,
+                    )
+                    for model_id, year_model, region in chunk
+                )))
+            latest.extend(self.db.execute(query).scalars().all())
+        return latest
+
+    def _history(
+        self,
+        filters: list,
+        since: Optional[int],
+        until: Optional[int],
+        last_n_months: Optional[int],
+    ) -> List[MonthlyAverage]:
+        filters = list(filters)
+        if since is not None:
+            filters.append(MonthlyAverage.month_key >= since)
+        if until is not None:
+            filters.append(MonthlyAverage.month_key <= until)
+
+        # Só as colunas cobertas pelo índice uq_monthly_averages_key
+        query = (
+            select(MonthlyAverage)
+            .options(load_only(*HISTORY_COLUMNS))
+            .where(*filters)
+        )
+
+        if last_n_months:
+            # Início da janela calculado no próprio SQL a partir do último mês
+            # (subquery escalar): a coluna fica livre para o range scan no índice
+            window_start = (
+                select(shift_month_key(func.max(MonthlyAverage.month_key), 1 - last_n_months))
+                .where(*filters)
+                .scalar_subquery()
+            )
+            query = query.where(MonthlyAverage.month_key >= window_start)
             
-        query = query.order_by(MonthlyAverage.month_ref)
+        query = query.order_by(MonthlyAverage.month_key)
         
         return self.db.execute(query).scalars().all()
 
-    def create_log(self, brand_id: Optional[int], model_id: Optional[int], year_model: Optional[int], status: str, region: Optional[str] = None):
+    def create_log(
+        self,
+        brand_id: Optional[int],
+        model_id: Optional[int],
+        year_model: Optional[int],
+        status: str,
+        region: Optional[str] = None,
+        items_requested: Optional[int] = None,
+        items_matched: Optional[int] = None,
+    ):
+        # Com sink configurado o log só é enfileirado (gravação em lote em background)
+        if self.log_sink is not None:
+            self.log_sink.submit(
+                brand_id, model_id, year_model, status, region,
+                items_requested=items_requested, items_matched=items_matched
+            )
+            return
+
         log = QueryLog(
             brand_id=brand_id,
             model_id=model_id,
             year_model=year_model,
             status=status,
-            region=region
+            region=region,
+            items_requested=items_requested,
+            items_matched=items_matched
         )
         self.db.add(log)
-        self.db.commit()
\ No newline at end of file
+        self.db.commit()
@@ -4,11 +4,17 @@ import os
 # Adiciona a raiz do projeto ao PYTHONPATH
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-import random  # noqa: E402
-from datetime import datetime, timedelta  # noqa: E402
+import argparse  # noqa: E402
+import time  # noqa: E402
+from datetime import datetime  # noqa: E402
+from typing import Dict, Iterator, List, Optional, Tuple  # noqa: E402
+import numpy as np  # noqa: E402
 from sqlalchemy import text  # noqa: E402
+from src.bulk_load import copy_dataframe  # noqa: E402
 from src.database import SessionLocal, engine, Base  # noqa: E402
 from src.models import Brand, Model, PriceCollection  # noqa: E402
+from src.partitions import ensure_month_partitions  # noqa: E402
+from src.periods import MONTH_TIMEZONE_NAME  # noqa: E402
 
 # Catálogo Expandido
 MODELS_DATA = {
@@ -23,9 +29,99 @@ MODELS_DATA = {
 REGIONS = ["SP", "RJ", "MG", "RS", "PR", "BA", "DF", "SC", "PE"]
 YEARS = [2022, 2023, 2024, 2025] # Anos disponíveis para gerar
 
-def seed_database():
-    print("🚀 Iniciando Seed Otimizado (Volume Alto & Anos Variados)...")
-    
+# Fatores de preço por região (demais regiões = 1.0)
+REGIONAL_FACTORS = {"SP": 1.03, "BA": 0.96}
+
+# Meses de histórico (mês atual + 12 anteriores)
+HISTORY_MONTHS = 13
+
+# Coletas por modelo/região/mês/ano na escala 1.0 (intervalo fechado)
+COLLECTIONS_PER_CELL = (10, 25)
+
+# Semente padrão: mesma escala + mesma semente = mesmos dados
+DEFAULT_SEED = 42
+
+
+def generate_collections(
+    models: List[Tuple[int, float]],
+    scale: float = 1.0,
+    seed: int = DEFAULT_SEED,
+    today: Optional[datetime] = None,
+) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Gera as coletas sintéticas em colunas NumPy, um bloco por modelo (a
+    memória fica limitada ao maior modelo, não ao total).
+
+    `scale` multiplica o número de coletas por modelo/região/mês/ano: 1.0
+    dá ~140 mil linhas no catálogo padrão, 72 passa de 10 milhões. O
+    modelo de preço é o mesmo de sempre: fatores de região, depreciação
+    por mês da coleta, ano do modelo e volatilidade de ±5%.
+    """
+    rng = np.random.default_rng(seed)
+    today = np.datetime64(today or datetime.now(), "s")
+    regions = np.array(REGIONS)
+    regional_factors = np.array([REGIONAL_FACTORS.get(r, 1.0) for r in REGIONS])
+
+    # Grade região x mês x ano (uma célula por combinação)
+    region_idx, month_offset, year_model = (
+        grid.ravel() for grid in np.meshgrid(
+            np.arange(len(REGIONS)), np.arange(HISTORY_MONTHS), np.array(YEARS), indexing="ij"
+        )
+    )
+    low, high = COLLECTIONS_PER_CELL
+
+    for model_id, base_price in models:
+        counts = np.rint(rng.integers(low, high + 1, size=region_idx.size) * scale).astype(np.int64)
+        total = int(counts.sum())
+        cell_region = np.repeat(region_idx, counts)
+        cell_offset = np.repeat(month_offset, counts)
+        cell_year = np.repeat(year_model, counts)
+
+        # Mês de referência (30 dias por mês) com jitter de ±10 dias
+        day_jitter = rng.integers(-10, 11, size=total)
+        collected_at = today - (cell_offset * 30 - day_jitter) * np.timedelta64(1, "D")
+
+        # Fatores de Preço: região, depreciação do tempo, ano do modelo e volatilidade
+        time_factor = 1.0 - cell_offset * 0.005
+        year_factor = 1.0 + (cell_year - 2024) * 0.10
+        volatility = rng.uniform(0.95, 1.05, size=total)
+        price = base_price * regional_factors[cell_region] * time_factor * year_factor * volatility
+
+        # month_key (YYYYMM) calculado aqui: o COPY não passa pelo default do ORM
+        months = collected_at.astype("datetime64[M]").astype(np.int64)
+
+        yield {
+            "model_id": np.full(total, model_id),
+            "year_model": cell_year,
+            "price": price,
+            "region": regions[cell_region],
+            "collected_at": collected_at,
+            "month_key": (months // 12 + 1970) * 100 + months % 12 + 1,
+        }
+
+
+def _create_catalog(db) -> List[Tuple[int, float]]:
+    # Marcas e modelos em um flush cada (ids vêm de volta no mesmo round trip)
+    brands = {name: Brand(name=name) for name in MODELS_DATA}
+    db.add_all(brands.values())
+    db.flush()
+
+    models = [
+        (Model(name=m_name, brand_id=brands[brand_name].id, vehicle_type="Carro"), base_price)
+        for brand_name, items in MODELS_DATA.items()
+        for m_name, base_price in items
+    ]
+    db.add_all([model for model, _ in models])
+    db.flush()
+    db.commit()
+    return [(model.id, base_price) for model, base_price in models]
+
+
+def seed_database(scale: float = 1.0, seed: int = DEFAULT_SEED):
+    import pandas as pd
+
+    print(f"🚀 Iniciando Seed Vetorizado (escala {scale}, semente {seed})...")
+
     # Tenta limpar conexões
     try:
         with engine.connect() as connection:
@@ -46,71 +142,25 @@ def seed_database():
 
     try:
         # 1. Marcas e Modelos
-        models_list = []
-        for brand_name, models in MODELS_DATA.items():
-            brand = Brand(name=brand_name)
-            db.add(brand)
-            db.commit()
-            db.refresh(brand)
-            
-            for m_name, base_price in models:
-                model = Model(name=m_name, brand_id=brand.id, vehicle_type="Carro")
-                db.add(model)
-                db.commit()
-                db.refresh(model)
-                models_list.append((model.id, base_price))
-
-        # 2. Geração Massiva
+        models = _create_catalog(db)
+
+        # 2. Geração Massiva (um bloco por modelo, gravado via COPY)
         print("Gerando histórico...")
-        collections = []
-        today = datetime.now()
-        
-        for model_id, base_price in models_list:
-            for region in REGIONS:
-                for month_offset in range(13): 
-                    ref_date = today - timedelta(days=30 * month_offset)
-                    
-                    # Gera dados para CADA ano disponível
-                    for year_model in YEARS:
-                        # Menos coletas para anos mais velhos ou muito novos (opcional)
-                        num_coletas = random.randint(10, 25)
-                        
-                        for _ in range(num_coletas):
-                            day_jitter = random.randint(-10, 10)
-                            final_date = ref_date + timedelta(days=day_jitter)
-                            
-                            # Fatores de Preço
-                            # 1. Região
-                            regional_factor = 1.03 if region == "SP" else (0.96 if region == "BA" else 1.0)
-                            
-                            # 2. Depreciação do Tempo (Mês da coleta)
-                            time_factor = 1.0 - (month_offset * 0.005)
-                            
-                            # 3. Fator do Ano do Modelo (Carro 2025 é mais caro que 2022)
-                            # Ex: Se base é 2024, 2025 vale +10%, 2023 vale -10%
-                            year_factor = 1.0 + ((year_model - 2024) * 0.10)
-                            
-                            volatility = random.uniform(0.95, 1.05)
-                            
-                            final_price = base_price * regional_factor * time_factor * year_factor * volatility
-                            
-                            c = PriceCollection(
-                                model_id=model_id,
-                                year_model=year_model, # <--- AGORA É DINÂMICO
-                                price=final_price,
-                                region=region,
-                                collected_at=final_date
-                            )
-                            collections.append(c)
-        
-        # Salva em lotes
-        print(f"Salvando {len(collections)} registros...")
-        for i in range(0, len(collections), 2000):
-            db.add_all(collections[i:i+2000])
-            db.commit()
-            print(f"Lote {i} salvo...")
-            
-        print("✅ Banco populado com sucesso!")
+        started = time.perf_counter()
+        total = 0
+        with engine.connect() as connection:
+            for block in generate_collections(models, scale=scale, seed=seed):
+                ensure_month_partitions(connection, np.unique(block["month_key"]))
+                frame = pd.DataFrame(block)
+                # Datas geradas são horário local: gravadas com o fuso, para
+                # bater com o month_key calculado acima (ver periods.to_month_key)
+                frame["collected_at"] = frame["collected_at"].dt.tz_localize(MONTH_TIMEZONE_NAME)
+                total += copy_dataframe(connection, PriceCollection.__table__, frame)
+                connection.commit()
+                print(f"{total} registros salvos...")
+
+        elapsed = time.perf_counter() - started
+        print(f"✅ Banco populado com sucesso! {total} coletas em {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f}/s)")
 
     except Exception as e:
         print(e)
@@ -119,4 +169,9 @@ def seed_database():
         db.close()
 
 if __name__ == "__main__":
-    seed_database()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Popula o banco com coletas sintéticas (CarFlow)")
+    parser.add_argument("--scale", type=float, default=1.0, help="Fator de volume (1.0 ≈ 140 mil coletas, 72 ≈ 10 milhões)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Semente do gerador (mesma semente = mesmos dados)")
+    args = parser.parse_args()
+
+    seed_database(scale=args.scale, seed=args.seed)
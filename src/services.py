@@ -1,12 +1,29 @@
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any, Optional
-import pandas as pd
+from typing import TYPE_CHECKING, List, Dict, Any, Callable, Iterable, Optional, Tuple, Union
+import functools
 
+from src.models import NATIONAL_REGION
+from src.cache import CachedCarRepository, RepositoryCache
+from src.database import session_scope
+from src.log_sink import QueryLogSink
 from src.repositories import CarRepository
 
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Colunas que identificam um veículo na avaliação em lote
+BULK_KEY = ("model_id", "year_model", "region")
+
+# CSV de estoque dos lojistas: colunas obrigatórias (regiao é opcional;
+# vazia = média nacional) e linhas lidas por vez
+INVENTORY_COLUMNS = ("marca", "modelo", "ano")
+INVENTORY_CHUNK_ROWS = 5000
+
 class CarService:
-    def __init__(self, db: Session):
-        self.repository = CarRepository(db)
+    def __init__(self, db: Session, log_sink: Optional[QueryLogSink] = None, cache: Optional[RepositoryCache] = None):
+        self.repository = CarRepository(db, log_sink=log_sink)
+        if cache is not None:
+            self.repository = CachedCarRepository(self.repository, cache)
 
     def list_brands(self) -> Dict[str, int]:
         """Retorna um dicionário {Nome: ID} das marcas."""
@@ -23,28 +40,235 @@ class CarService:
         return self.repository.get_years_by_model(model_id)
 
     def list_regions(self) -> List[str]:
-        """Retorna lista de regiões disponíveis."""
-        return [r for r in self.repository.get_available_regions() if r is not None]
+        """Retorna lista de regiões disponíveis (sem a média nacional)."""
+        return [r for r in self.repository.get_available_regions() if r is not None and r != NATIONAL_REGION]
 
-    def get_consolidated_price(self, brand_id: int, model_id: int, year_model: int, region: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    def get_consolidated_price(
+        self,
+        brand_id: int,
+        model_id: int,
+        year_model: int,
+        region: Optional[str] = None,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        last_n_months: Optional[int] = None,
+    ) -> Optional[Dict[str, Any]]:
         """
         Retorna o KPI principal (último preço) e o histórico para gráficos.
+        since/until (YYYYMM) e last_n_months limitam a janela do histórico.
         Registra log automaticamente.
         """
-        history = self.repository.get_price_history(model_id, year_model, region)
+        history = self.repository.get_price_history(
+            model_id, year_model, region,
+            since=since, until=until, last_n_months=last_n_months
+        )
         
         # Log da Tentativa (Com região agora)
         status = "SUCCESS" if history else "NO_RESULT"
         self.repository.create_log(brand_id, model_id, year_model, status, region)
 
+        return self._summarize(history)
+
+    def get_consolidated_prices(
+        self,
+        brand_id: int,
+        model_id: int,
+        year_model: int,
+        regions: List[str],
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        last_n_months: Optional[int] = None,
+    ) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Comparativo entre regiões (ex: a buscada + "Nacional") com uma única
+        consulta e um único log, o da primeira região (a consultada).
+        Retorna {região: resultado} na ordem de `regions`, com os history_df
+        alinhados nos mesmos meses (mês sem dado na região fica sem preço).
+        """
+        histories = self.repository.get_price_histories(
+            model_id, year_model, regions,
+            since=since, until=until, last_n_months=last_n_months
+        )
+
+        status = "SUCCESS" if histories[regions[0]] else "NO_RESULT"
+        self.repository.create_log(brand_id, model_id, year_model, status, regions[0])
+
+        months = sorted({h.month_ref for history in histories.values() for h in history})
+        return {region: self._summarize(histories[region], months) for region in regions}
+
+    def get_price_matrix(
+        self,
+        brand_id: int,
+        model_id: int,
+        year_model: int,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        last_n_months: Optional[int] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Matriz região x mês de um modelo/ano (todas as regiões numa consulta),
+        pivotada com pandas, e o spread de cada região contra a média
+        nacional (%) calculado sobre a mesma matriz. Registra um log sem
+        região (todas).
+        """
+        history = self.repository.get_price_history(
+            model_id, year_model, None,
+            since=since, until=until, last_n_months=last_n_months
+        )
+
+        status = "SUCCESS" if history else "NO_RESULT"
+        self.repository.create_log(brand_id, model_id, year_model, status, None)
+
+        if not history:
+            return None
+
+        import pandas as pd
+
+        df = pd.DataFrame({
+            "Região": [h.region for h in history],
+            "Mês": [h.month_ref for h in history],
+            "Preço Médio": [h.avg_price for h in history],
+            "Amostras": [h.samples_count for h in history],
+        })
+        prices = df.pivot(index="Região", columns="Mês", values="Preço Médio")
+        samples = df.pivot(index="Região", columns="Mês", values="Amostras").fillna(0).astype(int)
+
+        national = prices.loc[NATIONAL_REGION] if NATIONAL_REGION in prices.index else None
+        regional = prices.drop(index=NATIONAL_REGION, errors="ignore")
+        spreads = None
+        if national is not None:
+            # Broadcast da linha nacional sobre todas as regiões de uma vez
+            spreads = (regional - national) / national * 100
+
+        return {
+            "months": list(prices.columns),
+            "prices": regional,
+            "samples": samples.drop(index=NATIONAL_REGION, errors="ignore"),
+            "national": national,
+            "spreads_pct": spreads,
+        }
+
+    def get_bulk_valuation(self, vehicles: Union["pd.DataFrame", Iterable[Tuple[int, int, Optional[str]]]]) -> "pd.DataFrame":
+        """
+        Avaliação em lote (frotas/lojistas). `vehicles` é um DataFrame com
+        model_id, year_model e region ou um iterável de tuplas nessa ordem;
+        região vazia vale a média nacional. Os últimos preços saem de poucas
+        consultas set-based (chaves repetidas são buscadas uma vez) e é
+        registrado um único log BULK com itens pedidos/encontrados.
+
+        Retorna um DataFrame na ordem da entrada com month_ref, avg_price,
+        samples_count e status (SUCCESS / NO_RESULT) de cada veículo.
+        """
+        import numpy as np
+        import pandas as pd
+
+        key = list(BULK_KEY)
+        if isinstance(vehicles, pd.DataFrame):
+            requested = vehicles[key].reset_index(drop=True)
+        else:
+            requested = pd.DataFrame(list(vehicles), columns=key)
+        requested = requested.assign(region=requested["region"].fillna(NATIONAL_REGION)).astype(
+            {"model_id": "int64", "year_model": "int64"}
+        )
+
+        # astype(object): chaves como int/str do Python para o driver do banco
+        unique_keys = list(requested.drop_duplicates().astype(object).itertuples(index=False, name=None))
+        latest = self.repository.get_latest_prices(unique_keys) if unique_keys else []
+
+        found = pd.DataFrame(
+            [(h.model_id, h.year_model, h.region, h.month_ref, h.avg_price, h.samples_count) for h in latest],
+            columns=key + ["month_ref", "avg_price", "samples_count"],
+        ).astype({"model_id": "int64", "year_model": "int64", "avg_price": "float64", "samples_count": "float64"})
+
+        result = requested.merge(found, on=key, how="left")
+        matched = result["avg_price"].notna()
+        result["samples_count"] = result["samples_count"].fillna(0).astype(int)
+        result["status"] = np.where(matched, "SUCCESS", "NO_RESULT")
+
+        self.repository.create_log(
+            None, None, None, "BULK", None,
+            items_requested=len(result), items_matched=int(matched.sum())
+        )
+        return result
+
+    def value_inventory(self, csv_file, chunksize: int = INVENTORY_CHUNK_ROWS) -> "pd.DataFrame":
+        """
+        Avalia o CSV de estoque de um lojista. O arquivo é lido em blocos de
+        `chunksize` linhas; marca/modelo são casados (sem diferenciar
+        maiúsculas) com o catálogo carregado uma vez em memória, e todas as
+        linhas válidas são precificadas juntas por get_bulk_valuation (um
+        único log). Retorna as colunas do CSV + model_id, region, month_ref,
+        avg_price, samples_count e status, que além de SUCCESS/NO_RESULT
+        pode ser UNKNOWN_MODEL ou INVALID_YEAR.
+        """
+        import numpy as np
+        import pandas as pd
+
+        catalog = pd.DataFrame(self.repository.get_catalog(), columns=["brand_id", "brand", "model_id", "model"])
+        catalog_index = pd.DataFrame({
+            "brand_key": catalog["brand"].str.strip().str.casefold(),
+            "model_key": catalog["model"].str.strip().str.casefold(),
+            "model_id": catalog["model_id"],
+        }).drop_duplicates(["brand_key", "model_key"])
+
+        chunks = []
+        for chunk in pd.read_csv(csv_file, chunksize=chunksize, dtype=str, skipinitialspace=True):
+            chunk.columns = chunk.columns.str.strip().str.lower()
+            missing = [c for c in INVENTORY_COLUMNS if c not in chunk.columns]
+            if missing:
+                raise ValueError(f"CSV sem as colunas obrigatórias: {', '.join(missing)}")
+
+            keys = pd.DataFrame({
+                "brand_key": chunk["marca"].str.strip().str.casefold(),
+                "model_key": chunk["modelo"].str.strip().str.casefold(),
+            })
+            chunk["model_id"] = keys.merge(catalog_index, on=["brand_key", "model_key"], how="left")["model_id"].to_numpy()
+            # Ano fracionário (ex: 2022.9) também é INVALID_YEAR
+            year_model = pd.to_numeric(chunk["ano"], errors="coerce")
+            chunk["year_model"] = year_model.where(year_model % 1 == 0).astype("Int64")
+            region = chunk["regiao"] if "regiao" in chunk.columns else pd.Series(None, index=chunk.index, dtype=object)
+            region = region.astype(object).str.strip().str.upper()
+            chunk["region"] = region.mask(region == "NACIONAL", NATIONAL_REGION).mask(region == "", None)
+            chunks.append(chunk)
+
+        if not chunks:
+            raise ValueError("CSV vazio")
+        inventory = pd.concat(chunks, ignore_index=True)
+
+        valid = inventory["model_id"].notna() & inventory["year_model"].notna()
+        # Colunas preenchidas só nas linhas válidas: dtypes explícitos para
+        # que a atribuição abaixo não mude o tipo da coluna
+        inventory["region"] = inventory["region"].astype(object)
+        inventory["status"] = pd.Series(
+            np.where(inventory["model_id"].isna(), "UNKNOWN_MODEL", "INVALID_YEAR"), index=inventory.index, dtype=object
+        )
+        inventory["month_ref"] = pd.Series(None, index=inventory.index, dtype=object)
+        inventory["avg_price"] = pd.Series(np.nan, index=inventory.index, dtype="float64")
+        inventory["samples_count"] = pd.Series(0, index=inventory.index, dtype="int64")
+
+        # Uma avaliação set-based para o arquivo inteiro
+        priced = self.get_bulk_valuation(inventory.loc[valid, list(BULK_KEY)])
+        for column in ("region", "month_ref", "avg_price", "samples_count", "status"):
+            inventory.loc[valid, column] = priced[column].to_numpy()
+
+        inventory["model_id"] = inventory["model_id"].astype("Int64")
+        return inventory.drop(columns=["year_model"])
+
+    def _summarize(self, history, months: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """KPI (último mês) + DataFrame do histórico; `months` alinha o DataFrame."""
         if not history:
             return None
 
-        # Preparar dados para o Front
+        # Preparar dados para o Front (pandas só é carregado quando há gráfico)
+        import pandas as pd
+
         df = pd.DataFrame([
             {"Mês": h.month_ref, "Preço Médio": h.avg_price, "Amostras": h.samples_count}
             for h in history
         ])
+        if months is not None:
+            df = df.set_index("Mês").reindex(months).rename_axis("Mês").reset_index()
+            df["Amostras"] = df["Amostras"].fillna(0).astype(int)
         
         latest = history[-1]
         
@@ -54,4 +278,33 @@ class CarService:
             "current_month": latest.month_ref,
             "samples": latest.samples_count,
             "history_df": df
-        }
\ No newline at end of file
+        }
+
+
+class ScopedCarService:
+    """
+    Fachada de longa duração para o CarService (ex: uma por processo no
+    Streamlit). Cada chamada abre uma sessão só para ela e a devolve ao pool
+    ao terminar, então nenhum rerun segura conexão ociosa.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        log_sink: Optional[QueryLogSink] = None,
+        cache: Optional[RepositoryCache] = None,
+    ):
+        self.session_factory = session_factory
+        self.log_sink = log_sink
+        self.cache = cache
+
+    def __getattr__(self, name: str):
+        method = getattr(CarService, name)
+
+        @functools.wraps(method)
+        def call(*args, **kwargs):
+            with session_scope(self.session_factory) as db:
+                service = CarService(db, log_sink=self.log_sink, cache=self.cache)
+                return getattr(service, name)(*args, **kwargs)
+
+        return call
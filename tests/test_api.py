@@ -0,0 +1,172 @@
+import asyncio
+import gzip
+
+import httpx
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.api import CarFlowAPI
+from src.database import Base
+from src.models import NATIONAL_REGION, Brand, Model as CarModel, MonthlyAverage
+from src.services import ScopedCarService
+
+
+class FakeDataVersion:
+    def __init__(self, version=1):
+        self.version = version
+
+    def current(self):
+        return self.version
+
+
+class FakeService:
+    def __init__(self):
+        self.calls = []
+
+    def list_brands(self):
+        self.calls.append("list_brands")
+        return {"Ford": 2, "Fiat": 1}
+
+    def list_models(self, brand_id):
+        self.calls.append(("list_models", brand_id))
+        return {"Ka": 11}
+
+    def list_years(self, model_id):
+        self.calls.append(("list_years", model_id))
+        return [2024, 2023]
+
+    def list_regions(self):
+        self.calls.append("list_regions")
+        return ["DF", "SP"]
+
+    def get_consolidated_price(self, brand_id, model_id, year_model, region=None, since=None, until=None, last_n_months=None):
+        self.calls.append(("get_consolidated_price", brand_id, model_id, year_model, region, last_n_months))
+        if region == "RJ":
+            return None
+        months = [f"2025-{m:02d}" for m in range(1, 13)]
+        return {
+            "current_price": 1150.0,
+            "current_month": months[-1],
+            "samples": 2,
+            "history_df": pd.DataFrame({
+                "Mês": months,
+                "Preço Médio": [1000.0 + m for m in range(12)],
+                "Amostras": [2] * 12,
+            }),
+        }
+
+
+@pytest.fixture()
+def api():
+    return CarFlowAPI(service=FakeService(), data_version=FakeDataVersion())
+
+
+def _get(app, url, headers=None):
+    async def _request():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get(url, headers=headers or {})
+    return asyncio.run(_request())
+
+
+def test_catalog_routes(api):
+    assert _get(api, "/brands").json() == {"Ford": 2, "Fiat": 1}
+    assert _get(api, "/brands/2/models").json() == {"Ka": 11}
+    assert _get(api, "/models/11/years").json() == [2024, 2023]
+    assert _get(api, "/regions").json() == ["DF", "SP"]
+
+
+def test_prices_route_returns_history(api):
+    response = _get(api, "/prices?brand_id=2&model_id=11&year_model=2024&region=DF&last_n_months=12")
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["current_price"] == 1150.0
+    assert data["history"][0] == {"month_ref": "2025-01", "avg_price": 1000.0, "samples_count": 2}
+    assert api.service.calls[-1] == ("get_consolidated_price", 2, 11, 2024, "DF", 12)
+
+
+def test_errors_are_json(api):
+    assert _get(api, "/prices?brand_id=2&model_id=11").status_code == 400
+    assert _get(api, "/prices?brand_id=x&model_id=11&year_model=2024").json() == {"error": "Parâmetro inválido: brand_id"}
+    assert _get(api, "/prices?brand_id=2&model_id=11&year_model=2024&region=RJ").status_code == 404
+    assert _get(api, "/nada").status_code == 404
+
+
+def test_unchanged_data_version_returns_304_without_service_call(api):
+    first = _get(api, "/brands")
+    etag = first.headers["etag"]
+    assert etag.startswith('"v1-')
+
+    second = _get(api, "/brands", headers={"If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.content == b""
+    assert api.service.calls == ["list_brands"]
+
+    # Outra rota, outro ETag
+    assert _get(api, "/regions").headers["etag"] != etag
+
+    # Batch publicou versão nova: o ETag antigo não vale mais
+    api.data_version.version = 2
+    third = _get(api, "/brands", headers={"If-None-Match": etag})
+    assert third.status_code == 200
+    assert third.headers["etag"].startswith('"v2-')
+
+
+def test_large_responses_are_gzipped(api):
+    url = "/prices?brand_id=2&model_id=11&year_model=2024"
+
+    response = _get(api, url, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.json()["history"]) == 12  # httpx descomprime
+
+    raw = api.handle("GET", "/prices", "brand_id=2&model_id=11&year_model=2024", {"accept-encoding": "gzip"})
+    assert gzip.decompress(raw[2]).startswith(b'{"current_price"')
+
+    small = _get(api, "/regions", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+
+    plain = _get(api, url, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+
+
+def test_only_get_is_allowed(api):
+    status, _, _ = api.handle("POST", "/brands", "", {})
+    assert status == 405
+
+
+def test_prices_without_region_returns_the_national_series():
+    engine = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        future=True,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+    with factory() as db:
+        db.add_all([Brand(id=1, name="Ford"), CarModel(id=11, brand_id=1, name="Ka", vehicle_type="Carro")])
+        for month_ref, prices in [("2026-08", {"DF": 100.0, "SP": 300.0}), ("2026-09", {"DF": 110.0, "SP": 330.0})]:
+            for region, price in prices.items():
+                db.add(MonthlyAverage(brand_id=1, model_id=11, year_model=2024, month_ref=month_ref,
+                                      region=region, avg_price=price, samples_count=1))
+            db.add(MonthlyAverage(brand_id=1, model_id=11, year_model=2024, month_ref=month_ref,
+                                  region=NATIONAL_REGION, avg_price=sum(prices.values()) / 2, samples_count=2))
+        db.commit()
+    api = CarFlowAPI(service=ScopedCarService(factory), data_version=FakeDataVersion())
+
+    data = _get(api, "/prices?brand_id=1&model_id=11&year_model=2024&last_n_months=2").json()
+
+    assert [row["month_ref"] for row in data["history"]] == ["2026-08", "2026-09"]
+    assert (data["current_price"], data["current_month"], data["samples"]) == (220.0, "2026-09", 2)
+
+
+def test_out_of_range_ids_are_rejected(api):
+    huge = str(2**63)
+    assert _get(api, f"/brands/{huge}/models").status_code == 404
+    assert _get(api, f"/models/{huge}/years").status_code == 404
+    assert _get(api, f"/prices?brand_id=1&model_id={huge}&year_model=2024").status_code == 400
+    assert ("list_models", int(huge)) not in api.service.calls
@@ -0,0 +1,208 @@
+import importlib
+from datetime import datetime
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, delete, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import src.archive as archive_mod
+from src.database import Base
+from src.models import ArchivedMonth, Brand, Model as CarModel, MonthlyAverage, PriceCollection
+
+
+@pytest.fixture()
+def Session(monkeypatch):
+    engine = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        future=True,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+    monkeypatch.setattr(archive_mod, "engine", engine)
+    monkeypatch.setattr(importlib.import_module("src.batch_etl"), "SessionLocal", factory)
+    # Sem commits concorrentes aqui: o mês fecha assim que o batch passa por ele
+    monkeypatch.setattr(archive_mod, "ARCHIVE_LAG_IDS", 0)
+
+    with factory() as db:
+        db.add_all([Brand(id=1, name="Ford"), CarModel(id=11, brand_id=1, name="Ka", vehicle_type="Carro")])
+        db.commit()
+    return factory
+
+
+def _collect(Session, rows):
+    with Session() as db:
+        db.add_all([
+            PriceCollection(model_id=11, year_model=2024, region=region, price=price,
+                            collected_at=collected_at, source_id=f"{region}-{price}")
+            for region, price, collected_at in rows
+        ])
+        db.commit()
+
+
+def _averages(Session):
+    with Session() as db:
+        rows = db.execute(select(MonthlyAverage)).scalars().all()
+        return {(r.region, r.month_ref): (round(r.avg_price, 6), r.samples_count) for r in rows}
+
+
+def _hot_months(Session):
+    with Session() as db:
+        return sorted(set(db.execute(select(PriceCollection.month_key)).scalars()))
+
+
+def test_archive_exports_closed_months_and_batch_rebuilds_from_it(Session, tmp_path, capsys):
+    batch_mod = importlib.import_module("src.batch_etl")
+    archive_dir = str(tmp_path / "archive")
+    _collect(Session, [
+        ("DF", 100.0, datetime(2025, 12, 5)),
+        ("DF", 200.0, datetime(2025, 12, 20)),
+        ("SP", 400.0, datetime(2025, 12, 31)),
+        ("SP", 500.0, datetime(2026, 1, 10)),
+        ("DF", 300.0, datetime(2026, 3, 1)),
+    ])
+    batch_mod.run_monthly_batch()
+    consolidated = _averages(Session)
+
+    # Fevereiro chegou depois do batch: ainda não está fechado
+    _collect(Session, [("DF", 250.0, datetime(2026, 2, 3))])
+
+    archived = archive_mod.archive_months(202603, archive_dir)
+
+    assert archived == [(202512, 3), (202601, 1)]
+    assert _hot_months(Session) == [202602, 202603]
+    assert archive_mod.archived_months(archive_dir) == [202512, 202601]
+    assert list((tmp_path / "archive" / "month_key=202512" / "brand_id=1").glob("*.parquet"))
+
+    december = pd.concat(archive_mod.read_archive(archive_dir, [202512]))
+    assert sorted(december["price"]) == [100.0, 200.0, 400.0]
+    assert set(december["source_id"]) == {"DF-100.0", "DF-200.0", "SP-400.0"}
+    assert december["collected_at"].dt.tz is not None
+
+    # Rebuild completo: meses arquivados vêm do Parquet, o resto da tabela quente
+    with Session() as db:
+        db.execute(delete(MonthlyAverage))
+        db.commit()
+    batch_mod.run_monthly_batch(full_refresh=True, archive_dir=archive_dir)
+
+    rebuilt = _averages(Session)
+    assert {k: v for k, v in rebuilt.items() if k[1] != "2026-02"} == consolidated
+    assert rebuilt[("DF", "2026-02")] == (250.0, 1)
+    assert "Reagregando 2 meses a partir do arquivo Parquet" in capsys.readouterr().out
+
+
+def test_late_collection_for_archived_month_is_merged(Session, tmp_path):
+    batch_mod = importlib.import_module("src.batch_etl")
+    archive_dir = str(tmp_path / "archive")
+    _collect(Session, [
+        ("DF", 100.0, datetime(2025, 12, 5)),
+        ("DF", 200.0, datetime(2025, 12, 20)),
+    ])
+    batch_mod.run_monthly_batch()
+    assert archive_mod.archive_months(202601, archive_dir) == [(202512, 2)]
+
+    # Coleta atrasada de dezembro: o incremental soma com o arquivo
+    _collect(Session, [("DF", 600.0, datetime(2025, 12, 28))])
+    batch_mod.run_monthly_batch(archive_dir=archive_dir)
+    assert _averages(Session)[("DF", "2025-12")] == (300.0, 3)
+
+    # Rearquivar o mês regrava o arquivo com as três coletas, sem repetir
+    assert archive_mod.archive_months(202601, archive_dir) == [(202512, 1)]
+    december = pd.concat(archive_mod.read_archive(archive_dir, [202512]))
+    assert sorted(december["price"]) == [100.0, 200.0, 600.0]
+    assert december["id"].is_unique
+    assert _hot_months(Session) == []
+
+
+def test_nothing_is_archived_before_the_first_batch(Session, tmp_path):
+    _collect(Session, [("DF", 100.0, datetime(2025, 12, 5))])
+
+    assert archive_mod.archive_months(202601, str(tmp_path / "archive")) == []
+    assert _hot_months(Session) == [202512]
+
+
+def test_default_batch_run_reads_archived_months_from_the_registry(Session, tmp_path, capsys):
+    batch_mod = importlib.import_module("src.batch_etl")
+    archive_dir = tmp_path / "archive"
+    _collect(Session, [
+        ("DF", 100.0, datetime(2025, 12, 5)),
+        ("DF", 200.0, datetime(2025, 12, 20)),
+    ])
+    batch_mod.run_monthly_batch()
+    archive_mod.archive_months(202601, str(archive_dir))
+    with Session() as db:
+        assert db.get(ArchivedMonth, 202512).archive_dir == str(archive_dir)
+
+    # Invocação padrão (sem --archive-dir): o mês não é recalculado só com a coleta atrasada
+    _collect(Session, [("DF", 600.0, datetime(2025, 12, 28))])
+    batch_mod.run_monthly_batch()
+    assert _averages(Session)[("DF", "2025-12")] == (300.0, 3)
+
+    # Arquivo fora do lugar: médias mantidas, com aviso
+    archive_dir.rename(tmp_path / "moved")
+    _collect(Session, [("DF", 900.0, datetime(2025, 12, 29))])
+    batch_mod.run_monthly_batch()
+    assert _averages(Session)[("DF", "2025-12")] == (300.0, 3)
+    assert "arquivo Parquet inacessível para 2025-12" in capsys.readouterr().out
+
+
+def test_resent_collection_for_archived_month_is_a_duplicate(Session, tmp_path, monkeypatch):
+    batch_mod = importlib.import_module("src.batch_etl")
+    ingest_mod = importlib.import_module("src.ingest")
+    monkeypatch.setattr(ingest_mod, "engine", archive_mod.engine)
+    path = tmp_path / "coletas.csv"
+    path.write_text(
+        "model_id,year_model,price,region,collected_at,source_id\n"
+        "11,2024,95000,DF,2025-12-05,a1\n"
+        "11,2024,97000,DF,2025-12-20,a2\n"
+    )
+    ingest_mod.ingest_files([str(path)], str(tmp_path / "q.csv"))
+    batch_mod.run_monthly_batch()
+    archive_mod.archive_months(202601, str(tmp_path / "archive"))
+
+    # Sem a partição do mês o índice único não vê o arquivo: a deduplicação usa o Parquet
+    again = ingest_mod.ingest_files([str(path)], str(tmp_path / "q.csv"))
+
+    assert (again["loaded"], again["duplicates"]) == (0, 2)
+    assert _hot_months(Session) == []
+
+
+def test_month_written_before_the_lock_is_not_archived(Session, tmp_path, monkeypatch, capsys):
+    batch_mod = importlib.import_module("src.batch_etl")
+    _collect(Session, [
+        ("DF", 100.0, datetime(2025, 12, 5)),
+        ("SP", 500.0, datetime(2026, 1, 10)),
+    ])
+    batch_mod.run_monthly_batch()
+
+    # Coleta de dezembro commitada entre closed_months e o lock do mês
+    def lock_after_late_write(connection, month_key):
+        if month_key == 202512:
+            connection.execute(PriceCollection.__table__.insert().values(
+                model_id=11, year_model=2024, region="DF", price=600.0,
+                collected_at=datetime(2025, 12, 28), month_key=202512,
+            ))
+
+    monkeypatch.setattr(archive_mod, "_lock_month", lock_after_late_write)
+
+    assert archive_mod.archive_months(202602, str(tmp_path / "archive")) == [(202601, 1)]
+    assert _hot_months(Session) == [202512]
+    assert archive_mod.archived_months(str(tmp_path / "archive")) == [202601]
+    assert "2025-12: coletas novas desde a última consolidação" in capsys.readouterr().out
+
+
+def test_lag_window_is_configurable_and_reported(Session, tmp_path, capsys):
+    batch_mod = importlib.import_module("src.batch_etl")
+    _collect(Session, [("DF", 100.0, datetime(2025, 12, 5)), ("DF", 200.0, datetime(2026, 1, 5))])
+    batch_mod.run_monthly_batch()
+
+    # Marca d'água 2: uma janela maior que o banco inteiro não fecha mês nenhum, e avisa
+    assert archive_mod.archive_months(202602, str(tmp_path / "archive"), lag_ids=5) == []
+    assert "Nenhum mês fechado" in capsys.readouterr().out
+
+    # Janela de 1 id: dezembro (id 1) fecha, janeiro (id 2) ainda não
+    assert archive_mod.archive_months(202602, str(tmp_path / "archive"), lag_ids=1) == [(202512, 1)]
+    assert _hot_months(Session) == [202601]
@@ -1,46 +1,49 @@
 import importlib
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from unittest.mock import MagicMock
 
+from sqlalchemy import create_engine, delete, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.sql.dml import Insert
+
+from src.database import Base
+from src.models import BatchState, Brand, Model as CarModel, MonthlyAverage, PriceCollection
+
 BATCH_MODULE_PATH = "src.batch_etl"  
 
 
-@dataclass
-class DummyMonthlyAverage:
-    brand_id: int
-    model_id: int
-    year_model: int
-    month_ref: str
-    region: str
-    avg_price: float
-    samples_count: int
+def batch_state(last_collection_id):
+    batch_mod = importlib.import_module(BATCH_MODULE_PATH)
+    return batch_mod.BatchState(name=batch_mod.BATCH_NAME, last_collection_id=last_collection_id)
 
 
-def _make_db_mock(results_rows, existing_first_return=None, execute_raises=None):
+def _make_db_mock(results_rows, execute_raises=None, watermark=None, max_id=1, chunk_size=500, months=None):
     """
     Cria um mock de sessão do SQLAlchemy com o comportamento esperado pelo seu batch:
-      - db.execute(stmt).all() -> results_rows
-      - db.query(...).filter_by(...).first() -> existing_first_return
+      - db.get(BatchState, ...) -> watermark (None = primeira execução)
+      - db.execute(stmt).scalar() -> max_id (maior price_collections.id)
+      - db.execute(stmt).partitions(...) -> results_rows em lotes de chunk_size
+      - db.execute(stmt).scalars().all() -> months (partições do modo paralelo)
+      - db.get_bind().dialect.name -> "postgresql"
     """
     db = MagicMock(name="db_session_mock")
+    db.get.return_value = watermark
+    db.get_bind.return_value.dialect.name = "postgresql"
 
     if execute_raises is not None:
         db.execute.side_effect = execute_raises
     else:
         result_proxy = MagicMock(name="result_proxy")
-        result_proxy.all.return_value = results_rows
+        result_proxy.partitions.return_value = [
+            results_rows[i:i + chunk_size] for i in range(0, len(results_rows), chunk_size)
+        ]
+        result_proxy.scalar.return_value = max_id
+        result_proxy.scalars.return_value.all.return_value = months or []
         db.execute.return_value = result_proxy
 
-    # OTIMIZAÇÃO BATCH: Agora o código carrega db.query(...).all() em vez de filter_by
-    # Precisamos ajustar o mock para retornar uma lista com o item existente
-    # quando db.query(MonthlyAverage).all() for chamado.
-    q = db.query.return_value
-    q.all.return_value = [existing_first_return] if existing_first_return else []
-    
-    # O mock antigo filter_by não é mais usado, mas mantemos por segurança
-    f = q.filter_by.return_value
-    f.first.return_value = existing_first_return
-
     return db
 
 
@@ -49,69 +52,94 @@ def _patch_module(monkeypatch, db_mock):
 
     monkeypatch.setattr(batch_mod, "SessionLocal", lambda: db_mock)
 
-    monkeypatch.setattr(batch_mod, "MonthlyAverage", DummyMonthlyAverage)
-
     return batch_mod
 
 
-def test_run_monthly_batch_inserts_new_rows(monkeypatch, capsys):
+def _upsert_statements(db):
+    return [c.args[0] for c in db.execute.call_args_list if isinstance(c.args[0], Insert)]
+
+
+def test_run_monthly_batch_upserts_results_set_based(monkeypatch, capsys):
     results = [
-        (10, 20, 2022, "DF", "2026-01", 12345.67, 3),
+        (10, 20, 2022, "DF", 202601, 12345.67, 3),
     ]
 
-    db = _make_db_mock(results_rows=results, existing_first_return=None)
+    db = _make_db_mock(results_rows=results)
     batch_mod = _patch_module(monkeypatch, db)
 
     batch_mod.run_monthly_batch()
 
-    assert db.add.call_count == 1
-    added_obj = db.add.call_args[0][0]
-    assert isinstance(added_obj, DummyMonthlyAverage)
-
-    assert added_obj.brand_id == 10
-    assert added_obj.model_id == 20
-    assert added_obj.year_model == 2022
-    assert added_obj.region == "DF"
-    assert added_obj.month_ref == "2026-01"
-    assert added_obj.avg_price == 12345.67
-    assert added_obj.samples_count == 3
+    # Nada de ORM linha a linha: um único INSERT ... ON CONFLICT DO UPDATE
+    db.add.assert_not_called()
+    db.query.assert_not_called()
+
+    upserts = _upsert_statements(db)
+    assert len(upserts) == 1
+
+    compiled = upserts[0].compile(dialect=postgresql.dialect())
+    sql = str(compiled)
+    assert "ON CONFLICT (model_id, year_model, region, month_key) DO UPDATE" in sql
+    assert compiled.params["brand_id_m0"] == 10
+    assert compiled.params["model_id_m0"] == 20
+    assert compiled.params["year_model_m0"] == 2022
+    assert compiled.params["region_m0"] == "DF"
+    assert compiled.params["month_key_m0"] == 202601
+    assert compiled.params["month_ref_m0"] == "2026-01"
+    assert compiled.params["avg_price_m0"] == 12345.67
+    assert compiled.params["samples_count_m0"] == 3
 
     db.commit.assert_called_once()
     db.close.assert_called_once()
     db.rollback.assert_not_called()
 
     out = capsys.readouterr().out
+    assert "Calculadas 1 métricas consolidadas" in out
     assert "Batch Mensal finalizado com sucesso" in out
 
 
-def test_run_monthly_batch_updates_existing_row(monkeypatch):
+def test_run_monthly_batch_upserts_in_chunks(monkeypatch):
     results = [
-        (10, 20, 2022, "DF", "2026-01", 999.0, 7),
+        (10, 20, 2022, "DF", 202600 + m, 100.0 + m, 1)
+        for m in range(1, 13)
     ]
 
-    existing = DummyMonthlyAverage(
-        brand_id=10,
-        model_id=20,
-        year_model=2022,
-        month_ref="2026-01",
-        region="DF",
-        avg_price=111.0,
-        samples_count=1,
-    )
-
-    db = _make_db_mock(results_rows=results, existing_first_return=existing)
+    db = _make_db_mock(results_rows=results, chunk_size=5)
     batch_mod = _patch_module(monkeypatch, db)
 
     batch_mod.run_monthly_batch()
 
-    db.add.assert_not_called()
+    # 12 linhas em lotes de 5 -> 3 round trips de escrita
+    assert len(_upsert_statements(db)) == 3
+    db.commit.assert_called_once()
 
-    assert existing.avg_price == 999.0
-    assert existing.samples_count == 7
 
-    db.commit.assert_called_once()
-    db.close.assert_called_once()
-    db.rollback.assert_not_called()
+def test_upsert_monthly_averages_inserts_then_updates_on_sqlite():
+    engine = create_engine("sqlite+pysqlite:///:memory:", future=True)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+    batch_mod = importlib.import_module(BATCH_MODULE_PATH)
+
+    row = {
+        "brand_id": 10,
+        "model_id": 20,
+        "year_model": 2022,
+        "region": "DF",
+        "month_key": 202601,
+        "month_ref": "2026-01",
+        "avg_price": 111.0,
+        "samples_count": 1,
+    }
+
+    with Session() as db:
+        batch_mod._upsert_monthly_averages(db, [row])
+        batch_mod._upsert_monthly_averages(db, [{**row, "avg_price": 999.0, "samples_count": 7}])
+        db.commit()
+
+        saved = db.execute(select(MonthlyAverage)).scalars().all()
+
+    assert len(saved) == 1
+    assert saved[0].avg_price == 999.0
+    assert saved[0].samples_count == 7
 
 
 def test_run_monthly_batch_on_error_rollbacks_and_closes(monkeypatch, capsys):
@@ -130,3 +158,307 @@ def test_run_monthly_batch_on_error_rollbacks_and_closes(monkeypatch, capsys):
 
     out = capsys.readouterr().out
     assert "Erro no Batch" in out
+
+
+def _executed_sql(db):
+    return [str(c.args[0]) for c in db.execute.call_args_list]
+
+
+def _aggregation_sql(db):
+    return [sql for sql in _executed_sql(db) if "GROUP BY" in sql][-1]
+
+
+def test_run_monthly_batch_saves_watermark(monkeypatch):
+    results = [
+        (10, 20, 2022, "DF", 202601, 12345.67, 3),
+    ]
+
+    db = _make_db_mock(results_rows=results, max_id=42)
+    batch_mod = _patch_module(monkeypatch, db)
+
+    batch_mod.run_monthly_batch()
+
+    state = db.merge.call_args[0][0]
+    assert state.name == batch_mod.BATCH_NAME
+    assert state.last_collection_id == 42
+    assert state.data_version == 1
+    db.commit.assert_called_once()
+
+
+def test_run_monthly_batch_notifies_new_data_version_on_postgres(monkeypatch):
+    watermark = batch_state(last_collection_id=30)
+    watermark.data_version = 4
+    db = _make_db_mock(results_rows=[], watermark=watermark, max_id=42)
+    batch_mod = _patch_module(monkeypatch, db)
+
+    batch_mod.run_monthly_batch()
+
+    notify = [c.args[0] for c in db.execute.call_args_list if "pg_notify" in str(c.args[0])]
+    assert len(notify) == 1
+    params = notify[0].compile(dialect=postgresql.dialect()).params
+    assert sorted(params.values()) == ["5", batch_mod.DATA_VERSION_CHANNEL]
+    # NOTIFY só é entregue no commit: tem que ser enviado antes dele
+    calls = [name for name, args, _ in db.method_calls if name == "commit" or (
+        name == "execute" and "pg_notify" in str(args[0])
+    )]
+    assert calls == ["execute", "commit"]
+
+
+def test_run_monthly_batch_incremental_filters_touched_groups(monkeypatch, capsys):
+    watermark = batch_state(last_collection_id=30)
+    db = _make_db_mock(results_rows=[], watermark=watermark, max_id=42, months=[202601, 202602])
+    batch_mod = _patch_module(monkeypatch, db)
+    monkeypatch.setattr(batch_mod, "WATERMARK_LAG_IDS", 10)
+
+    batch_mod.run_monthly_batch()
+
+    aggregation = [s for s in (c.args[0] for c in db.execute.call_args_list) if "GROUP BY" in str(s)][-1]
+    aggregation_sql = str(aggregation)
+    assert "IN (SELECT DISTINCT" in aggregation_sql
+    assert "price_collections.id >" in aggregation_sql
+    # Meses tocados em literais: o Postgres poda as partições no planejamento
+    assert "price_collections.month_key IN" in aggregation_sql
+    compiled = aggregation.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    assert "price_collections.month_key IN (202601, 202602)" in str(compiled)
+    # Relê a janela de WATERMARK_LAG_IDS abaixo da marca d'água
+    assert "price_collections.id > 20" in str(compiled)
+
+    out = capsys.readouterr().out
+    assert "Modo incremental" in out
+    assert db.merge.call_args[0][0].last_collection_id == 42
+
+
+def test_run_monthly_batch_full_refresh_ignores_watermark(monkeypatch, capsys):
+    watermark = batch_state(last_collection_id=30)
+    db = _make_db_mock(results_rows=[], watermark=watermark, max_id=42)
+    batch_mod = _patch_module(monkeypatch, db)
+
+    batch_mod.run_monthly_batch(full_refresh=True)
+
+    aggregation_sql = _aggregation_sql(db)
+    assert "IN (SELECT DISTINCT" not in aggregation_sql
+
+    out = capsys.readouterr().out
+    assert "Modo completo" in out
+
+
+def test_run_monthly_batch_without_new_collections_is_noop(monkeypatch, capsys):
+    watermark = batch_state(last_collection_id=42)
+    db = _make_db_mock(results_rows=[], watermark=watermark, max_id=42)
+    batch_mod = _patch_module(monkeypatch, db)
+
+    batch_mod.run_monthly_batch()
+
+    db.commit.assert_not_called()
+    db.merge.assert_not_called()
+    db.close.assert_called_once()
+
+    out = capsys.readouterr().out
+    assert "Nenhuma coleta nova" in out
+
+
+def test_run_monthly_batch_parallel_runs_one_partition_per_month(monkeypatch, capsys):
+    results = [
+        (10, 20, 2022, "DF", 202601, 12345.67, 3),
+    ]
+
+    db = _make_db_mock(results_rows=results, max_id=42, months=[202601, 202602, 202603])
+    batch_mod = _patch_module(monkeypatch, db)
+    # Threads no lugar de processos: mesmo fluxo, mas com o mock compartilhado
+    monkeypatch.setattr(batch_mod, "ProcessPoolExecutor", ThreadPoolExecutor)
+
+    batch_mod.run_monthly_batch(workers=2)
+
+    # Um upsert por partição e um commit por partição + o commit da marca d'água
+    assert len(_upsert_statements(db)) == 3
+    assert db.commit.call_count == 4
+    assert db.merge.call_args[0][0].last_collection_id == 42
+
+    partition_sql = [sql for sql in _executed_sql(db) if "GROUP BY" in sql]
+    assert len(partition_sql) == 3
+    assert all("price_collections.month_key = :month_key_" in sql for sql in partition_sql)
+
+    out = capsys.readouterr().out
+    assert "Modo paralelo: 3 partições em 2 workers" in out
+    assert "Partição 2026-02: 1 métricas em" in out
+    assert "Calculadas 3 métricas consolidadas" in out
+
+
+def test_run_monthly_batch_parallel_partition_error_keeps_watermark(monkeypatch, capsys):
+    db = _make_db_mock(results_rows=[], max_id=42, months=[202601])
+    batch_mod = _patch_module(monkeypatch, db)
+    monkeypatch.setattr(batch_mod, "ProcessPoolExecutor", ThreadPoolExecutor)
+
+    def broken_consolidate(*args, **kwargs):
+        raise RuntimeError("partição explodiu")
+
+    monkeypatch.setattr(batch_mod, "_consolidate", broken_consolidate)
+
+    batch_mod.run_monthly_batch(workers=2)
+
+    db.merge.assert_not_called()
+    db.commit.assert_not_called()
+
+    out = capsys.readouterr().out
+    assert "Erro no Batch: partição explodiu" in out
+
+
+def test_run_monthly_batch_postgres_rolls_up_national_with_grouping_sets(monkeypatch):
+    db = _make_db_mock(results_rows=[])
+    batch_mod = _patch_module(monkeypatch, db)
+
+    batch_mod.run_monthly_batch()
+
+    aggregation_sql = _aggregation_sql(db)
+    assert "GROUPING SETS" in aggregation_sql
+    assert "grouping(price_collections.region)" in aggregation_sql
+
+
+def test_national_rollup_fallback_weights_by_samples_across_chunks():
+    batch_mod = importlib.import_module(BATCH_MODULE_PATH)
+
+    # Ordenado por (modelo, ano, mês); o grupo 2026-01 atravessa os dois lotes
+    chunks = [
+        [
+            (10, 20, 2022, "DF", 202601, 100.0, 1),
+            (10, 20, 2022, "SP", 202601, 200.0, 3),
+        ],
+        [
+            (10, 20, 2022, "RJ", 202601, 400.0, 4),
+            (10, 20, 2022, "DF", 202602, 150.0, 2),
+        ],
+    ]
+
+    batches = list(batch_mod._with_national_rollup(batch_mod._as_rows(c) for c in chunks))
+    rows = [row for batch in batches for row in batch]
+
+    national = {r["month_ref"]: r for r in rows if r["region"] == "Nacional"}
+    assert set(national) == {"2026-01", "2026-02"}
+
+    # (100*1 + 200*3 + 400*4) / 8
+    assert national["2026-01"]["avg_price"] == 287.5
+    assert national["2026-01"]["samples_count"] == 8
+    assert national["2026-02"]["avg_price"] == 150.0
+    assert national["2026-02"]["samples_count"] == 2
+
+    # Regionais passam intactas e os valores chegam como tipos Python
+    assert len([r for r in rows if r["region"] != "Nacional"]) == 4
+    assert isinstance(national["2026-01"]["samples_count"], int)
+
+
+# --- Integração com SQLite (a agregação por month_key é portável) ---
+
+def _sqlite_session_factory():
+    engine = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        future=True,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+
+
+def _seed_collections(Session, rows):
+    with Session() as db:
+        if db.get(Brand, 1) is None:
+            db.add(Brand(id=1, name="Ford"))
+            db.add(CarModel(id=11, brand_id=1, name="Ka", vehicle_type="Carro"))
+        db.add_all([
+            PriceCollection(model_id=11, year_model=2024, region=region, price=price, collected_at=collected_at)
+            for region, price, collected_at in rows
+        ])
+        db.commit()
+
+
+def _averages(Session):
+    with Session() as db:
+        rows = db.execute(select(MonthlyAverage)).scalars().all()
+        return {(r.region, r.month_ref): (r.avg_price, r.samples_count) for r in rows}
+
+
+def test_run_monthly_batch_end_to_end_on_sqlite(monkeypatch):
+    Session = _sqlite_session_factory()
+    batch_mod = importlib.import_module(BATCH_MODULE_PATH)
+    monkeypatch.setattr(batch_mod, "SessionLocal", Session)
+
+    _seed_collections(Session, [
+        ("DF", 100.0, datetime(2026, 1, 5)),
+        ("DF", 200.0, datetime(2026, 1, 20)),
+        ("SP", 400.0, datetime(2026, 1, 31)),
+        ("SP", 500.0, datetime(2026, 2, 1)),
+    ])
+
+    batch_mod.run_monthly_batch()
+
+    assert _averages(Session) == {
+        ("DF", "2026-01"): (150.0, 2),
+        ("SP", "2026-01"): (400.0, 1),
+        ("Nacional", "2026-01"): (700.0 / 3, 3),
+        ("SP", "2026-02"): (500.0, 1),
+        ("Nacional", "2026-02"): (500.0, 1),
+    }
+
+    # Incremental: nova coleta em DF/2026-01 refaz o regional e o nacional do mês
+    _seed_collections(Session, [("DF", 300.0, datetime(2026, 1, 25))])
+    batch_mod.run_monthly_batch()
+
+    averages = _averages(Session)
+    assert averages[("DF", "2026-01")] == (200.0, 3)
+    assert averages[("Nacional", "2026-01")] == (250.0, 4)
+    assert averages[("SP", "2026-02")] == (500.0, 1)
+
+    with Session() as db:
+        state = db.get(BatchState, batch_mod.BATCH_NAME)
+        assert state.last_collection_id == 5
+        # Cada batch commitado publica uma nova versão dos dados
+        assert state.data_version == 2
+
+
+def test_run_monthly_batch_rescans_collections_committed_out_of_id_order(monkeypatch):
+    Session = _sqlite_session_factory()
+    batch_mod = importlib.import_module(BATCH_MODULE_PATH)
+    monkeypatch.setattr(batch_mod, "SessionLocal", Session)
+    monkeypatch.setattr(batch_mod, "WATERMARK_LAG_IDS", 2)
+
+    _seed_collections(Session, [("DF", 100.0, datetime(2026, 1, 5))] * 4)
+    with Session() as db:
+        # Simula uma transação que pegou o id 3 e ainda não commitou
+        db.execute(delete(PriceCollection).where(PriceCollection.id == 3))
+        db.commit()
+    batch_mod.run_monthly_batch()
+    assert _averages(Session)[("DF", "2026-01")] == (100.0, 3)
+
+    # O commit atrasado (id 3 < marca d'água 4) entra no próximo incremental
+    with Session() as db:
+        db.add(PriceCollection(id=3, model_id=11, year_model=2024, region="DF", price=500.0,
+                               collected_at=datetime(2026, 1, 6)))
+        db.commit()
+    _seed_collections(Session, [("SP", 300.0, datetime(2026, 2, 1))])
+    batch_mod.run_monthly_batch()
+
+    averages = _averages(Session)
+    assert averages[("DF", "2026-01")] == (200.0, 4)
+    assert averages[("SP", "2026-02")] == (300.0, 1)
+
+
+def test_run_monthly_batch_workers_fall_back_to_serial_on_sqlite(monkeypatch, capsys):
+    Session = _sqlite_session_factory()
+    batch_mod = importlib.import_module(BATCH_MODULE_PATH)
+    monkeypatch.setattr(batch_mod, "SessionLocal", Session)
+
+    def no_pool(*args, **kwargs):
+        raise AssertionError("SQLite não deve abrir processos")
+
+    monkeypatch.setattr(batch_mod, "ProcessPoolExecutor", no_pool)
+    _seed_collections(Session, [
+        ("DF", 100.0, datetime(2026, 1, 5)),
+        ("SP", 300.0, datetime(2026, 2, 1)),
+    ])
+
+    batch_mod.run_monthly_batch(workers=4)
+
+    out = capsys.readouterr().out
+    assert "Aviso: --workers 4 requer Postgres; rodando em série" in out
+    assert "Erro no Batch" not in out
+    assert _averages(Session)[("SP", "2026-02")] == (300.0, 1)
@@ -0,0 +1,32 @@
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import create_engine, func, select
+
+import src.bulk_load as bulk_load
+from src.database import Base
+from src.models import PriceCollection
+
+
+def test_copy_dataframe_inserts_rows_in_chunks(monkeypatch):
+    engine = create_engine("sqlite+pysqlite:///:memory:", future=True)
+    Base.metadata.create_all(engine)
+    monkeypatch.setattr(bulk_load, "EXECUTEMANY_CHUNK_ROWS", 2)
+
+    frame = pd.DataFrame({
+        "model_id": [1, 1, 2],
+        "year_model": [2024, 2024, 2025],
+        "price": [100.0, 110.0, 200.0],
+        "region": ["DF", "SP", "DF"],
+        "collected_at": pd.to_datetime([datetime(2026, 1, 10)] * 3),
+        "month_key": [202601] * 3,
+    })
+
+    with engine.connect() as conn:
+        assert bulk_load.copy_dataframe(conn, PriceCollection.__table__, frame) == 3
+        assert bulk_load.copy_dataframe(conn, PriceCollection.__table__, frame.iloc[:0]) == 0
+        conn.commit()
+
+    with engine.connect() as conn:
+        rows = conn.execute(select(func.count(), func.sum(PriceCollection.price))).one()
+    assert tuple(rows) == (3, 410.0)
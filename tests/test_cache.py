@@ -0,0 +1,250 @@
+import os
+import time
+
+import pytest
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.cache import (
+    DATA_VERSION_CHANNEL,
+    CachedCarRepository,
+    DataVersion,
+    DataVersionListener,
+    RepositoryCache,
+    TTLCache,
+)
+from src.database import Base
+from src.models import BatchState, Brand, Model as CarModel, MonthlyAverage, QueryLog
+from src.repositories import CarRepository
+
+
+@pytest.fixture()
+def engine():
+    eng = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        future=True,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(eng)
+    return eng
+
+
+@pytest.fixture()
+def session_factory(engine):
+    Session = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+    with Session() as db:
+        db.add_all([
+            Brand(id=20, name="Ford"),
+            CarModel(id=200, brand_id=20, name="Ka", vehicle_type="Carro"),
+            MonthlyAverage(brand_id=20, model_id=200, year_model=2022, region="DF",
+                           month_ref="2026-01", avg_price=1000.0, samples_count=3),
+            BatchState(name="monthly_averages", last_collection_id=10, data_version=1),
+        ])
+        db.commit()
+    return Session
+
+
+@pytest.fixture()
+def select_counter(engine):
+    counter = {"selects": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            counter["selects"] += 1
+
+    return counter
+
+
+def _publish_version(session_factory, version):
+    with session_factory() as db:
+        db.get(BatchState, "monthly_averages").data_version = version
+        db.commit()
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == (True, 1)  # "a" passa a ser o mais recente
+
+    cache.set("c", 3)
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, 1)
+    assert cache.get("c") == (True, 3)
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=10, ttl=0.01)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") == (False, None)
+    assert len(cache) == 0
+
+
+def test_data_version_reads_database_at_most_once_per_interval(session_factory, select_counter):
+    version = DataVersion(session_factory, check_interval=60)
+
+    assert version.current() == 1
+    assert version.current() == 1
+    assert select_counter["selects"] == 1
+
+    version.set(7)
+    assert version.current() == 7
+    assert select_counter["selects"] == 1
+
+    version.invalidate()
+    assert version.current() == 1
+    assert select_counter["selects"] == 2
+
+
+def test_cached_repository_hits_skip_database(session_factory, select_counter):
+    cache = RepositoryCache(DataVersion(session_factory, check_interval=60))
+
+    with session_factory() as db:
+        repo = CachedCarRepository(CarRepository(db), cache)
+        assert [b.name for b in repo.get_brands()] == ["Ford"]
+        assert [m.name for m in repo.get_models_by_brand(20)] == ["Ka"]
+        assert repo.get_years_by_model(200) == [2022]
+        assert repo.get_available_regions() == ["DF"]
+        assert [h.avg_price for h in repo.get_price_history(200, 2022, "DF")] == [1000.0]
+        assert repo.get_price_histories(200, 2022, ["DF", "Nacional"])["Nacional"] == []
+
+    selects_after_warmup = select_counter["selects"]
+
+    # Nova sessão (novo rerun): tudo vem do cache, sem round trip
+    with session_factory() as db:
+        repo = CachedCarRepository(CarRepository(db), cache)
+        assert [b.name for b in repo.get_brands()] == ["Ford"]
+        assert [m.name for m in repo.get_models_by_brand(20)] == ["Ka"]
+        assert repo.get_years_by_model(200) == [2022]
+        assert repo.get_available_regions() == ["DF"]
+        history = repo.get_price_history(200, 2022, "DF")
+        assert [h.avg_price for h in repo.get_price_histories(200, 2022, ["DF", "Nacional"])["DF"]] == [1000.0]
+
+    assert select_counter["selects"] == selects_after_warmup
+    # Os valores em cache continuam legíveis com a sessão fechada
+    assert (history[0].month_ref, history[0].samples_count) == ("2026-01", 3)
+
+
+def test_new_data_version_invalidates_cached_entries(session_factory):
+    version = DataVersion(session_factory, check_interval=60)
+    cache = RepositoryCache(version)
+
+    with session_factory() as db:
+        repo = CachedCarRepository(CarRepository(db), cache)
+        assert [h.avg_price for h in repo.get_price_history(200, 2022, "DF")] == [1000.0]
+
+        # O batch reprocessa e publica a versão 2
+        db.execute(MonthlyAverage.__table__.update().values(avg_price=1200.0))
+        db.commit()
+        _publish_version(session_factory, 2)
+
+        # Antes da releitura da versão o valor antigo ainda é servido
+        assert [h.avg_price for h in repo.get_price_history(200, 2022, "DF")] == [1000.0]
+
+        version.invalidate()
+        assert [h.avg_price for h in repo.get_price_history(200, 2022, "DF")] == [1200.0]
+        assert len(cache.entries) == 1
+
+
+def test_cached_repository_delegates_writes(session_factory):
+    cache = RepositoryCache(DataVersion(session_factory))
+
+    with session_factory() as db:
+        repo = CachedCarRepository(CarRepository(db), cache)
+        repo.create_log(brand_id=20, model_id=200, year_model=2022, status="SUCCESS", region="DF")
+
+        assert len(db.execute(select(QueryLog)).scalars().all()) == 1
+
+
+def test_listener_notification_sets_version_without_database(session_factory, select_counter):
+    version = DataVersion(session_factory, check_interval=60)
+    cache = RepositoryCache(version)
+    cache.entries.set("stale", 1)
+    listener = DataVersionListener(cache, engine=None)
+
+    listener.handle("8")
+
+    assert len(cache.entries) == 0
+    assert version.current() == 8
+    assert select_counter["selects"] == 0
+
+    # Payload inesperado: volta a ler a versão do banco
+    listener.handle("???")
+    assert version.current() == 1
+    assert listener.received == 2
+
+
+def _wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_listener_receives_postgres_notify():
+    url = os.getenv("TEST_DATABASE_URL", "")
+    if not url.startswith(("postgresql://", "postgres://")):
+        pytest.skip("TEST_DATABASE_URL (Postgres) não configurada")
+
+    engine = create_engine(url.replace("postgres://", "postgresql://", 1), future=True)
+    version = DataVersion(sessionmaker(bind=engine, future=True), check_interval=60)
+    version.set(1)
+    cache = RepositoryCache(version)
+    listener = DataVersionListener(cache, engine, poll_timeout=0.1).start()
+    try:
+        # Espera o LISTEN (a conexão inicial já conta como uma releitura)
+        time.sleep(0.5)
+        with engine.begin() as conn:
+            conn.execute(select(func.pg_notify(DATA_VERSION_CHANNEL, "42")))
+
+        assert _wait_until(lambda: listener.received == 1)
+        assert version.current() == 42
+    finally:
+        listener.stop()
+        engine.dispose()
+
+
+def test_listening_data_version_does_not_poll_on_the_request_path(session_factory, select_counter):
+    version = DataVersion(session_factory, check_interval=0)
+    cache = RepositoryCache(version)
+    listener = DataVersionListener(cache, engine=None)
+
+    assert version.current() == 1
+    version.set_listening(True)
+    for _ in range(5):
+        assert version.current() == 1
+    assert select_counter["selects"] == 1
+
+    listener.handle("2")
+    assert version.current() == 2
+    assert select_counter["selects"] == 1
+
+    # Listener caiu: volta ao polling
+    version.set_listening(False)
+    version.current()
+    assert select_counter["selects"] == 2
+
+
+def test_untrusted_payload_is_reread_until_the_replica_catches_up(session_factory, select_counter):
+    version = DataVersion(session_factory, check_interval=0)
+    version.set_listening(True)
+    cache = RepositoryCache(version)
+    listener = DataVersionListener(cache, engine=None, use_payload=False)
+
+    # Réplica ainda na versão 1: segue relendo até a 2 aparecer
+    listener.handle("2")
+    assert version.current() == 1
+    assert version.current() == 1
+    _publish_version(session_factory, 2)
+    assert version.current() == 2
+    selects = select_counter["selects"]
+
+    # Alcançou a versão anunciada: sem polling de novo
+    assert version.current() == 2
+    assert select_counter["selects"] == selects
@@ -1,8 +1,13 @@
 import importlib
+import logging
+import sqlite3
 import sys
+import threading
+import time
 
 import sqlalchemy
 import sqlalchemy.orm
+from sqlalchemy.engine import create_engine as real_create_engine
 
 
 def _import_fresh_database_module(monkeypatch, database_url=None):
@@ -124,3 +129,179 @@ def test_get_db_yields_session_and_closes(monkeypatch):
     # Ao fechar o generator, executa o finally e fecha a sessão
     gen.close()
     assert db.closed is True
+
+
+def test_pool_size_and_overflow_come_from_env(monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "20")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "5")
+    monkeypatch.setenv("DB_POOL_TIMEOUT", "2.5")
+    module, calls, _ = _import_fresh_database_module(monkeypatch, None)
+
+    kwargs = calls["create_engine"]["kwargs"]
+    assert kwargs["poolclass"] is module.TimedQueuePool
+    assert kwargs["pool_size"] == 20
+    assert kwargs["max_overflow"] == 5
+    assert kwargs["pool_timeout"] == 2.5
+
+
+def test_sqlite_keeps_default_pool(monkeypatch):
+    _, calls, _ = _import_fresh_database_module(monkeypatch, "sqlite:///carflow.db")
+
+    assert calls["create_engine"]["kwargs"] == {}
+
+
+def test_session_scope_rolls_back_and_closes_on_error(monkeypatch):
+    module, _, _ = _import_fresh_database_module(monkeypatch, None)
+
+    class Session:
+        rolled_back = closed = False
+
+        def rollback(self):
+            self.rolled_back = True
+
+        def close(self):
+            self.closed = True
+
+    db = Session()
+    try:
+        with module.session_scope(lambda: db):
+            raise RuntimeError("falhou")
+    except RuntimeError:
+        pass
+
+    assert db.rolled_back is True
+    assert db.closed is True
+
+
+def test_timed_pool_logs_slow_checkout(monkeypatch, caplog):
+    module, _, _ = _import_fresh_database_module(monkeypatch, None)
+    monkeypatch.setattr(module, "SLOW_CHECKOUT_MS", 50)
+
+    pool = module.TimedQueuePool(lambda: sqlite3.connect(":memory:"), pool_size=1, max_overflow=0, timeout=2)
+    held = pool.connect()
+    threading.Timer(0.1, held.close).start()
+
+    with caplog.at_level(logging.WARNING, logger=module.__name__):
+        pool.connect().close()
+
+    assert any("Checkout do pool esperou" in r.getMessage() for r in caplog.records)
+
+
+def test_timed_pool_measures_engine_checkouts(monkeypatch, caplog):
+    module, _, _ = _import_fresh_database_module(monkeypatch, None)
+    engine = real_create_engine("sqlite://", poolclass=module.TimedQueuePool, pool_size=1, max_overflow=0)
+
+    with caplog.at_level(logging.DEBUG, logger=module.__name__):
+        with engine.connect() as conn:
+            conn.execute(sqlalchemy.text("SELECT 1"))
+
+    assert any("Checkout do pool esperou" in r.getMessage() for r in caplog.records)
+
+
+def test_without_replica_reads_use_primary_session(monkeypatch):
+    monkeypatch.delenv("READ_DATABASE_URL", raising=False)
+    module, _, engine_stub = _import_fresh_database_module(monkeypatch, None)
+
+    assert module.read_engine is engine_stub
+    assert module.ReadSessionLocal is module.SessionLocal
+    assert module.replica_router.reader() is engine_stub
+
+
+def test_read_replica_gets_own_engine_and_routing_session(monkeypatch, tmp_path):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'primary.db'}")
+    monkeypatch.setenv("READ_DATABASE_URL", f"sqlite:///{tmp_path / 'replica.db'}")
+    sys.modules.pop("src.database", None)
+    module = importlib.import_module("src.database")
+
+    assert module.read_engine is not module.engine
+    assert str(module.read_engine.url).endswith("replica.db")
+    with module.ReadSessionLocal() as db:
+        assert isinstance(db, module.RoutingSession)
+        assert db.get_bind() is module.read_engine
+
+
+def _routing_fixture(module, tmp_path, replica_url):
+    # sqlalchemy.create_engine está interceptado pelo import do módulo
+    primary = real_create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    replica = real_create_engine(replica_url)
+    metadata = sqlalchemy.MetaData()
+    table = sqlalchemy.Table("item", metadata, sqlalchemy.Column("name", sqlalchemy.String))
+    metadata.create_all(primary)
+    with primary.begin() as conn:
+        conn.execute(table.insert().values(name="primário"))
+
+    router = module.ReplicaRouter(primary, replica, check_interval=60)
+    session_class = type("TestRoutingSession", (module.RoutingSession,), {"router": router})
+    return router, session_class, table
+
+
+def test_routing_session_reads_from_replica_and_writes_to_primary(monkeypatch, tmp_path):
+    module, _, _ = _import_fresh_database_module(monkeypatch, None)
+    router, session_class, table = _routing_fixture(module, tmp_path, f"sqlite:///{tmp_path / 'replica.db'}")
+    table.metadata.create_all(router.replica)
+    with router.replica.begin() as conn:
+        conn.execute(table.insert().values(name="réplica"))
+
+    with session_class() as db:
+        assert db.execute(sqlalchemy.select(table.c.name)).scalars().all() == ["réplica"]
+        db.execute(table.insert().values(name="novo"))
+        db.commit()
+
+    with router.primary.connect() as conn:
+        assert conn.execute(sqlalchemy.select(table.c.name)).scalars().all() == ["primário", "novo"]
+
+
+def test_reads_fall_back_to_primary_when_replica_is_down(monkeypatch, tmp_path, caplog):
+    module, _, _ = _import_fresh_database_module(monkeypatch, None)
+    router, session_class, table = _routing_fixture(module, tmp_path, f"sqlite:///{tmp_path / 'nao_existe' / 'replica.db'}")
+
+    with caplog.at_level(logging.WARNING, logger=module.__name__):
+        with session_class() as db:
+            assert db.execute(sqlalchemy.select(table.c.name)).scalars().all() == ["primário"]
+
+    assert router.reader() is router.primary
+    assert any("Réplica de leitura indisponível" in r.getMessage() for r in caplog.records)
+
+
+def test_replica_that_dies_between_reads_is_retried_on_primary(monkeypatch, tmp_path):
+    module, _, _ = _import_fresh_database_module(monkeypatch, None)
+    replica_path = tmp_path / "replica.db"
+    alive = {"up": True}
+
+    def connect_replica():
+        if not alive["up"]:
+            raise sqlite3.OperationalError("réplica fora do ar")
+        return sqlite3.connect(str(replica_path), check_same_thread=False)
+
+    router, session_class, table = _routing_fixture(module, tmp_path, "sqlite://")
+    router.replica = real_create_engine("sqlite://", creator=connect_replica)
+    sqlalchemy.event.listen(router.replica, "handle_error", router._on_error)
+    table.metadata.create_all(router.replica)
+    with router.replica.begin() as conn:
+        conn.execute(table.insert().values(name="réplica"))
+
+    with session_class() as db:
+        assert db.execute(sqlalchemy.select(table.c.name)).scalars().all() == ["réplica"]
+
+    # Réplica cai depois do último teste de saúde: a leitura não chega como erro
+    alive["up"] = False
+    router.replica.dispose()
+    with session_class() as db:
+        assert db.execute(sqlalchemy.select(table.c.name)).scalars().all() == ["primário"]
+    assert router.reader() is router.primary
+    router.stop()
+
+
+def test_replica_health_is_probed_in_background(monkeypatch, tmp_path):
+    module, _, _ = _import_fresh_database_module(monkeypatch, None)
+    router, _, _ = _routing_fixture(module, tmp_path, f"sqlite:///{tmp_path / 'replica.db'}")
+    router.check_interval = 0.01
+    router.mark_down()
+
+    # A requisição não testa a réplica: recebe o primário na hora
+    assert router.reader() is router.primary
+    deadline = time.monotonic() + 5
+    while router.reader() is not router.replica and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert router.reader() is router.replica
+    router.stop()
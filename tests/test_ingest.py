@@ -0,0 +1,154 @@
+import io
+import json
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.pool import StaticPool
+
+import src.ingest as ingest_mod
+from src.database import Base
+from src.models import Brand, Model as CarModel, PriceCollection
+from src.periods import to_month_key
+
+CSV_ROWS = """model_id,year_model,price,region,collected_at
+10,2024,95000.50,df,2026-01-10T12:00:00
+10,2024,120000,SP,2026-02-01 08:30:00
+99,2024,95000,DF,2026-01-10
+10,1800,95000,DF,2026-01-10
+10,2024,12,DF,2026-01-10
+10,2024,95000,XX,2026-01-10
+10,2024,95000,DF,ontem
+"""
+
+
+@pytest.fixture()
+def engine(monkeypatch):
+    eng = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        future=True,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(eng)
+    with eng.begin() as conn:
+        conn.execute(Brand.__table__.insert().values(id=1, name="Fiat"))
+        conn.execute(CarModel.__table__.insert().values(id=10, brand_id=1, name="Argo", vehicle_type="Carro"))
+    monkeypatch.setattr(ingest_mod, "engine", eng)
+    return eng
+
+
+def test_validate_chunk_flags_each_problem():
+    chunk = pd.read_csv(io.StringIO(CSV_ROWS), dtype=str)
+
+    valid, rejected = ingest_mod.validate_chunk(chunk, known_models={10}, max_year=2027)
+
+    assert list(valid.columns) == list(ingest_mod.LOAD_COLUMNS)
+    assert valid["region"].tolist() == ["DF", "SP"]
+    assert valid["month_key"].tolist() == [202601, 202602]
+    assert rejected["reason"].tolist() == [
+        "UNKNOWN_MODEL", "INVALID_YEAR", "INVALID_PRICE", "INVALID_REGION", "INVALID_DATE",
+    ]
+
+
+def test_month_key_uses_the_local_calendar_like_the_orm():
+    chunk = pd.DataFrame({
+        "model_id": ["10"] * 3, "year_model": ["2024"] * 3, "price": ["95000"] * 3, "region": ["DF"] * 3,
+        "collected_at": ["2024-01-31T22:00:00-03:00", "2024-02-01T01:30:00Z", "2024-01-31 23:30:00"],
+    })
+
+    valid, _ = ingest_mod.validate_chunk(chunk, known_models={10}, max_year=2027)
+
+    # Todas ainda são 31/01 no horário de Brasília
+    assert valid["month_key"].tolist() == [202401, 202401, 202401]
+    assert valid["month_key"].tolist() == [to_month_key(ts.to_pydatetime()) for ts in valid["collected_at"]]
+    # Sem fuso = horário local, guardado em UTC
+    assert valid["collected_at"].iloc[2] == pd.Timestamp("2024-02-01T02:30:00Z")
+
+
+def test_ingest_files_loads_valid_rows_and_quarantines_the_rest(engine, tmp_path):
+    csv_path = tmp_path / "coletas.csv"
+    csv_path.write_text(CSV_ROWS)
+    jsonl_path = tmp_path / "coletas.jsonl"
+    jsonl_path.write_text("\n".join(json.dumps(row) for row in [
+        {"model_id": 10, "year_model": 2025, "price": 101000.0, "region": "RJ", "collected_at": "2026-03-05T10:00:00Z"},
+        {"model_id": 10, "year_model": 2025, "price": None, "region": "RJ", "collected_at": "2026-03-05T10:00:00Z"},
+    ]))
+    quarantine = tmp_path / "quarentena.csv"
+
+    totals = ingest_mod.ingest_files([str(csv_path), str(jsonl_path)], str(quarantine), chunk_rows=3)
+
+    assert (totals["read"], totals["loaded"], totals["rejected"]) == (9, 3, 6)
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(PriceCollection.region, PriceCollection.month_key).order_by(PriceCollection.id)
+        ).all()
+    assert rows == [("DF", 202601), ("SP", 202602), ("RJ", 202603)]
+
+    rejected = pd.read_csv(quarantine)
+    assert rejected["reason"].tolist()[-1] == "INVALID_PRICE"
+    # Linha de origem preservada entre blocos (chunk_rows=3)
+    assert rejected["source_line"].tolist() == [3, 4, 5, 6, 7, 2]
+
+
+def test_ingest_rejects_file_without_required_columns(engine, tmp_path):
+    path = tmp_path / "incompleto.csv"
+    path.write_text("model_id,price\n10,1000\n")
+
+    with pytest.raises(ValueError, match="year_model"):
+        ingest_mod.ingest_files([str(path)], str(tmp_path / "q.csv"))
+
+
+def test_content_hash_identifies_resent_listings():
+    chunk = pd.DataFrame({
+        "model_id": ["10", "10", "10", "10"],
+        "year_model": ["2024"] * 4,
+        "price": ["95000.50", "95000.5", "95000.51", "95000.50"],
+        "region": ["DF", " df", "DF", "DF"],
+        "collected_at": ["2026-01-10T12:00:00Z", "2026-01-10 09:00:00-03:00", "2026-01-10T12:00:00Z", "2026-01-10T12:00:00Z"],
+        "source_id": ["abc", "abc", "abc", "xyz"],
+    })
+
+    valid, _ = ingest_mod.validate_chunk(chunk, known_models={10}, max_year=2027)
+    hashes = valid["content_hash"].tolist()
+
+    # Mesmo anúncio (formatação diferente) = mesmo hash; preço ou origem diferente = outro
+    assert hashes[0] == hashes[1]
+    assert len({hashes[0], hashes[2], hashes[3]}) == 3
+    assert valid["content_hash"].dtype == "int64"
+
+
+def test_reingesting_skips_duplicates_and_reports_them(engine, tmp_path, capsys):
+    path = tmp_path / "coletas.csv"
+    path.write_text(
+        "model_id,year_model,price,region,collected_at,source_id\n"
+        "10,2024,95000,DF,2026-01-10,a1\n"
+        "10,2024,95000,DF,2026-01-10,a1\n"
+        "10,2024,97000,SP,2026-01-11,\n"
+    )
+
+    first = ingest_mod.ingest_files([str(path)], str(tmp_path / "q.csv"))
+    second = ingest_mod.ingest_files([str(path)], str(tmp_path / "q.csv"))
+
+    assert (first["loaded"], first["duplicates"]) == (2, 1)
+    assert (second["loaded"], second["duplicates"]) == (0, 3)
+    assert "3 duplicadas (100.0%)" in capsys.readouterr().out
+    with engine.connect() as conn:
+        rows = conn.execute(select(PriceCollection.source_id).order_by(PriceCollection.id)).scalars().all()
+    assert rows == ["a1", None]
+
+
+def test_rerun_rewrites_quarantine_instead_of_appending(engine, tmp_path):
+    path = tmp_path / "coletas.csv"
+    path.write_text(
+        "model_id,year_model,price,region,collected_at\n"
+        "10,2024,95000,DF,2026-01-10\n"
+        "10,2024,95000,DF,ontem\n"
+    )
+    quarantine = tmp_path / "q.csv"
+
+    ingest_mod.ingest_files([str(path)], str(quarantine))
+    ingest_mod.ingest_files([str(path)], str(quarantine))
+
+    rejected = pd.read_csv(quarantine)
+    assert rejected["reason"].tolist() == ["INVALID_DATE"]
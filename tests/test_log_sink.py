@@ -0,0 +1,134 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.database import Base
+from src.log_sink import QueryLogSink
+from src.models import QueryLog
+from src.repositories import CarRepository
+
+
+@pytest.fixture()
+def session_factory():
+    # Mesma conexão compartilhada entre a thread do teste e a do sink
+    engine = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        future=True,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+
+
+def _saved_logs(session_factory):
+    with session_factory() as db:
+        return db.execute(select(QueryLog).order_by(QueryLog.id)).scalars().all()
+
+
+def _wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_flushes_when_batch_is_full(session_factory):
+    sink = QueryLogSink(session_factory, batch_size=3, flush_interval_ms=60_000).start()
+    try:
+        for year in (2022, 2023, 2024):
+            assert sink.submit(2, 11, year, "SUCCESS", "DF")
+
+        assert _wait_until(lambda: sink.written == 3)
+        logs = _saved_logs(session_factory)
+        assert [log.year_model for log in logs] == [2022, 2023, 2024]
+        assert all(log.created_at is not None for log in logs)
+    finally:
+        sink.close()
+
+
+def test_flushes_after_interval(session_factory):
+    sink = QueryLogSink(session_factory, batch_size=100, flush_interval_ms=20).start()
+    try:
+        sink.submit(2, 11, 2024, "NO_RESULT", "SP")
+        assert _wait_until(lambda: sink.written == 1)
+    finally:
+        sink.close()
+
+
+def test_close_flushes_pending_entries(session_factory):
+    # Sem start(): nada é gravado até o close
+    sink = QueryLogSink(session_factory, batch_size=2)
+    for year in (2022, 2023, 2024):
+        sink.submit(2, 11, year, "SUCCESS")
+
+    assert _saved_logs(session_factory) == []
+
+    sink.close()
+    assert sink.written == 3
+    assert len(_saved_logs(session_factory)) == 3
+
+
+def test_drop_policy_never_blocks_when_full(session_factory):
+    sink = QueryLogSink(session_factory, max_queue=2)
+
+    assert sink.submit(1, 1, 2024, "SUCCESS")
+    assert sink.submit(1, 1, 2024, "SUCCESS")
+
+    started = time.perf_counter()
+    assert sink.submit(1, 1, 2024, "SUCCESS") is False
+    assert time.perf_counter() - started < 0.05
+    assert sink.dropped == 1
+
+
+def test_block_policy_waits_then_drops(session_factory):
+    sink = QueryLogSink(session_factory, max_queue=1, overflow="block", block_timeout=0.05)
+    sink.submit(1, 1, 2024, "SUCCESS")
+
+    started = time.perf_counter()
+    assert sink.submit(1, 1, 2024, "SUCCESS") is False
+    assert time.perf_counter() - started >= 0.04
+    assert sink.dropped == 1
+
+
+def test_invalid_overflow_policy(session_factory):
+    with pytest.raises(ValueError):
+        QueryLogSink(session_factory, overflow="explode")
+
+
+def test_write_failure_is_counted_not_raised():
+    # Sessão sem bind: o INSERT falha dentro do sink
+    sink = QueryLogSink(sessionmaker())
+    sink.submit(1, 1, 2024, "SUCCESS")
+    sink.flush()
+
+    assert sink.written == 0
+    assert sink.failed == 1
+
+
+def test_repository_create_log_enqueues_without_commit(session_factory):
+    sink = QueryLogSink(session_factory)
+    with session_factory() as db:
+        repo = CarRepository(db, log_sink=sink)
+        repo.create_log(brand_id=10, model_id=100, year_model=2022, status="SUCCESS", region="DF")
+
+        # Nada foi gravado na sessão da leitura
+        assert db.execute(select(QueryLog)).scalars().all() == []
+
+    sink.close()
+    logs = _saved_logs(session_factory)
+    assert [(log.brand_id, log.model_id, log.region, log.status) for log in logs] == [(10, 100, "DF", "SUCCESS")]
+
+
+def test_bulk_log_counts_are_written(session_factory):
+    sink = QueryLogSink(session_factory)
+    sink.submit(None, None, None, "BULK", items_requested=1000, items_matched=987)
+    sink.close()
+
+    [log] = _saved_logs(session_factory)
+    assert (log.status, log.items_requested, log.items_matched) == ("BULK", 1000, 987)
@@ -4,11 +4,35 @@ import pandas as pd
 import pytest
 
 
+service_calls = []
+opened_sessions = []
+
+
+class SessionStub:
+    def __init__(self):
+        self.closed = False
+        opened_sessions.append(self)
+
+    def execute(self, stmt):
+        # Única consulta fora do serviço fake: a versão dos dados publicada pelo batch
+        class Result:
+            def scalar(self):
+                return 1
+        return Result()
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
 class FakeCarService:
-    def __init__(self, db):
-        self.calls = []
+    def __init__(self, db, log_sink=None, cache=None):
+        self.calls = service_calls
 
     def list_brands(self):
+        self.calls.append(("list_brands",))
         return {"Ford": 2}
 
     def list_models(self, brand_id: int):
@@ -22,10 +46,26 @@ class FakeCarService:
     def list_regions(self):
         return ["DF", "SP"]
 
-    def get_consolidated_price(self, brand_id: int, model_id: int, year_model: int, region=None):
-        self.calls.append(("get_consolidated_price", brand_id, model_id, year_model, region))
+    def get_consolidated_prices(self, brand_id: int, model_id: int, year_model: int, regions, last_n_months=None):
+        assert last_n_months == 12
+        self.calls.append(("get_consolidated_prices", brand_id, model_id, year_model, tuple(regions)))
+        return {region: self._consolidated_price(region) for region in regions}
+
+    def get_price_matrix(self, brand_id: int, model_id: int, year_model: int, last_n_months=None):
+        self.calls.append(("get_price_matrix", brand_id, model_id, year_model))
+        prices = pd.DataFrame({"2026-01": [1100.0, 900.0]}, index=["DF", "SP"])
+        national = pd.Series({"2026-01": 1000.0})
+        return {
+            "months": ["2026-01"],
+            "prices": prices,
+            "samples": pd.DataFrame({"2026-01": [3, 10]}, index=["DF", "SP"]),
+            "national": national,
+            "spreads_pct": (prices - national) / national * 100,
+        }
+
+    def _consolidated_price(self, region):
 
-        if region is None:
+        if region in (None, "Nacional"):
             df = pd.DataFrame(
                 [
                     {"Mês": "2026-01", "Preço Médio": 1000.0, "Amostras": 10},
@@ -113,13 +153,19 @@ def test_streamlit_main_flow(monkeypatch):
 
     import src.services as services_mod
     import src.database as database_mod
+    import src.migrate as migrate_mod
 
     # Não tocar no banco real
     monkeypatch.setattr(database_mod.Base.metadata, "create_all", lambda *a, **k: None, raising=True)
-    monkeypatch.setattr(database_mod, "SessionLocal", lambda: object(), raising=True)
+    monkeypatch.setattr(migrate_mod, "run_migrations", lambda *a, **k: None, raising=True)
+    monkeypatch.setattr(migrate_mod, "check_database_ready", lambda *a, **k: None, raising=True)
+    monkeypatch.setattr(database_mod, "SessionLocal", SessionStub, raising=True)
+    monkeypatch.setattr(database_mod, "ReadSessionLocal", SessionStub, raising=True)
 
     # Service fake
     monkeypatch.setattr(services_mod, "CarService", FakeCarService, raising=True)
+    service_calls.clear()
+    opened_sessions.clear()
 
     project_root = Path(__file__).resolve().parents[1]
     app_path = _find_streamlit_app_file(project_root)
@@ -130,6 +176,8 @@ def test_streamlit_main_flow(monkeypatch):
     labels = _sidebar_labels(at)
     assert "Marca" in labels
     assert "Região" in labels
+    # "Nacional" aparece uma única vez (o serviço não repete o rollup nacional)
+    assert list(at.sidebar.selectbox[-1].options).count("Nacional") == 1
 
     at.sidebar.selectbox[0].set_value("Ford")
     at.run()
@@ -151,12 +199,50 @@ def test_streamlit_main_flow(monkeypatch):
     at.run()
     _assert_no_exception(at, "após clicar consultar")
 
+    # Regional + nacional em uma única chamada ao serviço
+    price_calls = [c for c in service_calls if c[0] == "get_consolidated_prices"]
+    assert [c[-1] for c in price_calls] == [("DF", "Nacional")]
+
     rendered = _any_rendered_text(at)
     assert "Análise:" in rendered
     assert "Referência:" in rendered
+    assert "COMPARATIVO NACIONAL" in rendered
     # assert len(at.plotly_chart) >= 1 
     assert "Histórico Recente" in rendered
 
+    # Mudar um filtro não refaz a consulta: o resultado só muda no clique
+    at.sidebar.selectbox[3].set_value("SP")
+    at.run()
+    _assert_no_exception(at, "após trocar o filtro")
+    assert len([c for c in service_calls if c[0] == "get_consolidated_prices"]) == 1
+    assert "COMPARATIVO NACIONAL" in _any_rendered_text(at)
+    at.sidebar.selectbox[3].set_value("DF")
+    at.run()
+
+    # Mapa regional só é consultado quando o usuário liga a visão
+    assert not [c for c in service_calls if c[0] == "get_price_matrix"]
+    at.toggle[0].set_value(True)
+    at.run()
+    _assert_no_exception(at, "após abrir o mapa regional")
+    assert [c for c in service_calls if c[0] == "get_price_matrix"] == [("get_price_matrix", 2, 11, 2024)]
+    # Mapa guardado na sessão chaveado também pela versão dos dados
+    assert at.session_state["region_matrix"][0] == (1, 2, 11, 2024)
+
+    # Página de estoque: upload de CSV no lugar da consulta
+    at.sidebar.radio[0].set_value("📦 Estoque (CSV)")
+    at.run()
+    _assert_no_exception(at, "na página de estoque")
+    assert "Avaliação de Estoque" in _any_rendered_text(at)
+    at.sidebar.radio[0].set_value("🔍 Consulta de Preço")
+    at.run()
+
+    # Catálogo vem do st.cache_data enquanto a versão dos dados não muda
+    assert service_calls.count(("list_brands",)) == 1
+
+    # Cada chamada ao serviço abriu e devolveu a própria sessão
+    assert opened_sessions
+    assert all(s.closed for s in opened_sessions)
+
     history = _get_history_from_session_state(at)
 
     at.sidebar.button[0].click()
@@ -0,0 +1,143 @@
+import importlib
+import os
+
+import pytest
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.database import Base
+from src.migrate import check_database_ready, partition_price_collections, run_migrations
+from src.partitions import is_partitioned, list_month_partitions
+
+
+def test_readiness_fails_before_migration_and_passes_after():
+    engine = create_engine("sqlite+pysqlite:///:memory:", future=True)
+
+    with pytest.raises(OperationalError):
+        check_database_ready(engine)
+
+    run_migrations(engine)
+    assert "monthly_averages" in inspect(engine).get_table_names()
+    check_database_ready(engine)
+
+
+def test_readiness_check_is_a_single_query():
+    engine = create_engine("sqlite+pysqlite:///:memory:", future=True)
+    run_migrations(engine)
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cursor, stmt, *a: statements.append(stmt))
+    check_database_ready(engine)
+
+    assert len(statements) == 1
+
+
+# Schema da versão anterior (sem month_key, chave única, dedup, batch_state...)
+LEGACY_SCHEMA = [
+    "CREATE TABLE brands (id INTEGER PRIMARY KEY, name VARCHAR UNIQUE)",
+    "CREATE TABLE models (id INTEGER PRIMARY KEY, brand_id INTEGER REFERENCES brands(id), name VARCHAR, vehicle_type VARCHAR)",
+    "CREATE TABLE price_collections (id INTEGER PRIMARY KEY, model_id INTEGER REFERENCES models(id), year_model INTEGER, "
+    "price FLOAT, region VARCHAR, collected_at DATETIME)",
+    "CREATE TABLE monthly_averages (id INTEGER PRIMARY KEY, brand_id INTEGER, model_id INTEGER, year_model INTEGER, "
+    "month_ref VARCHAR, region VARCHAR, avg_price FLOAT, samples_count INTEGER, created_at DATETIME)",
+    "CREATE TABLE query_logs (id INTEGER PRIMARY KEY, brand_id INTEGER, model_id INTEGER, year_model INTEGER, "
+    "region VARCHAR, status VARCHAR, created_at DATETIME)",
+    "CREATE TABLE batch_state (name VARCHAR PRIMARY KEY, last_collection_id INTEGER NOT NULL, updated_at DATETIME)",
+]
+
+
+def _legacy_engine():
+    engine = create_engine("sqlite+pysqlite:///:memory:", future=True, poolclass=StaticPool)
+    with engine.begin() as conn:
+        for ddl in LEGACY_SCHEMA:
+            conn.execute(text(ddl))
+        conn.execute(text("INSERT INTO brands VALUES (1, 'Ford')"))
+        conn.execute(text("INSERT INTO models VALUES (11, 1, 'Ka', 'Carro')"))
+        conn.execute(text(
+            "INSERT INTO price_collections VALUES (1, 11, 2024, 100.0, 'DF', '2025-12-05 10:00:00'), "
+            "(2, 11, 2024, 300.0, 'DF', '2026-01-20 10:00:00')"
+        ))
+        # Duas linhas para a mesma chave (batch antigo sem upsert): fica a mais nova
+        conn.execute(text(
+            "INSERT INTO monthly_averages (id, brand_id, model_id, year_model, month_ref, region, avg_price, samples_count) "
+            "VALUES (1, 1, 11, 2024, '2025-12', 'DF', 90.0, 1), (2, 1, 11, 2024, '2025-12', 'DF', 100.0, 1)"
+        ))
+        conn.execute(text("INSERT INTO batch_state (name, last_collection_id) VALUES ('monthly_averages', 1)"))
+    return engine
+
+
+def test_run_migrations_upgrades_legacy_tables():
+    engine = _legacy_engine()
+
+    run_migrations(engine)
+
+    inspector = inspect(engine)
+    assert {"month_key", "source_id", "content_hash"} <= {c["name"] for c in inspector.get_columns("price_collections")}
+    assert {"items_requested", "items_matched"} <= {c["name"] for c in inspector.get_columns("query_logs")}
+    assert "uq_monthly_averages_key" in {i["name"] for i in inspector.get_indexes("monthly_averages")}
+    assert "uq_price_collections_content_hash" in {i["name"] for i in inspector.get_indexes("price_collections")}
+
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT id, month_key FROM price_collections ORDER BY id")).all() == [(1, 202512), (2, 202601)]
+        assert conn.execute(text("SELECT id, month_key, avg_price FROM monthly_averages")).all() == [(2, 202512, 100.0)]
+        assert conn.execute(text("SELECT data_version FROM batch_state")).scalar() == 0
+
+
+def test_run_migrations_is_idempotent_and_batch_runs_on_upgraded_tables(monkeypatch):
+    engine = _legacy_engine()
+    run_migrations(engine)
+    run_migrations(engine)
+
+    batch_mod = importlib.import_module("src.batch_etl")
+    monkeypatch.setattr(batch_mod, "SessionLocal", sessionmaker(bind=engine, autoflush=False, future=True))
+    batch_mod.run_monthly_batch(full_refresh=True)
+
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT region, month_key, avg_price FROM monthly_averages WHERE region = 'DF' ORDER BY month_key"
+        )).all()
+    assert rows == [("DF", 202512, 100.0), ("DF", 202601, 300.0)]
+
+
+@pytest.fixture()
+def postgres_engine():
+    url = os.getenv("TEST_DATABASE_URL", "")
+    if not url.startswith(("postgresql://", "postgres://")):
+        pytest.skip("TEST_DATABASE_URL (Postgres) não configurada")
+
+    engine = create_engine(url.replace("postgres://", "postgresql://", 1), future=True)
+    Base.metadata.drop_all(engine)
+    yield engine
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+def test_postgres_converts_legacy_price_collections_to_partitioned(postgres_engine):
+    with postgres_engine.begin() as conn:
+        for ddl in LEGACY_SCHEMA:
+            conn.execute(text(ddl.replace("DATETIME", "TIMESTAMP WITH TIME ZONE").replace("id INTEGER PRIMARY KEY", "id SERIAL PRIMARY KEY", 1)))
+        conn.execute(text("INSERT INTO brands (id, name) VALUES (1, 'Ford')"))
+        conn.execute(text("INSERT INTO models (id, brand_id, name) VALUES (11, 1, 'Ka')"))
+        conn.execute(text(
+            "INSERT INTO price_collections (model_id, year_model, price, region, collected_at) "
+            "VALUES (11, 2024, 100.0, 'DF', '2019-03-05 10:00:00-03'), (11, 2024, 300.0, 'DF', now())"
+        ))
+
+    run_migrations(postgres_engine)
+    with postgres_engine.begin() as conn:
+        assert not is_partitioned(conn)
+        assert partition_price_collections(conn) == 2
+
+    with postgres_engine.begin() as conn:
+        assert is_partitioned(conn)
+        assert partition_price_collections(conn) == 0
+        assert 201903 in list_month_partitions(conn)
+        assert conn.execute(text("SELECT to_regclass('price_collections_legacy')")).scalar() is None
+        # Mesmos ids; a sequence continua depois do maior
+        new_id = conn.execute(text(
+            "INSERT INTO price_collections (model_id, year_model, price, region, month_key) "
+            "VALUES (11, 2024, 200.0, 'DF', 201903) RETURNING id"
+        )).scalar()
+        assert new_id == 3
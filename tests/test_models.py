@@ -1,4 +1,5 @@
 import pytest
+from datetime import datetime
 from sqlalchemy import create_engine, inspect
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
@@ -109,6 +110,12 @@ def test_can_insert_minimal_rows_and_defaults_work(db):
     db.refresh(pc)
     assert pc.id is not None
     assert pc.collected_at is not None  # default do banco
+    assert 200001 <= pc.month_key <= 999912  # YYYYMM preenchido na ingestão
+
+    pc_jan = PriceCollection(model_id=m.id, year_model=2024, price=1000.0, region="DF", collected_at=datetime(2026, 1, 31, 23, 59))
+    db.add(pc_jan)
+    db.commit()
+    assert pc_jan.month_key == 202601
 
     # MonthlyAverage: created_at tem server_default=func.now(), region nullable
     ma = MonthlyAverage(
@@ -178,3 +185,28 @@ def test_monthly_averages_relationships(db):
         db.commit()
     db.rollback()
 
+
+
+def test_monthly_averages_natural_key_unique(db):
+    """Chave natural (model_id, year_model, region, month_ref) usada no upsert do batch"""
+    b = Brand(name="Fiat")
+    db.add(b)
+    db.commit()
+
+    m = Model(name="Uno", brand_id=b.id, vehicle_type="Carro")
+    db.add(m)
+    db.commit()
+
+    for price in (10.0, 20.0):
+        db.add(MonthlyAverage(
+            brand_id=b.id,
+            model_id=m.id,
+            year_model=2020,
+            month_ref="2024-01",
+            region="SP",
+            avg_price=price,
+            samples_count=1
+        ))
+    with pytest.raises(IntegrityError):
+        db.commit()
+    db.rollback()
@@ -0,0 +1,114 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.schema import CreateTable
+
+from src.database import Base
+from src.models import Brand, Model as CarModel, PriceCollection
+from src.partitions import (
+    DEFAULT_PARTITION,
+    INITIAL_PAST_MONTHS,
+    FUTURE_MONTHS,
+    detach_month_partitions,
+    ensure_month_partitions,
+    list_month_partitions,
+    partition_name,
+)
+
+
+def test_postgres_ddl_partitions_by_month_key():
+    ddl = str(CreateTable(PriceCollection.__table__).compile(dialect=postgresql.dialect()))
+
+    assert "PARTITION BY RANGE (month_key)" in ddl
+    # PK de tabela particionada precisa da chave de partição
+    assert "PRIMARY KEY (id, month_key)" in ddl
+
+
+def test_sqlite_ddl_is_unchanged():
+    ddl = str(CreateTable(PriceCollection.__table__).compile(dialect=sqlite.dialect()))
+
+    assert "PARTITION" not in ddl
+    assert "month_key)" not in ddl
+    assert "id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT" in ddl
+
+
+def test_partition_helpers_are_noop_outside_postgres():
+    engine = create_engine("sqlite+pysqlite:///:memory:", future=True)
+    Base.metadata.create_all(engine)
+
+    with engine.begin() as conn:
+        assert ensure_month_partitions(conn, [202601]) == []
+        assert list_month_partitions(conn) == []
+        assert detach_month_partitions(conn, 202701, drop=True) == []
+
+
+@pytest.fixture()
+def postgres_engine():
+    url = os.getenv("TEST_DATABASE_URL", "")
+    if not url.startswith(("postgresql://", "postgres://")):
+        pytest.skip("TEST_DATABASE_URL (Postgres) não configurada")
+
+    engine = create_engine(url.replace("postgres://", "postgresql://", 1), future=True)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    yield engine
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+def _scanned_relations(node):
+    found = [node["Relation Name"]] if "Relation Name" in node else []
+    for child in node.get("Plans", []):
+        found.extend(_scanned_relations(child))
+    return found
+
+
+def test_postgres_month_filter_prunes_partitions_and_detach_is_metadata_only(postgres_engine):
+    with postgres_engine.begin() as conn:
+        # create_all já cria o mês atual, os anteriores e alguns à frente
+        assert len(list_month_partitions(conn)) == INITIAL_PAST_MONTHS + FUTURE_MONTHS + 1
+
+        assert ensure_month_partitions(conn, [201912, 202001]) == [201912, 202001]
+        assert ensure_month_partitions(conn, [202001]) == []
+
+        conn.execute(Brand.__table__.insert().values(id=1, name="Fiat"))
+        conn.execute(CarModel.__table__.insert().values(id=10, brand_id=1, name="Argo"))
+        conn.execute(PriceCollection.__table__.insert(), [
+            {"model_id": 10, "year_model": 2020, "price": 1000.0, "region": "DF",
+             "collected_at": datetime(2019, 12, 5), "month_key": 201912},
+            {"model_id": 10, "year_model": 2020, "price": 2000.0, "region": "DF",
+             "collected_at": datetime(2020, 1, 5), "month_key": 202001},
+        ])
+
+        plan = conn.execute(text(
+            "EXPLAIN (FORMAT JSON) SELECT avg(price) FROM price_collections WHERE month_key = 202001"
+        )).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        assert set(_scanned_relations(plan[0]["Plan"])) == {partition_name(202001)}
+
+        assert detach_month_partitions(conn, 202001, drop=True) == [201912]
+        assert conn.execute(text("SELECT count(*) FROM price_collections")).scalar() == 1
+        assert conn.execute(text("SELECT to_regclass(:name)"), {"name": partition_name(201912)}).scalar() is None
+
+
+def test_postgres_default_partition_takes_rows_until_their_month_is_created(postgres_engine):
+    with postgres_engine.begin() as conn:
+        conn.execute(Brand.__table__.insert().values(id=1, name="Fiat"))
+        conn.execute(CarModel.__table__.insert().values(id=10, brand_id=1, name="Argo"))
+        # Mês bem à frente, sem partição: cai na DEFAULT em vez de falhar
+        conn.execute(PriceCollection.__table__.insert().values(
+            model_id=10, year_model=2020, price=1000.0, region="DF",
+            collected_at=datetime(2035, 6, 5), month_key=203506,
+        ))
+        assert conn.execute(text(f'SELECT count(*) FROM "{DEFAULT_PARTITION}"')).scalar() == 1
+
+        # Criar o mês move as coletas da DEFAULT para a partição nova
+        assert ensure_month_partitions(conn, [203506]) == [203506]
+        assert conn.execute(text(f'SELECT count(*) FROM "{DEFAULT_PARTITION}"')).scalar() == 0
+        assert conn.execute(text(f'SELECT count(*) FROM "{partition_name(203506)}"')).scalar() == 1
+        assert conn.execute(text("SELECT count(*) FROM price_collections")).scalar() == 1
@@ -0,0 +1,179 @@
+"""
+Regressão de planos de execução: roda EXPLAIN sobre cada SELECT emitido pelos
+métodos de leitura do CarRepository e falha se algum cair em varredura
+sequencial da tabela (índice removido ou consulta que deixou de usá-lo).
+
+SQLite roda sempre (em memória). Postgres roda quando TEST_DATABASE_URL
+aponta para um banco descartável (ex: o do docker-compose).
+"""
+import json
+import os
+import re
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.database import Base
+from src.models import Brand, Model as CarModel, MonthlyAverage
+from src.repositories import CarRepository
+
+# Métodos que só escrevem (fora da regressão de planos de leitura)
+WRITE_METHODS = {"create_log"}
+
+# (método, kwargs): toda variação relevante de cada método de leitura
+READ_CALLS = [
+    ("get_brands", {}),
+    ("get_models_by_brand", {"brand_id": 20}),
+    ("get_catalog", {}),
+    ("get_years_by_model", {"model_id": 200}),
+    ("get_available_regions", {}),
+    ("get_price_history", {"model_id": 200, "year_model": 2022}),
+    ("get_price_history", {"model_id": 200, "year_model": 2022, "region": "DF"}),
+    ("get_price_history", {"model_id": 200, "year_model": 2022, "region": "DF", "since": 202601, "until": 202612}),
+    ("get_price_history", {"model_id": 200, "year_model": 2022, "region": "DF", "last_n_months": 12}),
+    ("get_price_histories", {"model_id": 200, "year_model": 2022, "regions": ["DF", "Nacional"]}),
+    ("get_price_histories", {"model_id": 200, "year_model": 2022, "regions": ["DF", "Nacional"], "last_n_months": 12}),
+    ("get_latest_prices", {"keys": [(200, 2022, "DF"), (200, 2021, "Nacional")]}),
+]
+
+
+def _seed(db):
+    db.add_all([
+        Brand(id=10, name="Fiat"),
+        Brand(id=20, name="Ford"),
+        CarModel(id=100, brand_id=10, name="Argo", vehicle_type="Carro"),
+        CarModel(id=200, brand_id=20, name="Ka", vehicle_type="Carro"),
+    ])
+    db.add_all([
+        MonthlyAverage(
+            brand_id=20, model_id=200, year_model=year, region=region,
+            month_ref=f"2026-{month:02d}", avg_price=1000.0, samples_count=3,
+        )
+        for year in (2021, 2022)
+        for region in ("DF", "SP", "Nacional")
+        for month in range(1, 13)
+    ])
+    db.commit()
+
+
+def _captured_selects(engine, call):
+    statements = []
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", _capture)
+    try:
+        call()
+    finally:
+        event.remove(engine, "before_cursor_execute", _capture)
+    return statements
+
+
+def _run_read_calls(engine):
+    """Executa READ_CALLS e devolve [(descrição, statement, parâmetros)]."""
+    Session = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+    executed = []
+    with Session() as db:
+        repo = CarRepository(db)
+        for name, kwargs in READ_CALLS:
+            selects = _captured_selects(engine, lambda: getattr(repo, name)(**kwargs))
+            assert selects, f"{name}({kwargs}) não emitiu SELECT"
+            executed.extend((f"{name}({kwargs})", stmt, params) for stmt, params in selects)
+    return executed
+
+
+def test_every_read_method_is_covered():
+    public = {
+        name for name in dir(CarRepository)
+        if not name.startswith("_") and callable(getattr(CarRepository, name))
+    }
+    covered = {name for name, _ in READ_CALLS}
+    assert public - WRITE_METHODS == covered
+
+
+# --- SQLite ---
+
+_SQLITE_TABLE_SCAN = re.compile(r"^SCAN (\w+)$")
+
+
+@pytest.fixture()
+def sqlite_engine():
+    engine = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        future=True,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine, future=True)() as db:
+        _seed(db)
+    return engine
+
+
+def test_sqlite_plans_use_indexes(sqlite_engine):
+    offenders = []
+    with sqlite_engine.connect() as conn:
+        for call, statement, params in _run_read_calls(sqlite_engine):
+            plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", params).all()
+            for row in plan:
+                detail = row[-1]
+                if _SQLITE_TABLE_SCAN.match(detail):
+                    offenders.append(f"{call}: {detail}")
+
+    assert offenders == []
+
+
+# --- Postgres ---
+
+def _pg_seq_scans(node):
+    found = []
+    if node.get("Node Type") == "Seq Scan":
+        found.append(node.get("Relation Name"))
+    for child in node.get("Plans", []):
+        found.extend(_pg_seq_scans(child))
+    return found
+
+
+@pytest.fixture()
+def postgres_engine():
+    url = os.getenv("TEST_DATABASE_URL", "")
+    if not url.startswith(("postgresql://", "postgres://")):
+        pytest.skip("TEST_DATABASE_URL (Postgres) não configurada")
+
+    engine = create_engine(url.replace("postgres://", "postgresql://", 1), future=True)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine, future=True)() as db:
+        _seed(db)
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+    # Tabelas pequenas sempre "preferem" Seq Scan: desliga a opção para que só
+    # apareça quando não houver índice utilizável
+    @event.listens_for(engine, "connect")
+    def _disable_seqscan(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("SET enable_seqscan = off")
+        cursor.close()
+
+    engine.dispose()
+    yield engine
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+def test_postgres_plans_use_indexes(postgres_engine):
+    offenders = []
+    with postgres_engine.connect() as conn:
+        for call, statement, params in _run_read_calls(postgres_engine):
+            plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", params).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            for table in _pg_seq_scans(plan[0]["Plan"]):
+                offenders.append(f"{call}: Seq Scan on {table}")
+
+    assert offenders == []
@@ -1,7 +1,7 @@
 import pytest
 from datetime import datetime, timezone
 
-from sqlalchemy import create_engine, select
+from sqlalchemy import create_engine, event, select
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.inspection import inspect as sa_inspect
 
@@ -175,6 +175,88 @@ def test_get_price_history_orders_by_month_and_filters_region(db_session, repo):
     assert all(h.region == "DF" for h in hist_df)
 
 
+def test_get_price_history_fills_integer_month_key(db_session, repo):
+    seed_basic_data(db_session)
+
+    hist = repo.get_price_history(model_id=200, year_model=2022, region="DF")
+    assert [h.month_key for h in hist] == [202601, 202602]
+
+
+def test_get_price_history_since_until_window(db_session, repo):
+    seed_basic_data(db_session)
+
+    hist = repo.get_price_history(model_id=200, year_model=2022, since=202602)
+    assert [h.month_ref for h in hist] == ["2026-02", "2026-03"]
+
+    hist = repo.get_price_history(model_id=200, year_model=2022, since=202601, until=202602)
+    assert [h.month_ref for h in hist] == ["2026-01", "2026-02"]
+
+
+def test_get_price_history_last_n_months_relative_to_latest(db_session, repo):
+    seed_basic_data(db_session)
+    db_session.add_all([
+        _autofill_required_fields(
+            MonthlyAverage,
+            model_id=200,
+            year_model=2022,
+            region="DF",
+            month_ref=month_ref,
+            avg_price=900.0,
+            samples_count=1,
+        )
+        for month_ref in ("2024-12", "2025-11", "2025-12")
+    ])
+    db_session.commit()
+
+    # Último mês em DF é 2026-02: janela de 3 meses = 2025-12 .. 2026-02 (atravessa o ano)
+    hist = repo.get_price_history(model_id=200, year_model=2022, region="DF", last_n_months=3)
+    assert [h.month_ref for h in hist] == ["2025-12", "2026-01", "2026-02"]
+
+    # A janela é relativa ao último mês dentro do filtro "until"
+    hist = repo.get_price_history(model_id=200, year_model=2022, region="DF", until=202512, last_n_months=13)
+    assert [h.month_ref for h in hist] == ["2024-12", "2025-11", "2025-12"]
+
+
+def test_get_price_histories_groups_regions_in_one_query(db_session, repo):
+    seed_basic_data(db_session)
+    statements = []
+    event.listen(db_session.get_bind(), "before_cursor_execute", lambda conn, cursor, stmt, *a: statements.append(stmt))
+
+    histories = repo.get_price_histories(model_id=200, year_model=2022, regions=["SP", "DF", "RJ"])
+
+    assert len(statements) == 1
+    assert list(histories) == ["SP", "DF", "RJ"]
+    assert [h.month_ref for h in histories["DF"]] == ["2026-01", "2026-02"]
+    assert [h.month_ref for h in histories["SP"]] == ["2026-03"]
+    assert histories["RJ"] == []
+
+    # Janela comum: últimos 2 meses entre todas as regiões (2026-02 .. 2026-03)
+    histories = repo.get_price_histories(model_id=200, year_model=2022, regions=["SP", "DF"], last_n_months=2)
+    assert [h.month_ref for h in histories["DF"]] == ["2026-02"]
+    assert [h.month_ref for h in histories["SP"]] == ["2026-03"]
+
+
+def test_get_latest_prices_returns_last_month_per_key(db_session, repo, monkeypatch):
+    seed_basic_data(db_session)
+    keys = [(200, 2022, "DF"), (200, 2021, "SP"), (200, 2022, "RJ")]
+
+    latest = repo.get_latest_prices(keys)
+    by_key = {(h.model_id, h.year_model, h.region): (h.month_ref, h.avg_price) for h in latest}
+    assert by_key == {
+        (200, 2022, "DF"): ("2026-02", 1100.0),
+        (200, 2021, "SP"): ("2026-01", 900.0),
+    }
+
+    # Lotes de chaves: uma consulta por lote
+    import src.repositories as repositories_mod
+    monkeypatch.setattr(repositories_mod, "BULK_KEYS_CHUNK", 2)
+    statements = []
+    event.listen(db_session.get_bind(), "before_cursor_execute", lambda conn, cursor, stmt, *a: statements.append(stmt))
+
+    assert len(repo.get_latest_prices(keys)) == 2
+    assert len(statements) == 2
+
+
 def test_create_log_inserts_row_and_commits(db_session, repo):
     # cria log
     repo.create_log(brand_id=10, model_id=100, year_model=2022, status="FOUND", region="DF")
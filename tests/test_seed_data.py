@@ -0,0 +1,52 @@
+from datetime import datetime
+
+import numpy as np
+
+from src.periods import to_month_key
+from src.seed_data import COLLECTIONS_PER_CELL, HISTORY_MONTHS, REGIONS, YEARS, generate_collections
+
+TODAY = datetime(2026, 1, 15, 12, 0)
+MODELS = [(1, 100000.0), (2, 50000.0)]
+CELLS = len(REGIONS) * HISTORY_MONTHS * len(YEARS)
+
+
+def _generate(**kwargs):
+    return list(generate_collections(MODELS, today=TODAY, **kwargs))
+
+
+def test_same_seed_generates_same_data():
+    first, second = _generate(seed=7), _generate(seed=7)
+
+    for a, b in zip(first, second):
+        for column in a:
+            np.testing.assert_array_equal(a[column], b[column])
+
+    other = _generate(seed=8)
+    assert not np.array_equal(first[0]["price"], other[0]["price"])
+
+
+def test_scale_multiplies_collections_per_cell():
+    low, high = COLLECTIONS_PER_CELL
+
+    base = sum(len(block["price"]) for block in _generate())
+    scaled = sum(len(block["price"]) for block in _generate(scale=10))
+
+    assert len(MODELS) * CELLS * low <= base <= len(MODELS) * CELLS * high
+    assert len(MODELS) * CELLS * low * 10 <= scaled <= len(MODELS) * CELLS * high * 10
+
+
+def test_generated_columns_follow_price_model():
+    block = _generate()[0]
+
+    assert set(block["model_id"]) == {1}
+    assert set(block["region"]) == set(REGIONS)
+    assert set(block["year_model"]) == set(YEARS)
+
+    # Pior caso: SP (1.03), ano 2025 (+10%), volatilidade +5%
+    assert block["price"].max() <= 100000 * 1.03 * 1.10 * 1.05
+    # Pior caso: BA (0.96), 12 meses atrás, ano 2022 (-20%), volatilidade -5%
+    assert block["price"].min() >= 100000 * 0.96 * (1 - 12 * 0.005) * 0.80 * 0.95
+
+    # month_key igual ao que o ORM calcularia a partir do collected_at
+    sample = block["collected_at"][:50].astype(datetime)
+    assert list(block["month_key"][:50]) == [to_month_key(d) for d in sample]
@@ -1,3 +1,5 @@
+import io
+import warnings
 from dataclasses import dataclass
 from typing import Optional
 
@@ -20,6 +22,24 @@ class DummyMonthlyAverage:
     samples_count: int
 
 
+@dataclass
+class DummyRegionalAverage:
+    region: str
+    month_ref: str
+    avg_price: float
+    samples_count: int
+
+
+@dataclass
+class DummyLatestPrice:
+    model_id: int
+    year_model: int
+    region: str
+    month_ref: str
+    avg_price: float
+    samples_count: int
+
+
 class FakeRepo:
     def __init__(self):
         self._brands = [DummyObj(1, "Fiat"), DummyObj(2, "Ford")]
@@ -28,6 +48,10 @@ class FakeRepo:
         self._regions = ["DF", None, "SP"]
         self._history_map = {}  # (model_id, year_model, region) -> list[DummyMonthlyAverage]
         self.logs = []          # (brand_id, model_id, year_model, status, region)
+        self.history_windows = []  # (since, until, last_n_months)
+        self.log_counts = []    # (items_requested, items_matched)
+        self._latest = {}       # (model_id, year_model, region) -> DummyLatestPrice
+        self.latest_calls = []
 
     def get_brands(self):
         return self._brands
@@ -41,9 +65,30 @@ class FakeRepo:
     def get_available_regions(self):
         return self._regions
 
-    def get_price_history(self, model_id: int, year_model: int, region: Optional[str] = None):
+    def get_price_history(
+        self,
+        model_id: int,
+        year_model: int,
+        region: Optional[str] = None,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        last_n_months: Optional[int] = None,
+    ):
+        self.history_windows.append((since, until, last_n_months))
         return self._history_map.get((model_id, year_model, region), [])
 
+    def get_price_histories(
+        self,
+        model_id: int,
+        year_model: int,
+        regions,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        last_n_months: Optional[int] = None,
+    ):
+        self.history_windows.append((since, until, last_n_months))
+        return {r: self._history_map.get((model_id, year_model, r), []) for r in regions}
+
     def create_log(
         self,
         brand_id: Optional[int],
@@ -51,8 +96,18 @@ class FakeRepo:
         year_model: Optional[int],
         status: str,
         region: Optional[str] = None,
+        items_requested: Optional[int] = None,
+        items_matched: Optional[int] = None,
     ):
         self.logs.append((brand_id, model_id, year_model, status, region))
+        self.log_counts.append((items_requested, items_matched))
+
+    def get_catalog(self):
+        return [(2, "Ford", 10, "Fiesta"), (2, "Ford", 11, "Ka")]
+
+    def get_latest_prices(self, keys):
+        self.latest_calls.append(list(keys))
+        return [self._latest[k] for k in keys if k in self._latest]
 
 
 @pytest.fixture()
@@ -84,6 +139,11 @@ def test_list_regions_filters_none(service):
     assert service.list_regions() == ["DF", "SP"]
 
 
+def test_list_regions_hides_national_rollup(service, fake_repo):
+    fake_repo._regions = ["DF", "Nacional", "SP"]
+    assert service.list_regions() == ["DF", "SP"]
+
+
 def test_get_consolidated_price_no_result_logs_and_returns_none(service, fake_repo):
     out = service.get_consolidated_price(brand_id=2, model_id=11, year_model=2024, region="DF")
     assert out is None
@@ -115,3 +175,206 @@ def test_get_consolidated_price_success_returns_kpi_and_history_df(service, fake
 
     # Esperado: 1 log por consulta (SUCCESS com região)
     assert fake_repo.logs == [(2, 11, 2024, "SUCCESS", "DF")]
+
+
+def test_get_consolidated_price_forwards_history_window(service, fake_repo):
+    service.get_consolidated_price(brand_id=2, model_id=11, year_model=2024, region="DF", last_n_months=12)
+    service.get_consolidated_price(brand_id=2, model_id=11, year_model=2024, region="DF", since=202501, until=202512)
+
+    assert fake_repo.history_windows == [(None, None, 12), (202501, 202512, None)]
+
+
+def test_get_consolidated_prices_aligns_regions_and_logs_once(service, fake_repo):
+    fake_repo._history_map[(11, 2024, "DF")] = [
+        DummyMonthlyAverage(month_ref="2026-02", avg_price=1100.0, samples_count=2),
+    ]
+    fake_repo._history_map[(11, 2024, "Nacional")] = [
+        DummyMonthlyAverage(month_ref="2026-01", avg_price=950.0, samples_count=40),
+        DummyMonthlyAverage(month_ref="2026-02", avg_price=1000.0, samples_count=38),
+    ]
+
+    out = service.get_consolidated_prices(
+        brand_id=2, model_id=11, year_model=2024, regions=["DF", "Nacional"], last_n_months=12
+    )
+
+    assert list(out) == ["DF", "Nacional"]
+    assert out["DF"]["current_price"] == 1100.0
+    assert out["Nacional"]["current_price"] == 1000.0
+
+    # Mesmos meses nas duas séries; janeiro não tem dado no DF
+    df_region = out["DF"]["history_df"]
+    assert list(df_region["Mês"]) == list(out["Nacional"]["history_df"]["Mês"]) == ["2026-01", "2026-02"]
+    assert pd.isna(df_region["Preço Médio"].iloc[0])
+    assert list(df_region["Amostras"]) == [0, 2]
+
+    assert fake_repo.history_windows == [(None, None, 12)]
+    assert fake_repo.logs == [(2, 11, 2024, "SUCCESS", "DF")]
+
+
+def test_get_consolidated_prices_without_regional_data(service, fake_repo):
+    fake_repo._history_map[(11, 2024, "Nacional")] = [
+        DummyMonthlyAverage(month_ref="2026-01", avg_price=950.0, samples_count=40),
+    ]
+
+    out = service.get_consolidated_prices(brand_id=2, model_id=11, year_model=2024, regions=["SP", "Nacional"])
+
+    assert out["SP"] is None
+    assert out["Nacional"]["current_price"] == 950.0
+    assert fake_repo.logs == [(2, 11, 2024, "NO_RESULT", "SP")]
+
+
+def test_get_price_matrix_pivots_regions_and_spreads(service, fake_repo):
+    fake_repo._history_map[(11, 2024, None)] = [
+        DummyRegionalAverage("DF", "2026-01", 1100.0, 3),
+        DummyRegionalAverage("Nacional", "2026-01", 1000.0, 30),
+        DummyRegionalAverage("SP", "2026-01", 900.0, 10),
+        DummyRegionalAverage("DF", "2026-02", 1260.0, 2),
+        DummyRegionalAverage("Nacional", "2026-02", 1200.0, 28),
+    ]
+
+    out = service.get_price_matrix(brand_id=2, model_id=11, year_model=2024, last_n_months=12)
+
+    assert out["months"] == ["2026-01", "2026-02"]
+    assert list(out["prices"].index) == ["DF", "SP"]
+    assert out["prices"].loc["DF"].tolist() == [1100.0, 1260.0]
+    assert out["national"].tolist() == [1000.0, 1200.0]
+    assert out["samples"].loc["SP"].tolist() == [10, 0]
+
+    spreads = out["spreads_pct"]
+    assert spreads.loc["DF"].round(2).tolist() == [10.0, 5.0]
+    assert spreads.loc["SP", "2026-01"] == pytest.approx(-10.0)
+    assert pd.isna(spreads.loc["SP", "2026-02"])
+
+    # Uma consulta (todas as regiões) e um log sem região
+    assert fake_repo.history_windows == [(None, None, 12)]
+    assert fake_repo.logs == [(2, 11, 2024, "SUCCESS", None)]
+
+
+def test_get_price_matrix_without_data(service, fake_repo):
+    assert service.get_price_matrix(brand_id=2, model_id=11, year_model=2024) is None
+    assert fake_repo.logs == [(2, 11, 2024, "NO_RESULT", None)]
+
+
+def test_get_bulk_valuation_matches_in_input_order_and_logs_once(service, fake_repo):
+    fake_repo._latest = {
+        (11, 2024, "DF"): DummyLatestPrice(11, 2024, "DF", "2026-02", 1100.0, 2),
+        (11, 2024, "Nacional"): DummyLatestPrice(11, 2024, "Nacional", "2026-02", 1000.0, 30),
+    }
+    vehicles = pd.DataFrame({
+        "model_id": [11, 10, 11, 11],
+        "year_model": [2024, 2023, 2024, 2024],
+        "region": ["DF", "SP", None, "DF"],
+        "plate": ["AAA", "BBB", "CCC", "DDD"],
+    })
+
+    out = service.get_bulk_valuation(vehicles)
+
+    assert list(out["region"]) == ["DF", "SP", "Nacional", "DF"]
+    assert out["avg_price"].tolist()[0] == 1100.0
+    assert pd.isna(out["avg_price"].iloc[1])
+    assert list(out["samples_count"]) == [2, 0, 30, 2]
+    assert list(out["status"]) == ["SUCCESS", "NO_RESULT", "SUCCESS", "SUCCESS"]
+
+    # Chaves repetidas buscadas uma vez, como tipos do Python
+    [keys] = fake_repo.latest_calls
+    assert keys == [(11, 2024, "DF"), (10, 2023, "SP"), (11, 2024, "Nacional")]
+    assert all(isinstance(k[0], int) for k in keys)
+
+    # Um único log agregado
+    assert fake_repo.logs == [(None, None, None, "BULK", None)]
+    assert fake_repo.log_counts == [(4, 3)]
+
+
+def test_get_bulk_valuation_accepts_tuples(service, fake_repo):
+    out = service.get_bulk_valuation([(11, 2024, "DF")])
+
+    assert list(out["status"]) == ["NO_RESULT"]
+    assert fake_repo.log_counts == [(1, 0)]
+
+
+def test_value_inventory_matches_catalog_in_chunks(service, fake_repo):
+    fake_repo._latest = {
+        (11, 2024, "DF"): DummyLatestPrice(11, 2024, "DF", "2026-02", 1100.0, 2),
+        (11, 2024, "Nacional"): DummyLatestPrice(11, 2024, "Nacional", "2026-02", 1000.0, 30),
+    }
+    csv = io.StringIO(
+        "Marca,Modelo,Ano,Regiao,Placa\n"
+        "ford, KA,2024,df,AAA\n"
+        "Ford,Ka,2024,,BBB\n"
+        "Fiat,Uno,2020,SP,CCC\n"
+        "Ford,Ka,abc,SP,DDD\n"
+        "Ford,Fiesta,2020,nacional,EEE\n"
+    )
+
+    out = service.value_inventory(csv, chunksize=2)
+
+    assert list(out["placa"]) == ["AAA", "BBB", "CCC", "DDD", "EEE"]
+    assert list(out["status"]) == ["SUCCESS", "SUCCESS", "UNKNOWN_MODEL", "INVALID_YEAR", "NO_RESULT"]
+    assert list(out["region"][:2]) == ["DF", "Nacional"]
+    assert out["avg_price"].tolist()[:2] == [1100.0, 1000.0]
+    assert list(out["samples_count"]) == [2, 30, 0, 0, 0]
+    assert out["model_id"].tolist() == [11, 11, pd.NA, 11, 10]
+
+    # Todas as linhas válidas em uma única busca set-based e um único log
+    assert len(fake_repo.latest_calls) == 1
+    assert fake_repo.log_counts == [(3, 2)]
+
+
+def test_value_inventory_rejects_fractional_years_without_dtype_warnings(service, fake_repo):
+    fake_repo._latest = {(11, 2024, "Nacional"): DummyLatestPrice(11, 2024, "Nacional", "2026-02", 1000.0, 30)}
+    csv = io.StringIO(
+        "marca,modelo,ano,regiao\n"
+        "Ford,Ka,2022.9,\n"
+        "Ford,Ka,2024,nacional\n"
+        "Ford,Ka,2024,\n"
+    )
+
+    with warnings.catch_warnings():
+        # Downcast no replace / dtype incompatível no .loc viram erro no pandas 3
+        warnings.simplefilter("error", FutureWarning)
+        out = service.value_inventory(csv, chunksize=1)
+
+    assert list(out["status"]) == ["INVALID_YEAR", "SUCCESS", "SUCCESS"]
+    assert list(out["region"][1:]) == ["Nacional", "Nacional"]
+    assert out["avg_price"].dtype == "float64"
+    assert fake_repo.log_counts == [(2, 2)]
+
+
+def test_value_inventory_rejects_missing_columns(service):
+    with pytest.raises(ValueError, match="ano"):
+        service.value_inventory(io.StringIO("marca,modelo\nFord,Ka\n"))
+
+
+def test_scoped_service_uses_one_session_per_call(monkeypatch):
+    import src.services as services_mod
+
+    sessions = []
+
+    class Session:
+        closed = False
+
+        def rollback(self):
+            pass
+
+        def close(self):
+            self.closed = True
+
+    def session_factory():
+        sessions.append(Session())
+        return sessions[-1]
+
+    repo = FakeRepo()
+
+    class StubCarService(CarService):
+        def __init__(self, db, log_sink=None, cache=None):
+            assert db is sessions[-1]
+            self.repository = repo
+
+    monkeypatch.setattr(services_mod, "CarService", StubCarService)
+    scoped = services_mod.ScopedCarService(session_factory)
+
+    assert scoped.list_brands() == {"Fiat": 1, "Ford": 2}
+    assert scoped.list_years(11) == [2024, 2023, 2022]
+
+    assert len(sessions) == 2
+    assert all(s.closed for s in sessions)
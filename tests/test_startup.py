@@ -0,0 +1,89 @@
+"""
+Benchmark de cold start: tempo de import da camada de serviço e tempo até o
+primeiro render da landing page, cada um em um processo Python novo (para
+que módulos já carregados por outros testes não mascarem o resultado).
+
+Os tempos vão para o relatório do pytest (record_property / --junitxml) e
+falham acima do orçamento, ajustável por CARFLOW_IMPORT_BUDGET_S e
+CARFLOW_FIRST_RENDER_BUDGET_S em máquinas mais lentas.
+"""
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+IMPORT_BUDGET_S = float(os.getenv("CARFLOW_IMPORT_BUDGET_S", "3.0"))
+FIRST_RENDER_BUDGET_S = float(os.getenv("CARFLOW_FIRST_RENDER_BUDGET_S", "10.0"))
+
+# Módulos que só devem ser carregados quando há gráfico/DataFrame
+HEAVY_MODULES = ("pandas", "plotly.express")
+
+IMPORT_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import src.services
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+FIRST_RENDER_SCRIPT = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+
+import src.services as services_mod
+
+
+class LandingService:
+    def list_brands(self):
+        return {}
+
+    def list_regions(self):
+        return []
+
+
+services_mod.ScopedCarService = lambda *a, **k: LandingService()
+
+started = time.perf_counter()
+at = AppTest.from_file("src/main.py").run()
+elapsed = time.perf_counter() - started
+print(json.dumps({
+    "seconds": elapsed,
+    "exceptions": [str(e.value) for e in at.exception],
+    "loaded": [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def _run_fresh(script, database_path):
+    # Banco SQLite vazio: o cold start inclui migração e verificação de prontidão
+    env = dict(os.environ, PYTHONPATH=str(PROJECT_ROOT), DATABASE_URL=f"sqlite:///{database_path}")
+    out = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, timeout=120, check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def test_service_import_is_light(record_property, tmp_path):
+    result = _run_fresh(IMPORT_SCRIPT, tmp_path / "carflow.db")
+    record_property("import_seconds", round(result["seconds"], 3))
+
+    assert result["loaded"] == []
+    assert result["seconds"] < IMPORT_BUDGET_S
+
+
+def test_landing_page_first_render(record_property, tmp_path):
+    pytest.importorskip("streamlit.testing.v1", reason="streamlit.testing.v1 não disponível (atualize streamlit)")
+
+    result = _run_fresh(FIRST_RENDER_SCRIPT, tmp_path / "carflow.db")
+    record_property("first_render_seconds", round(result["seconds"], 3))
+
+    assert result["exceptions"] == []
+    # Landing page não tem gráfico: nada de pandas/plotly
+    assert result["loaded"] == []
+    assert result["seconds"] < FIRST_RENDER_BUDGET_S